@@ -42,11 +42,13 @@ class FrameSense:
         )
         
         parser.add_argument("operator", help="operator to apply", choices=actions.keys())
+        parser.add_argument("stages", nargs='*', help="operators chained by the pipeline operator", metavar='OPERATOR')
         parser.add_argument("-f", "--filter", help="filter paths", default='')
         parser.add_argument("-v", "--verbose", action='store_true', help="enable verbose output")
         parser.add_argument("-r", "--redo", action='store_true', help="redo")
         parser.add_argument("-n", "--dry-run", action='store_true', help="perform a trial run with no changes made")
         parser.add_argument("-s", "--serve", help="run an operator as a service over a collection", metavar='COLLECTION')
+        parser.add_argument("-j", "--jobs", type=int, help="number of items processed in parallel (at least 1)", metavar='N')
        
         args = parser.parse_args()
         self.args = args
@@ -19,28 +19,61 @@ class AnswerFramesVLM(Operator):
 
         for col in self.context['collections']:
             collection_path = col['attributes']['path']
-            for frames_folder_path in sorted(collection_path.glob('**/shots/*/')):
-                self._question_frames(frames_folder_path, collection_path)
+            self._question_shots(self._get_shot_folder_paths(col), collection_path)
 
         return ret
 
-    def _question_frames(self, frames_folder_path: Path, collection_path: Path):
+    def _process_clip(self, clip_path: Path, collection_path: Path):
+        self._question_shots(sorted(clip_path.parent.glob('shots/*/')), collection_path)
+
+    def _question_shots(self, frames_folder_paths: [Path], collection_path: Path):
+        '''Sends the questions about the frames of many shots at once
+        to keep the inference platform busy (see `concurrency` param).
+        The answers are written back into each shot's frames.json, in order.'''
+        # enough requests to keep all the slots of the platform busy
+        window_size = max(1, int(self.get_param('concurrency') or 1)) * 4
+
+        shots = []
+        pending_count = 0
+        for frames_folder_path in frames_folder_paths:
+            shot = self._get_pending_questions(frames_folder_path)
+            if not shot['requests']:
+                continue
+            shots.append(shot)
+            pending_count += len(shot['requests'])
+            if pending_count >= window_size:
+                self._answer_shots(shots)
+                shots = []
+                pending_count = 0
+
+        self._answer_shots(shots)
+
+    def _get_pending_questions(self, frames_folder_path: Path) -> dict:
+        '''Returns the content of the frames.json of a shot
+        and the requests for the questions not yet answered.'''
         frames_meta_path = Path(frames_folder_path / 'frames.json')
         frames_meta_content = self._read_data_file(frames_meta_path, is_data_dict=True)
         frames_data = frames_meta_content['data']
+
+        ret = {
+            'path': frames_meta_path,
+            'content': frames_meta_content,
+            'requests': [],
+        }
         
         template = self.get_param('prompt_template')
         questions = self.get_param('questions')
+        is_cached = self._get_content_cache() is not None
 
         frame_file_paths = list(frames_folder_path.glob('*.jpg'))
 
-        has_changed = False
         for frame_file_path in frame_file_paths:
             if self.get_param('frame_filter') not in str(frame_file_path):
                 continue
 
             if not self._is_path_selected(frame_file_path):
-                return
+                ret['requests'] = []
+                return ret
 
             frame_id = re.sub(r'^(\d+).*$', r'\1', frame_file_path.name)
             frame_data = frames_data.get(frame_id, None)
@@ -48,6 +81,8 @@ class AnswerFramesVLM(Operator):
                 frame_data = {}
                 frames_data[frame_id] = frame_data
 
+            image_hash = None
+
             for question_key, question in questions.items():
                 prompt = template
                 prompt = prompt.replace('{question}', question['question'])
@@ -67,38 +102,79 @@ class AnswerFramesVLM(Operator):
                     # we already got that answer, skip
                     continue
 
-                # pass the prompt to the container
-                self.set_param('prompt', prompt)
-
                 prompt_length = len(re.findall(r'\w+', prompt))
                 self._log(f'{frame_file_path} (question: {question_key}; words in prompt: {prompt_length})')
 
-                answer = '[]'
-                # this condition is important b/c:
-                # qwen will hallucinate if transcription is empty;
-                # also saves time;
-                
-                response = self.send_prompt_to_openai_api_from_params(image_path=frame_file_path)
+                cache_key = None
+                if is_cached:
+                    if image_hash is None:
+                        image_hash = self._get_content_hash(frame_file_path)
+                    cache_key = self._get_answer_cache_key(image_hash, prompt, ['context_length', 'think'])
 
-                if response['error']:
-                    self._error(f'Unexpected error from the LLM inferrence platform ({response["error"]})')
+                ret['requests'].append({
+                    'image_path': frame_file_path,
+                    'prompt': prompt,
+                    'prompt_hash': prompt_hash,
+                    'question_key': question_key,
+                    'frame_data': frame_data,
+                    'cache_key': cache_key,
+                })
 
-                # print(response)
-                answer = response['result']
+        return ret
 
-                frame_data[question_key] = {
-                    'value': self._parse_dirty_json(answer),
+    def _answer_shots(self, shots: [dict]):
+        requests = [
+            request
+            for shot in shots
+            for request in shot['requests']
+        ]
+        if not requests:
+            return
+
+        # the same question about identical frames (e.g. overlapping clips)
+        # is answered from the content cache, or asked only once
+        cached_answers = self._get_cached_answers([r['cache_key'] for r in requests if r['cache_key']])
+        # cache key (or position) => request sent to the platform
+        missing_requests = {}
+        for i, request in enumerate(requests):
+            key = request['cache_key'] or i
+            if key not in cached_answers and key not in missing_requests:
+                missing_requests[key] = request
+
+        responses = dict(zip(missing_requests.keys(), self._dispatch_prompts(list(missing_requests.values()))))
+        self._cache_answers({
+            key: response['result']
+            for key, response in responses.items()
+            if isinstance(key, str) and not response['error']
+        })
+        for key, answer in cached_answers.items():
+            responses[key] = {'error': '', 'result': answer}
+
+        error = ''
+        i = 0
+        for shot in shots:
+            for request in shot['requests']:
+                response = responses[request['cache_key'] or i]
+                i += 1
+                if response['error']:
+                    error = error or response['error']
+                    continue
+
+                request['frame_data'][request['question_key']] = {
+                    'value': self._parse_dirty_json(response['result']),
                     'operator': self._get_operator_name(),
                     'model': self.get_param('model'),
                     # 'context_length': self.get_param('context_length'),
                     'seed': self.get_param('seed'),
                     'updated': datetime.datetime.now(datetime.timezone.utc).isoformat(),
-                    'prompt_hash': prompt_hash,
+                    'prompt_hash': request['prompt_hash'],
                 }
-                has_changed = True
-                
-        if has_changed:
-            self._write_data_file(frames_meta_path, frames_meta_content)
+
+            # save the answers received so far, even if some failed
+            self._write_data_file(shot['path'], shot['content'])
+
+        if error:
+            self._error(f'Unexpected error from the LLM inferrence platform ({error})')
 
     def short_hash(self, s, length=8):
         hash_object = hashlib.sha256(s.encode('utf-8'))
@@ -19,16 +19,16 @@ class AnswerTranscriptionOllama(Operator):
 
         for col in self.context['collections']:
             collection_path = col['attributes']['path']
-            for video_folder_path in col['attributes']['path'].iterdir():
-                if video_folder_path.is_dir():
-                    for clip_folder_path in video_folder_path.iterdir():
-                        if clip_folder_path.is_dir():
-                            clip_path = self._get_video_file_path(clip_folder_path)
-                            if clip_path:
-                                self._question_transcription(clip_path, collection_path)
+            for clip_folder_path in self._get_clip_folder_paths(col):
+                clip_path = self._get_video_file_path(clip_folder_path)
+                if clip_path:
+                    self._question_transcription(clip_path, collection_path)
 
         return ret
 
+    def _process_clip(self, clip_path: Path, collection_path: Path):
+        self._question_transcription(clip_path, collection_path)
+
     def _question_transcription(self, clip_path: Path, collection_path: Path):
         transcription_path = clip_path.parent / 'transcription.json'
 
@@ -47,6 +47,9 @@ class AnswerTranscriptionOllama(Operator):
         template = self.get_param('prompt_template')
         questions = self.get_param('questions')
 
+        is_cached = self._get_content_cache() is not None
+        transcription_hash = None
+
         transcription = self.read_json(transcription_path)
         transcription_srt = '\n'.join([
             f'{self.get_hhmmss(item["start"])} {item["segment"]}'
@@ -73,17 +76,27 @@ class AnswerTranscriptionOllama(Operator):
                 # we already got that answer, skip
                 continue
 
-            # pass the prompt to the container
-            self.set_param('prompt', prompt)
-
             prompt_length = len(re.findall(r'\w+', prompt))
             self._log(f'{transcription_path} (question: {question_key}; words in prompt: {prompt_length})')
 
+            # the same transcription (e.g. of an identical clip) may have been asked the same question
+            cache_key = None
+            if is_cached:
+                if transcription_hash is None:
+                    transcription_hash = self._get_content_hash(transcription_path)
+                cache_key = self._get_answer_cache_key(transcription_hash, prompt, ['context_length', 'think'])
+            cached_answers = self._get_cached_answers([cache_key]) if cache_key else {}
+
             answer = '[]'
+            if cache_key in cached_answers:
+                answer = cached_answers[cache_key]
             # this condition is important b/c:
             # qwen will hallucinate if transcription is empty;
             # also saves time;
-            if re.findall(r'\w', transcription_srt):
+            elif re.findall(r'\w', transcription_srt):
+                # pass the prompt to the container
+                self.set_param('prompt', prompt)
+
                 binding = [clip_path.parent, Path('/data')]
                 command_args = [
                     'python', 
@@ -94,6 +107,8 @@ class AnswerTranscriptionOllama(Operator):
                 response = json.loads(res.stdout)
                 # TODO: check for errors
                 answer = response['result']
+                if cache_key and not response.get('error', ''):
+                    self._cache_answers({cache_key: answer})
 
             answers[question_key] = {
                 'answer': self._parse_dirty_json(answer),
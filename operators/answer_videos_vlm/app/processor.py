@@ -7,6 +7,7 @@ from flask import Flask, request, jsonify
 from transformers import Qwen3VLForConditionalGeneration, Qwen3VLMoeForConditionalGeneration, AutoProcessor
 import signal
 import os
+import threading
 # from qwen_vl_utils import process_vision_info
 from datetime import datetime
 
@@ -77,6 +78,8 @@ class VQA:
         print('Create processor')
         
         self.processor = AutoProcessor.from_pretrained(MODEL)
+        # the service handles requests in parallel threads but the model isn't thread-safe
+        self.lock = threading.Lock()
 
         # device_name = torch.cuda.get_device_name(torch.cuda.current_device())
 
@@ -109,14 +112,15 @@ class VQA:
         inputs = inputs.to(self.model.device)
 
         # Inference: Generation of the output
-        generated_ids = self.model.generate(
-            **inputs,
-            max_new_tokens=int(PARAMS['max_new_tokens']),
-            temperature=0.7,
-            top_k=20,
-            top_p=0.8,
-            #seed=3407,
-        )
+        with self.lock:
+            generated_ids = self.model.generate(
+                **inputs,
+                max_new_tokens=int(PARAMS['max_new_tokens']),
+                temperature=0.7,
+                top_k=20,
+                top_p=0.8,
+                #seed=3407,
+            )
         # generated_ids = model.generate(**inputs, max_new_tokens=MAX_NEW_TOKENS)
         generated_ids_trimmed = [
             out_ids[len(in_ids) :] for in_ids, out_ids in zip(inputs.input_ids, generated_ids)
@@ -191,7 +195,8 @@ if __name__ == '__main__':
                 # yes... Flask does NOT have a shutdown function.
                 os.kill(os.getpid(), signal.SIGINT)
 
-            app.run(debug=True, host='0.0.0.0', port=PORT)
+            # e.g. serve 5001, when another service already listens on the default port
+            app.run(debug=True, host='0.0.0.0', port=int(arguments[2]) if len(arguments) > 2 else PORT)
         elif first_arg == 'load_model':
             response = {
                 'error': '',
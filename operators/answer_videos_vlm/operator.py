@@ -19,7 +19,7 @@ class AnswerVideosVLM(Operator):
 
         for col in self.context['collections']:
             collection_path = col['attributes']['path']
-            for video_folder_path in collection_path.iterdir():
+            for video_folder_path in self._get_video_folder_paths(col):
                 video_path = self._get_video_file_path(video_folder_path, direct_child_only=True)
                 if video_path is None: 
                     continue
@@ -38,6 +38,8 @@ class AnswerVideosVLM(Operator):
 
         template = self.get_param('prompt_template')
         questions = self.get_param('questions')
+        is_cached = self._get_content_cache() is not None
+        video_hash = None
 
         for question_key, question in questions.items():
             prompt = template
@@ -57,15 +59,30 @@ class AnswerVideosVLM(Operator):
                 # we already got that answer, skip
                 continue
 
-            # pass the prompt to the container
-            self.set_param('prompt', prompt)
-
             prompt_length = len(re.findall(r'\w+', prompt))
             self._log(f'{video_path} (question: {question_key}; words in prompt: {prompt_length})')
 
-            response = self._call_service_processor(video_path, collection_path)
-            if response['error']:
-                self._error(response['error'])
+            # an identical video (e.g. a copy in another collection) may have been asked the same question
+            cache_key = None
+            if is_cached:
+                if video_hash is None:
+                    # once per video, and sampled: reading a whole film would cost more than a cache hit saves
+                    video_hash = self._get_content_hash(video_path, sampled=True)
+                cache_key = self._get_answer_cache_key(video_hash, prompt, ['max_new_tokens'])
+
+            cached_answers = self._get_cached_answers([cache_key]) if cache_key else {}
+            if cache_key in cached_answers:
+                response = {'error': '', 'result': cached_answers[cache_key]}
+            else:
+                # pass the prompt to the container
+                self.set_param('prompt', prompt)
+
+                response = self._call_service_processor(video_path, collection_path)
+                if response['error']:
+                    self._error(response['error'])
+
+                if cache_key:
+                    self._cache_answers({cache_key: response['result']})
 
             answer = response['result']
 
@@ -0,0 +1,202 @@
+import sqlite3
+import threading
+import time
+from pathlib import Path
+
+# proportion of the size cap kept after an eviction,
+# so the next insertions don't trigger another one straight away
+EVICTION_TARGET_RATIO = 0.9
+
+
+class ContentCache:
+    '''Results of the models indexed by the content of their inputs,
+    in a SQLite database shared by all the collections.
+
+    Each entry belongs to a namespace (e.g. 'embedding')
+    and is identified by a key derived from a hash of the input content
+    and everything else that affects the result (e.g. the model).
+    So an identical input (e.g. the same frame in two overlapping clips,
+    or a collection which has been moved) gets the cached result
+    rather than being processed again.
+
+    Values are bytes, serialised by the caller.
+    When the total size of the values exceeds max_size (in bytes),
+    the least recently used entries are evicted.
+    The total size is kept in the meta table, 
+    updated in the same transaction as the entries.
+
+    The number of hits and misses of the lookups are counted per namespace,
+    since the creation of the database and by this process.
+    '''
+
+    def __init__(self, database_path: Path, max_size: int):
+        self.database_path = database_path
+        self.max_size = max_size
+        self.lock = threading.RLock()
+        # default journal mode, WAL doesn't work on network file systems
+        self.connection = sqlite3.connect(str(database_path), check_same_thread=False)
+        self.connection.executescript('''
+            CREATE TABLE IF NOT EXISTS entries (
+                namespace TEXT NOT NULL,
+                key TEXT NOT NULL,
+                value BLOB NOT NULL,
+                size INTEGER NOT NULL,
+                accessed REAL NOT NULL,
+                PRIMARY KEY (namespace, key)
+            );
+            CREATE INDEX IF NOT EXISTS entries_accessed ON entries (accessed);
+            CREATE TABLE IF NOT EXISTS stats (
+                namespace TEXT PRIMARY KEY,
+                hits INTEGER NOT NULL,
+                misses INTEGER NOT NULL
+            );
+            CREATE TABLE IF NOT EXISTS meta (
+                name TEXT PRIMARY KEY,
+                value INTEGER NOT NULL
+            );
+            -- total size of the values, only summed when the table is created
+            INSERT OR IGNORE INTO meta (name, value) 
+                SELECT 'size', COALESCE(SUM(size), 0) FROM entries;
+        ''')
+        self.connection.commit()
+        # {namespace: [hits, misses]} of the lookups by this process
+        self.session_stats = {}
+
+    def get_many(self, namespace: str, keys: [str]) -> dict:
+        '''Returns {key: value} for the keys found in the cache.'''
+        ret = {}
+
+        keys = list(set(keys))
+        with self.lock:
+            # stay below the maximum number of variables in a sqlite query
+            for i in range(0, len(keys), 500):
+                chunk = keys[i:i + 500]
+                rows = self.connection.execute(
+                    f'SELECT key, value FROM entries WHERE namespace = ? AND key IN ({",".join("?" * len(chunk))})',
+                    [namespace] + chunk
+                ).fetchall()
+                ret.update({row[0]: row[1] for row in rows})
+
+            if ret:
+                now = time.time()
+                self.connection.executemany(
+                    'UPDATE entries SET accessed = ? WHERE namespace = ? AND key = ?',
+                    [(now, namespace, key) for key in ret]
+                )
+            self._count_lookups(namespace, len(ret), len(keys) - len(ret))
+            self.connection.commit()
+
+        return ret
+
+    def set_many(self, namespace: str, values: dict):
+        '''Adds or replaces {key: value} in the cache,
+        then evicts the least recently used entries if the cache is too large.'''
+        if not values:
+            return
+
+        now = time.time()
+        with self.lock:
+            # the total size can't be changed by another process in the meantime
+            self.connection.execute('BEGIN IMMEDIATE')
+            try:
+                # minus the size of the values replaced
+                self.connection.executemany('''
+                    UPDATE meta SET value = value + ? - COALESCE(
+                        (SELECT size FROM entries WHERE namespace = ? AND key = ?), 0
+                    ) WHERE name = 'size'
+                ''', [
+                    (len(value), namespace, key)
+                    for key, value in values.items()
+                ])
+                self.connection.executemany('''
+                    INSERT INTO entries (namespace, key, value, size, accessed)
+                    VALUES (?, ?, ?, ?, ?)
+                    ON CONFLICT (namespace, key) DO UPDATE SET
+                        value = excluded.value, size = excluded.size, accessed = excluded.accessed
+                ''', [
+                    (namespace, key, sqlite3.Binary(value), len(value), now)
+                    for key, value in values.items()
+                ])
+                self._evict()
+                self.connection.commit()
+            except BaseException as e:
+                self.connection.rollback()
+                raise e
+
+    def get(self, namespace: str, key: str) -> bytes:
+        '''Returns the value of a key, None if not in the cache.'''
+        return self.get_many(namespace, [key]).get(key, None)
+
+    def set(self, namespace: str, key: str, value: bytes):
+        self.set_many(namespace, {key: value})
+
+    def get_stats(self, namespace: str) -> dict:
+        '''Returns the number of hits and misses of the lookups in a namespace,
+        in total and by this process, and the number of entries.'''
+        with self.lock:
+            row = self.connection.execute(
+                'SELECT hits, misses FROM stats WHERE namespace = ?', (namespace,)
+            ).fetchone() or [0, 0]
+            entries = self.connection.execute(
+                'SELECT COUNT(*) FROM entries WHERE namespace = ?', (namespace,)
+            ).fetchone()[0]
+            session_stats = self.session_stats.get(namespace, [0, 0])
+
+        return {
+            'hits': row[0],
+            'misses': row[1],
+            'session_hits': session_stats[0],
+            'session_misses': session_stats[1],
+            'entries': entries,
+        }
+
+    def get_session_namespaces(self) -> [str]:
+        '''Returns the namespaces looked up by this process.'''
+        with self.lock:
+            return list(self.session_stats.keys())
+
+    def _count_lookups(self, namespace: str, hits: int, misses: int):
+        session_stats = self.session_stats.setdefault(namespace, [0, 0])
+        session_stats[0] += hits
+        session_stats[1] += misses
+        self.connection.execute('''
+            INSERT INTO stats (namespace, hits, misses) VALUES (?, ?, ?)
+            ON CONFLICT (namespace) DO UPDATE SET
+                hits = hits + excluded.hits, misses = misses + excluded.misses
+        ''', (namespace, hits, misses))
+
+    def get_size(self) -> int:
+        '''Returns the total size of the values, in bytes.'''
+        with self.lock:
+            return self.connection.execute("SELECT value FROM meta WHERE name = 'size'").fetchone()[0]
+
+    def _evict(self):
+        '''Deletes the least recently used entries if the cache is too large,
+        within the transaction of the caller.'''
+        size = self.get_size()
+        if size <= self.max_size:
+            return
+
+        # delete the least recently used entries until the size is below the target
+        excess = size - int(self.max_size * EVICTION_TARGET_RATIO)
+        self.connection.execute('''
+            CREATE TEMP TABLE IF NOT EXISTS evicted (id INTEGER PRIMARY KEY, size INTEGER NOT NULL)
+        ''')
+        self.connection.execute('''
+            INSERT INTO evicted (id, size)
+            SELECT rowid, size FROM (
+                SELECT rowid, size, SUM(size) OVER (ORDER BY accessed, rowid) AS cumulated_size
+                FROM entries
+            )
+            WHERE cumulated_size - size < ?
+        ''', (excess,))
+        self.connection.execute('DELETE FROM entries WHERE rowid IN (SELECT id FROM evicted)')
+        self.connection.execute('''
+            UPDATE meta SET value = value - (SELECT COALESCE(SUM(size), 0) FROM evicted) 
+            WHERE name = 'size'
+        ''')
+        self.connection.execute('DELETE FROM evicted')
+
+    def close(self):
+        with self.lock:
+            self.connection.close()
@@ -0,0 +1,167 @@
+import threading
+import fcntl
+import json
+from pathlib import Path
+import numpy as np
+
+
+class EmbeddingStore:
+    '''Binary store of the vectors computed by one model over a collection.
+
+    The store is a folder with three files:
+    * meta.json: model, dimension and type of the vectors;
+    * vectors.f16: all the vectors, one row after the other, as raw float16;
+    * keys.tsv: one line per row, `row<TAB>key`, where key identifies the input
+        (e.g. the path of a frame relative to the collection).
+
+    Both vectors.f16 and keys.tsv are append-only,
+    so new vectors can be added incrementally without rewriting the store.
+    When a key is added again (e.g. redo), the last row wins.
+    Processes appending to the same store take turns with a lock on a `.lock` file,
+    the rows added by the others are counted from the size of vectors.f16.
+
+    The vectors can be read without copy (memory-mapped) with get_matrix().
+    '''
+
+    DTYPE = np.float16
+
+    def __init__(self, folder_path: Path, model=''):
+        self.folder_path = Path(folder_path)
+        self.model = model
+        self.lock = threading.RLock()
+        self.meta_path = self.folder_path / 'meta.json'
+        self.vectors_path = self.folder_path / 'vectors.f16'
+        self.keys_path = self.folder_path / 'keys.tsv'
+        self.lock_path = self.folder_path / '.lock'
+
+        self.dimension = None
+        self.rows = {}
+        self.row_count = 0
+        self.matrix = None
+
+        self._load()
+
+    def _load(self):
+        self._load_meta()
+
+        if not self.dimension or not self.vectors_path.exists():
+            return
+
+        self._count_rows()
+
+        if self.keys_path.exists():
+            with open(self.keys_path, 'r', encoding='utf-8') as fh:
+                for line in fh:
+                    if not line.endswith('\n'):
+                        # incomplete line left by an interrupted write
+                        break
+                    row, key = line.rstrip('\n').split('\t', 1)
+                    row = int(row)
+                    if row < self.row_count:
+                        self.rows[key] = row
+
+    def _load_meta(self):
+        if self.meta_path.exists():
+            meta = json.loads(self.meta_path.read_text())
+            self.dimension = meta['dimension']
+            self.model = self.model or meta.get('model', '')
+
+    def _count_rows(self):
+        '''Sets row_count from the size of vectors.f16,
+        which includes the rows appended by other processes.'''
+        self.row_count = 0
+        if not self.vectors_path.exists():
+            return
+
+        row_size = self.dimension * np.dtype(self.DTYPE).itemsize
+        size = self.vectors_path.stat().st_size
+        self.row_count = size // row_size
+        if size % row_size:
+            # incomplete row left by an interrupted write
+            with open(self.vectors_path, 'r+b') as fh:
+                fh.truncate(self.row_count * row_size)
+
+    def add(self, keys: [str], vectors) -> [int]:
+        '''Appends vectors (one per key) to the store.
+        Returns their row numbers.'''
+        ret = []
+
+        vectors = np.asarray(vectors, dtype=self.DTYPE)
+        if vectors.ndim == 1:
+            vectors = vectors.reshape(1, -1)
+        if len(keys) != len(vectors):
+            raise ValueError(f'{len(keys)} keys for {len(vectors)} vectors')
+        if not len(keys):
+            return ret
+
+        with self.lock:
+            self.folder_path.mkdir(parents=True, exist_ok=True)
+            with open(self.lock_path, 'a') as lock_file:
+                # released when the file is closed
+                fcntl.flock(lock_file, fcntl.LOCK_EX)
+
+                if self.dimension is None:
+                    # the store may have been created by another process in the meantime
+                    self._load_meta()
+                if self.dimension is None:
+                    self.dimension = int(vectors.shape[1])
+                    self.meta_path.write_text(json.dumps({
+                        'model': self.model,
+                        'dimension': self.dimension,
+                        'dtype': np.dtype(self.DTYPE).name,
+                    }, indent=2))
+                elif vectors.shape[1] != self.dimension:
+                    raise ValueError(f'vectors of dimension {vectors.shape[1]} added to a store of dimension {self.dimension} ({self.folder_path})')
+
+                # rows appended by other processes since the last time
+                self._count_rows()
+
+                # vectors are written before their keys,
+                # so a key never points to a missing vector.
+                with open(self.vectors_path, 'ab') as fh:
+                    fh.write(vectors.tobytes())
+
+                ret = list(range(self.row_count, self.row_count + len(keys)))
+                with open(self.keys_path, 'a', encoding='utf-8') as fh:
+                    fh.write(''.join(f'{row}\t{key}\n' for row, key in zip(ret, keys)))
+
+            for row, key in zip(ret, keys):
+                self.rows[key] = row
+            self.row_count += len(keys)
+            self.matrix = None
+
+        return ret
+
+    def get_matrix(self):
+        '''Returns all the rows of the store as a read-only memory-mapped matrix
+        (rows x dimension). Rows replaced by a later vector with the same key
+        are still in the matrix, use get_index() to find the current ones.'''
+        with self.lock:
+            if self.matrix is None:
+                if not self.row_count:
+                    self.matrix = np.zeros((0, self.dimension or 0), dtype=self.DTYPE)
+                else:
+                    self.matrix = np.memmap(self.vectors_path, dtype=self.DTYPE, mode='r', shape=(self.row_count, self.dimension))
+            ret = self.matrix
+        return ret
+
+    def get_index(self) -> dict:
+        '''Returns the current row of each key.'''
+        with self.lock:
+            ret = dict(self.rows)
+        return ret
+
+    def get(self, key: str):
+        '''Returns the vector of a key (a view on the memory-mapped matrix),
+        None if not found.'''
+        ret = None
+        row = self.rows.get(key, None)
+        if row is not None:
+            ret = self.get_matrix()[row]
+        return ret
+
+    def __contains__(self, key):
+        return key in self.rows
+
+    def __len__(self):
+        return len(self.rows)
@@ -0,0 +1,244 @@
+import sqlite3
+import threading
+import os
+from pathlib import Path
+
+
+class Manifest:
+    '''Index of all the folders and files under the collections,
+    stored in a SQLite database next to collections.json.
+
+    Listing the content of a collection from the manifest
+    is much faster than walking the file system,
+    especially over networked file systems (e.g. NFS).
+
+    The manifest is updated incrementally by refresh().
+    A folder which modification time hasn't changed since the last refresh
+    still has the same entries, so it is not listed again.
+    Note that a file rewritten in place doesn't change the modification time
+    of its folder, so its recorded size and mtime can be out of date.
+    Hence update_folder() after writing into a folder
+    and get_file_entries(restat=True) when the size or mtime matter.
+
+    Hidden folders (e.g. .framesense, where operators keep their indices)
+    are not part of the collection hierarchy and are left out.
+
+    Depth of an entry is relative to its collection folder:
+    1: video folder, 2: clip folder or video file,
+    3: clip file or `shots` folder, 4: shot folder, 5: shot file (e.g. frame).
+    '''
+
+    def __init__(self, database_path: Path):
+        self.database_path = database_path
+        # the same manifest can be used by concurrent work units
+        self.lock = threading.RLock()
+        # default journal mode, WAL doesn't work on network file systems
+        self.connection = sqlite3.connect(str(database_path), check_same_thread=False)
+        self.connection.executescript('''
+            CREATE TABLE IF NOT EXISTS entries (
+                path TEXT PRIMARY KEY,
+                parent TEXT NOT NULL,
+                collection TEXT NOT NULL,
+                depth INTEGER NOT NULL,
+                is_dir INTEGER NOT NULL,
+                size INTEGER NOT NULL,
+                mtime REAL NOT NULL
+            );
+            CREATE INDEX IF NOT EXISTS entries_parent ON entries (parent);
+            CREATE INDEX IF NOT EXISTS entries_collection ON entries (collection, depth);
+        ''')
+        self.connection.commit()
+        # ids of the collections refreshed by this process
+        self.refreshed = set()
+
+    def refresh(self, collection_id: str, collection_path: Path):
+        '''Brings the manifest of a collection up to date with the file system.
+        Returns the number of folders which had to be listed again.'''
+        ret = 0
+
+        collection_path = Path(collection_path)
+
+        with self.lock:
+            if not collection_path.is_dir():
+                self._delete_tree(str(collection_path), True)
+            else:
+                ret = self._refresh_folder(collection_id, collection_path, str(collection_path.parent), 0)
+            self.connection.commit()
+            self.refreshed.add(collection_id)
+
+        return ret
+
+    def is_refreshed(self, collection_id: str):
+        return collection_id in self.refreshed
+
+    def update_folder(self, collection_id: str, collection_path: Path, folder_path: Path):
+        '''Lists a folder again after files have been written into it,
+        even if its modification time hasn't changed
+        (file rewritten in place, or within the resolution of the clock).
+        A folder which isn't recorded yet is added by listing its parent.'''
+        collection_path = Path(collection_path)
+        folder_path = Path(folder_path)
+
+        with self.lock:
+            while folder_path != collection_path and folder_path.is_relative_to(collection_path) and not self.has_folder(folder_path):
+                folder_path = folder_path.parent
+
+            # listed again by the next refresh, even if its mtime is the same
+            self.connection.execute(
+                'UPDATE entries SET mtime = -1 WHERE path = ? AND is_dir = 1', (str(folder_path),)
+            )
+            if self.is_refreshed(collection_id) and folder_path.is_relative_to(collection_path):
+                depth = len(folder_path.relative_to(collection_path).parts)
+                self._refresh_folder(collection_id, folder_path, str(folder_path.parent), depth)
+            self.connection.commit()
+
+    def _refresh_folder(self, collection_id, folder_path: Path, parent: str, depth: int):
+        ret = 0
+
+        path = str(folder_path)
+
+        try:
+            stat = folder_path.stat()
+        except FileNotFoundError:
+            self._delete_tree(path)
+            return ret
+
+        row = self.connection.execute(
+            'SELECT mtime FROM entries WHERE path = ? AND is_dir = 1', (path,)
+        ).fetchone()
+
+        if row and row[0] == stat.st_mtime:
+            # same entries as last time, no need to list the folder
+            sub_folder_paths = [
+                Path(r[0]) for r in self.connection.execute(
+                    'SELECT path FROM entries WHERE parent = ? AND is_dir = 1', (path,)
+                )
+            ]
+        else:
+            ret += 1
+            self._upsert(path, parent, collection_id, depth, True, 0, stat.st_mtime)
+
+            recorded_paths = set(
+                r[0] for r in self.connection.execute(
+                    'SELECT path FROM entries WHERE parent = ?', (path,)
+                )
+            )
+
+            sub_folder_paths = []
+            with os.scandir(folder_path) as entries:
+                for entry in entries:
+                    is_dir = entry.is_dir()
+                    if is_dir and entry.name.startswith('.'):
+                        continue
+                    if is_dir:
+                        # mtime set when the sub-folder is refreshed
+                        sub_folder_paths.append(Path(entry.path))
+                    else:
+                        entry_stat = entry.stat()
+                        self._upsert(entry.path, path, collection_id, depth + 1, False, entry_stat.st_size, entry_stat.st_mtime)
+                    recorded_paths.discard(entry.path)
+
+            # entries removed from the file system since last refresh
+            for removed_path in recorded_paths:
+                self._delete_tree(removed_path)
+
+        for sub_folder_path in sub_folder_paths:
+            ret += self._refresh_folder(collection_id, sub_folder_path, path, depth + 1)
+
+        return ret
+
+    def _upsert(self, path, parent, collection_id, depth, is_dir, size, mtime):
+        self.connection.execute('''
+            INSERT INTO entries (path, parent, collection, depth, is_dir, size, mtime)
+            VALUES (?, ?, ?, ?, ?, ?, ?)
+            ON CONFLICT (path) DO UPDATE SET
+                parent = excluded.parent, collection = excluded.collection, depth = excluded.depth,
+                is_dir = excluded.is_dir, size = excluded.size, mtime = excluded.mtime
+        ''', (path, parent, collection_id, depth, int(is_dir), size, mtime))
+
+    def _delete_tree(self, path: str, descendants_only=False):
+        # '/' + 1 == '0', so this range covers all paths under path/
+        self.connection.execute(
+            'DELETE FROM entries WHERE path >= ? AND path < ?', (path + '/', path + '0')
+        )
+        if not descendants_only:
+            self.connection.execute('DELETE FROM entries WHERE path = ?', (path,))
+
+    def has_folder(self, folder_path: Path):
+        with self.lock:
+            row = self.connection.execute(
+                'SELECT 1 FROM entries WHERE path = ? AND is_dir = 1', (str(folder_path),)
+            ).fetchone()
+        return row is not None
+
+    def get_folder_paths(self, collection_id: str, depth: int, parent_name='') -> [Path]:
+        '''Returns the sorted paths of all folders at the given depth
+        in a collection, optionally only those under a parent with that name
+        (e.g. 'shots').'''
+        query = 'SELECT path FROM entries WHERE collection = ? AND depth = ? AND is_dir = 1'
+        args = [collection_id, depth]
+        if parent_name:
+            query += ' AND parent LIKE ?'
+            args.append(f'%/{parent_name}')
+
+        with self.lock:
+            ret = sorted(Path(r[0]) for r in self.connection.execute(query, args))
+
+        return ret
+
+    def get_file_entries(self, folder_path: Path, direct_child_only=False, suffixes=None, restat=False) -> [dict]:
+        '''Returns the recorded files under a folder,
+        as dictionaries with path, size and mtime keys.
+        suffixes: only files with one of those extensions (e.g. ['.mp4']).
+        restat: reads the size and mtime from the file system
+        (and leaves out the deleted files) rather than trusting the records.'''
+        folder_path = str(folder_path)
+
+        query = 'SELECT path, size, mtime FROM entries WHERE is_dir = 0 '
+        if direct_child_only:
+            query += 'AND parent = ?'
+            args = [folder_path]
+        else:
+            query += 'AND path >= ? AND path < ?'
+            args = [folder_path + '/', folder_path + '0']
+
+        with self.lock:
+            rows = self.connection.execute(query, args).fetchall()
+
+        ret = [
+            {'path': Path(r[0]), 'size': r[1], 'mtime': r[2]}
+            for r in rows
+        ]
+
+        if suffixes:
+            ret = [e for e in ret if e['path'].suffix.lower() in suffixes]
+
+        if restat:
+            ret = self._restat(ret)
+
+        return sorted(ret, key=lambda e: e['path'])
+
+    def _restat(self, entries: [dict]) -> [dict]:
+        ret = []
+
+        with self.lock:
+            for entry in entries:
+                try:
+                    stat = entry['path'].stat()
+                except FileNotFoundError:
+                    self._delete_tree(str(entry['path']))
+                    continue
+                if (stat.st_size, stat.st_mtime) != (entry['size'], entry['mtime']):
+                    entry = dict(entry, size=stat.st_size, mtime=stat.st_mtime)
+                    self.connection.execute(
+                        'UPDATE entries SET size = ?, mtime = ? WHERE path = ?',
+                        (entry['size'], entry['mtime'], str(entry['path']))
+                    )
+                ret.append(entry)
+            self.connection.commit()
+
+        return ret
+
+    def close(self):
+        with self.lock:
+            self.connection.close()
@@ -8,14 +8,78 @@ import sys
 import os
 import json
 import urllib.request
+import urllib.parse
+import http.client
 import time
 import re
 import http
+import random
+import hashlib
+import csv
 from datetime import datetime
 import shutil
+import tempfile
+import threading
+import socket
+from concurrent.futures import ThreadPoolExecutor
+from .manifest import Manifest
+from .provenance import Provenance
+from .cache import ContentCache
+from .results import Results, DataFileContent, flatten, unflatten
 
 ENGINES = ['docker', 'singularity']
 SERVICE_PORT = 5000
+# default number of inputs sent in one request to a service (see _call_service_processor_batch)
+SERVICE_BATCH_SIZE_DEFAULT = 16
+# default number of requests in flight to a service (FRAMESENSE_SERVICE_CONCURRENCY)
+SERVICE_CONCURRENCY_DEFAULT = 1
+# default time (in seconds) a service has to respond (FRAMESENSE_SERVICE_TIMEOUT)
+SERVICE_TIMEOUT_DEFAULT = 600
+# serialises the start of a service by concurrent work units
+SERVICE_LOCK = threading.RLock()
+
+# serialises log lines printed by concurrent work units (see --jobs)
+LOG_LOCK = threading.Lock()
+# per-thread state, e.g. log lines held back by a running work unit
+THREAD_DATA = threading.local()
+# how long (in seconds) probed host capabilities remain valid on disk
+CAPABILITIES_TTL_DEFAULT = 24 * 60 * 60
+# capabilities of the host probed or read by this process
+HOST_CAPABILITIES = {}
+CAPABILITIES_LOCK = threading.RLock()
+# manifests opened by this process, by database path
+MANIFESTS = {}
+MANIFESTS_LOCK = threading.RLock()
+VIDEO_EXTENSIONS = ['.mp4', '.mkv']
+# provenance databases opened by this process, by database path
+PROVENANCES = {}
+PROVENANCES_LOCK = threading.RLock()
+# content caches opened by this process, by database path
+CONTENT_CACHES = {}
+CONTENT_CACHES_LOCK = threading.RLock()
+# default maximum size (in MB) of the content cache (FRAMESENSE_CONTENT_CACHE_SIZE)
+CONTENT_CACHE_SIZE_DEFAULT = 1024
+# entries of the content cache for the answers of the models to prompts
+ANSWER_CACHE_NAMESPACE = 'answer'
+# parameters of any operator which don't affect the outputs, they only tune the execution
+PROVENANCE_IGNORED_PARAMS = ['batch_size', 'concurrency', 'max_retries', 'requests_per_second']
+# size of each of the three samples (start, middle, end) hashed by FRAMESENSE_FINGERPRINT=hash
+FINGERPRINT_SAMPLE_SIZE = 64 * 1024
+# number of samples of FINGERPRINT_SAMPLE_SIZE bytes hashed by _get_content_hash(sampled=True)
+CONTENT_HASH_SAMPLES = 16
+# sampled content hashes computed by this process, by (path, size, modification time)
+CONTENT_HASHES = {}
+CONTENT_HASHES_LOCK = threading.Lock()
+# results databases opened by this process, by database path
+RESULTS = {}
+RESULTS_LOCK = threading.RLock()
+# hidden folder under each collection where operators keep their stores and indices
+COLLECTION_DATA_FOLDER = '.framesense'
+# embedding stores opened by this process, by folder path
+EMBEDDING_STORES = {}
+EMBEDDING_STORES_LOCK = threading.RLock()
+# HTTP statuses of an inference platform worth retrying (see _dispatch_prompts)
+RETRYABLE_HTTP_STATUSES = [408, 429, 500, 502, 503, 504]
 
 
 class Operator(ABC):
@@ -30,25 +94,32 @@ class Operator(ABC):
             'filter': False,
             'verbose': False,
             'redo': False,
+            'jobs': False,
+            'stages': False,
         }
 
     def get_unsupported_arguments(self):
         ret = []
         for arg_name, is_supported in self.get_supported_arguments().items():
-            if not is_supported and self._get_framesense_argument(arg_name):
+            value = self._get_framesense_argument(arg_name)
+            # set, even to a falsy value like 0 (e.g. -j 0)
+            is_set = not (value is None or value is False or value == '' or value == [])
+            if not is_supported and is_set:
                 ret.append(arg_name)
         return ret
 
     def apply(self):
         self._before_apply()
         
-        collection = self.get_service_collection()
-        if collection:
-            ret = self._serve(collection)
-        else:
-            ret = self._apply()
-        
-        self._after_apply()
+        try:
+            collection = self.get_service_collection()
+            if collection:
+                ret = self._serve(collection)
+            else:
+                ret = self._apply()
+        finally:
+            # also on error, so we don't leave containers running behind
+            self._after_apply()
 
         return ret
 
@@ -63,6 +134,7 @@ class Operator(ABC):
         return ret
 
     def _before_apply(self):
+        self.worker = None
         self.stop_service()
         self._build_container_image()
 
@@ -70,6 +142,9 @@ class Operator(ABC):
         self.display_parameters()
         self._share_parameters_with_container()
 
+        if self._use_worker_container():
+            self._start_worker_container()
+
     def _load_parameters(self):
         ret = {}
 
@@ -123,6 +198,29 @@ class Operator(ABC):
 
     def _after_apply(self):
         self.stop_service()
+        self._stop_worker_container()
+        # the cache is shared by the stages of a pipeline, the pipeline logs it once
+        if not getattr(self, 'is_pipeline_stage', False):
+            self._log_content_cache_stats()
+
+    def _process_clip(self, clip_path: Path, collection_path: Path):
+        '''Processes one clip and all the units under it (e.g. its shots).
+        Operators working on clips, shots or frames implement it 
+        so the pipeline operator can pass them clips one by one.
+        The pipeline operator rejects the stages which don't implement it.'''
+        self._error(f'Operator "{self._get_operator_name()}" can\'t process clips one by one, it can only be the first operator of a pipeline')
+
+    def _iter_processed_clips(self):
+        '''Processes all the clips in the collections one by one.
+        Yields (clip_path, collection_path) after each clip is processed.
+        Used by the pipeline operator for its first operator.'''
+        for col in self.context['collections']:
+            collection_path = col['attributes']['path']
+            for clip_folder_path in self._get_clip_folder_paths(col):
+                clip_path = self._get_video_file_path(clip_folder_path)
+                if clip_path:
+                    self._process_clip(clip_path, collection_path)
+                    yield clip_path, collection_path
 
     def _get_operator_folder_path(self) -> Path:
         # /home/u/src/prj/tools/framesense/operators/make_shots_scenedetect
@@ -230,15 +328,189 @@ class Operator(ABC):
         return ret
     
     def _is_logged_into_singularity_remote(self):
-        ret = False
+        def probe():
+            ret = False
 
-        res = self._run_command(['singularity', 'remote', 'status'])
+            res = self._run_command(['singularity', 'remote', 'status'])
+
+            if "logged in as" in res.stdout.lower():
+                ret = True
+
+            return ret
+
+        return self._get_host_capability('singularity_remote_login', probe)
+
+    def _get_host_capability(self, name, probe):
+        '''Returns the value of a capability of the host (e.g. 'docker_gpu').
+
+        probe() is only called if the value is not already known.
+        The value is cached in memory and on disk (tmp/capabilities.json),
+        per host name because the framesense folder can be shared
+        by several machines (e.g. HPC nodes).
+        The value on disk expires after FRAMESENSE_CAPABILITIES_TTL seconds
+        (default: one day; 0: no caching on disk).
+        A probe which returns None is never cached.
+        '''
+        with CAPABILITIES_LOCK:
+            if name in HOST_CAPABILITIES:
+                return HOST_CAPABILITIES[name]
 
-        if "logged in as" in res.stdout.lower():
-            ret = True
+            ttl = int(os.getenv('FRAMESENSE_CAPABILITIES_TTL', CAPABILITIES_TTL_DEFAULT))
+            cache_path = self._get_framesense_tmp_path() / 'capabilities.json'
+            host_name = socket.gethostname()
+
+            cache = {}
+            if ttl > 0 and cache_path.is_file():
+                try:
+                    cache = self.read_json(cache_path)
+                except json.decoder.JSONDecodeError:
+                    cache = {}
+
+            entry = cache.get(host_name, {}).get(name, None)
+            if entry and (time.time() - entry['probed']) < ttl:
+                ret = entry['value']
+                self._debug(f'Host capability {name} = {ret} (cached)')
+            else:
+                ret = probe()
+                self._debug(f'Host capability {name} = {ret} (probed)')
+                if ret is not None and ttl > 0:
+                    cache.setdefault(host_name, {})[name] = {
+                        'value': ret,
+                        'probed': time.time(),
+                    }
+                    # atomic write, other processes may read it
+                    tmp_path = cache_path.with_suffix(f'.{os.getpid()}.tmp')
+                    self.write_json(tmp_path, cache)
+                    tmp_path.replace(cache_path)
+
+            if ret is not None:
+                HOST_CAPABILITIES[name] = ret
 
         return ret
 
+    def _use_worker_container(self):
+        '''Returns True if the commands this operator runs in its container
+        should be sent to a single persistent container (the worker)
+        rather than to a new container each time.
+        Overridden by operators which run many short commands (e.g. ffmpeg).
+        Can be disabled with FRAMESENSE_WORKER_CONTAINER=0.'''
+        return False
+
+    def _start_worker_container(self):
+        '''Starts a persistent container (docker) or instance (singularity)
+        from the operator image, with all the collections bound to it.
+        _run_in_container() will then execute commands in it
+        (docker exec / singularity exec instance://)
+        instead of paying the startup cost of a new container each time.
+        '''
+        self.worker = None
+
+        is_enabled = os.getenv('FRAMESENSE_WORKER_CONTAINER', '1')
+        if str(is_enabled).lower() not in ['1', 'true', 'yes', 'on']:
+            return
+
+        if not (self._get_operator_folder_path() / 'Dockerfile').is_file():
+            return
+
+        engine = self._detect_installed_container_engine()
+
+        # e.g. [[/path/to/collections/hollywood, '/collections/hollywood'], ...]
+        collection_bindings = []
+        for col in self.context['collections']:
+            collection_path = col['attributes']['path']
+            if collection_path.is_dir():
+                collection_bindings.append([
+                    collection_path, 
+                    f'/collections/{self._sluggify(col["id"])}'
+                ])
+
+        if not collection_bindings:
+            return
+
+        bindings = collection_bindings + self._get_default_bindings()
+
+        # pid: other framesense processes may run the same operator
+        worker_name = self._get_container_name(f'worker_{os.getpid()}')
+
+        self._log(f'Starting worker container {worker_name}...')
+
+        engine_command_args = [engine]
+        if engine == 'docker':
+            engine_command_args += ['run', '-d', '--rm', '--name', worker_name]
+            if self.does_docker_support_gpu():
+                engine_command_args += ['--gpus', 'all']
+        if engine == 'singularity':
+            engine_command_args += ['instance', 'start', '--nv']
+
+        engine_command_args += self._get_binding_arguments(bindings)
+
+        if engine == 'docker':
+            # keep the container alive; commands are sent with docker exec
+            engine_command_args += ['--entrypoint', 'sleep', self._get_container_image_name(), 'infinity']
+        if engine == 'singularity':
+            engine_command_args += [self._get_container_image_name(), worker_name]
+
+        self._run_command(engine_command_args)
+
+        self.worker = {
+            'name': worker_name,
+            'image': self._get_container_image_name(),
+            'bindings': bindings,
+            'collection_paths': [b[0] for b in collection_bindings],
+        }
+
+    def _stop_worker_container(self):
+        worker = getattr(self, 'worker', None)
+        if worker:
+            self._log(f'Stopping worker container {worker["name"]}...')
+            
+            engine = self._detect_installed_container_engine()
+            if engine == 'docker':
+                command_args = [engine, 'rm', '-f', worker['name']]
+            if engine == 'singularity':
+                command_args = [engine, 'instance', 'stop', worker['name']]
+
+            self.worker = None
+            self._run_command(command_args)
+
+    def _can_run_in_worker(self, container_image_name, binding=None, port_mapping=None, is_service=False, share_network=False):
+        '''Returns True if a command can be executed in the worker container 
+        instead of a new container.'''
+        worker = getattr(self, 'worker', None)
+
+        ret = bool(worker) and not (is_service or port_mapping or share_network)
+        if ret:
+            ret = str(worker['image']) == str(container_image_name)
+        if ret and binding:
+            # the bound path must be visible in the worker
+            ret = any(
+                Path(binding[0]).absolute().resolve().is_relative_to(collection_path)
+                for collection_path in worker['collection_paths']
+            )
+
+        return ret
+
+    def _run_in_worker(self, command_args: [str], same_user=False, stream=False):
+        worker = self.worker
+        engine = self._detect_installed_container_engine()
+
+        engine_command_args = [engine, 'exec']
+        if engine == 'docker':
+            if same_user:
+                engine_command_args += ['--user', f'{os.getuid()}:{os.getgid()}']
+            engine_command_args.append(worker['name'])
+        if engine == 'singularity':
+            if (self._get_operator_folder_path() / 'app').is_dir():
+                engine_command_args += ['--pwd', '/app']
+            engine_command_args.append(f'instance://{worker["name"]}')
+
+        command_args = self._map_paths_to_container(command_args, worker['bindings'])
+
+        if stream:
+            return self._start_command_stream(engine_command_args + command_args)
+
+        return self._run_command(engine_command_args + command_args)
+
     def _start_service_in_operator_container(self, command_args: [str], binding: Tuple[Path, Path] = None, same_user=False, port_mapping=None, wait_for_message=''):
         if self.service:
             # we can't reuse it b/c the bindings could be different
@@ -246,6 +518,8 @@ class Operator(ABC):
 
         self._log(f'Launching service in container...')
         self.service = self._run_in_operator_container(command_args, binding, same_user=same_user, port_mapping=port_mapping, is_service=True)
+        # set now so the container is stopped even if the launch fails
+        self.service_running = True
         self._log(f'Waiting for service...')
         
         os.set_blocking(self.service.stdout.fileno(), False)  # Now readline() will be non-blocking
@@ -283,19 +557,28 @@ class Operator(ABC):
                     self._error(f'Service launch failed (status: {self.service.returncode}): {info}')
 
     def _is_service_running(self):
-        ret = False
+        '''Returns True if the service container of this operator is running.
+        The container engine is only asked the first time 
+        (e.g. a service left behind by an interrupted run),
+        after that the state is tracked in memory.'''
+        ret = getattr(self, 'service_running', None)
 
-        res = None
+        if ret is None:
+            ret = False
 
-        engine = self._detect_installed_container_engine()
-        if engine == 'docker':
-            res = self._run_command([engine, 'ps'])
-        if engine == 'singularity':
-            service_name = self._get_container_name('service')
-            res = self._run_command([engine, 'instance', 'list', service_name])
-        
-        if res:
-            ret = self._get_container_name('service') in res.stdout
+            res = None
+
+            engine = self._detect_installed_container_engine()
+            if engine == 'docker':
+                res = self._run_command([engine, 'ps'])
+            if engine == 'singularity':
+                service_name = self._get_container_name('service')
+                res = self._run_command([engine, 'instance', 'list', service_name])
+            
+            if res:
+                ret = self._get_container_name('service') in res.stdout
+
+            self.service_running = ret
 
         return ret
     
@@ -325,11 +608,19 @@ class Operator(ABC):
             res = self._run_command(command_args)
             # print(res)
 
+        executor = getattr(self, 'service_executor', None)
+        if executor is not None:
+            executor.shutdown()
+        self.service_executor = None
+
+        self.service_running = False
         self.service = None
         self.service_output = ''
         self.service_collection_path = None
     
-    def _call_service_processor(self, input_file_path: Path, collection_path: Path):
+    def _call_service_processor(self, input_file_path: Path, collection_path: Path, input_text: str = None):
+        '''Sends an input file (or a text, e.g. a search query, with input_text) 
+        to the service of the operator running over the collection.'''
         ret = {
             'error': 'unknown error',
             'result': [],
@@ -338,22 +629,7 @@ class Operator(ABC):
         # current_time = datetime.now()
         # iso_string = current_time.strftime("%Y-%m-%d-%M-%S-%f")
 
-        binding = [
-            collection_path, 
-            '/data'
-        ]
-
-        command_args = [
-            'python',
-            'processor.py',
-            'serve'
-        ]
-
-        if self.service_collection_path != str(collection_path):
-            # Do NOT use same_user for parakeet b/c host user can vary
-            # Docker build could create dynamically, but not needed
-            self._start_service_in_operator_container(command_args, binding, same_user=False, port_mapping=[SERVICE_PORT, SERVICE_PORT], wait_for_message='Serving Flask app')
-            self.service_collection_path = str(collection_path)
+        binding = self._start_service_processor(collection_path)
 
         # send request to localhost:5000/process?input_path=frame_file_path
 
@@ -367,11 +643,15 @@ class Operator(ABC):
 
         # response = json.loads(res.stdout)
 
-        if input_file_path:
-            input_file_path_in_container = binding[1] / input_file_path.relative_to(binding[0])
-            
-            self._log(input_file_path.relative_to(binding[0]))
-            response = self._fetch_json(f'http://localhost:{SERVICE_PORT}/process?input_path={input_file_path_in_container}')
+        if input_file_path or input_text:
+            if input_text:
+                input_in_container = input_text
+                self._log(f'"{input_text}"')
+            else:
+                input_in_container = str(binding[1] / input_file_path.relative_to(binding[0]))
+                self._log(input_file_path.relative_to(binding[0]))
+
+            response = self._fetch_json(f'http://localhost:{self._get_service_port()}/process?input_path={urllib.parse.quote(input_in_container)}')
 
             error = response.get('error', '')
             if not error:
@@ -380,14 +660,131 @@ class Operator(ABC):
                 stack = response.get('stack', '')
                 if stack:
                     self._debug(f'Processing service returned error. Stack = \n\n{stack}')
-                self._error(f'Processing service returned error. Input = {input_file_path}; Error = {error}.')
+                self._error(f'Processing service returned error. Input = {input_file_path or input_text}; Error = {error}.')
+
+        return ret
+
+    def _call_service_processor_stream(self, chunks, input_label: str, collection_path: Path, parameters: dict = None):
+        '''Same as _call_service_processor() but the input is streamed 
+        to the /process_stream endpoint of the service (e.g. raw audio samples piped by ffmpeg),
+        so it doesn't need to be written to a file first.
+        chunks: iterable of bytes; 
+        input_label: describes the input in the messages;
+        parameters: added to the query string of the request.'''
+        ret = {
+            'error': 'unknown error',
+            'result': [],
+        }
+
+        self._start_service_processor(collection_path)
+
+        self._log(input_label)
+
+        query = urllib.parse.urlencode(parameters or {})
+        response = self._fetch_json(f'http://localhost:{self._get_service_port()}/process_stream?{query}', stream=chunks)
+
+        error = response.get('error', '')
+        if not error:
+            ret = response
+        else:
+            stack = response.get('stack', '')
+            if stack:
+                self._debug(f'Processing service returned error. Stack = \n\n{stack}')
+            self._error(f'Processing service returned error. Input = {input_label}; Error = {error}.')
+
+        return ret
+
+    def _get_service_port(self) -> int:
+        '''Returns the port the service of this operator listens to.
+        SERVICE_PORT unless changed by the caller 
+        (e.g. each stage of a pipeline has its own port).'''
+        return getattr(self, 'service_port', None) or SERVICE_PORT
+
+    def _start_service_processor(self, collection_path: Path):
+        '''Starts the processor service over a collection, 
+        unless it is already running over it.
+        Returns the binding between the collection and the container.'''
+        binding = [
+            collection_path, 
+            '/data'
+        ]
+
+        port = self._get_service_port()
+        command_args = [
+            'python',
+            'processor.py',
+            'serve',
+            str(port)
+        ]
+
+        with SERVICE_LOCK:
+            if self.service_collection_path != str(collection_path):
+                # Do NOT use same_user for parakeet b/c host user can vary
+                # Docker build could create dynamically, but not needed
+                self._start_service_in_operator_container(command_args, binding, same_user=False, port_mapping=[port, port], wait_for_message='Serving Flask app')
+                self.service_collection_path = str(collection_path)
+
+        return binding
+
+    def _call_service_processor_batch(self, input_file_paths: [Path], collection_path: Path) -> [dict]:
+        '''Same as _call_service_processor() but for many inputs.
+        The inputs are sent to the /process_batch endpoint of the service,
+        `batch_size` (operator parameter) inputs per request.
+        Up to FRAMESENSE_SERVICE_CONCURRENCY requests are in flight at once.
+        Returns one response (error & result) per input, in the same order.
+        '''
+        ret = []
+
+        binding = self._start_service_processor(collection_path)
+
+        batch_size = int(self.params.get('batch_size', SERVICE_BATCH_SIZE_DEFAULT) or SERVICE_BATCH_SIZE_DEFAULT)
+
+        batches = []
+        requests = []
+        for i in range(0, len(input_file_paths), batch_size):
+            batch = input_file_paths[i:i + batch_size]
+
+            self._log(f'{batch[0].relative_to(binding[0])} (+ {len(batch) - 1} more)')
+            input_paths_in_container = [
+                str(binding[1] / input_file_path.relative_to(binding[0]))
+                for input_file_path in batch
+            ]
+            batches.append(batch)
+            requests.append([
+                f'http://localhost:{self._get_service_port()}/process_batch', 
+                {'input_paths': input_paths_in_container}
+            ])
+
+        responses = self._fetch_json_many(requests)
+
+        for batch, response in zip(batches, responses):
+            error = response.get('error', '')
+            if error:
+                stack = response.get('stack', '')
+                if stack:
+                    self._debug(f'Processing service returned error. Stack = \n\n{stack}')
+                self._error(f'Processing service returned error. Inputs = {batch[0]} (+ {len(batch) - 1} more); Error = {error}.')
+
+            for input_file_path, item_response in zip(batch, response['result']):
+                error = item_response.get('error', '')
+                if error:
+                    self._error(f'Processing service returned error. Input = {input_file_path}; Error = {error}.')
+                ret.append(item_response)
 
         return ret
 
     def _run_in_operator_container(self, command_args: [str], binding: Tuple[Path, Path] = None, same_user=False, port_mapping=None, is_service=False, share_network=False):
         return self._run_in_container(self._get_container_image_name(), command_args, binding, same_user, port_mapping, is_service, share_network=share_network)
 
-    def _run_in_container(self, container_image_name, command_args: [str], binding: Tuple[Path, Path] = None, same_user=False, port_mapping=None, is_service=False, share_network=False):
+    def _stream_from_operator_container(self, command_args: [str], binding: Tuple[Path, Path] = None, chunk_size=1024 * 1024):
+        '''Runs a command in the operator container 
+        and yields its binary standard output by chunks of chunk_size bytes
+        (the last chunk can be shorter).
+        e.g. raw video frames or audio samples piped by ffmpeg.'''
+        process = self._run_in_container(self._get_container_image_name(), command_args, binding, stream=True)
+        return self._read_command_stream(process, chunk_size)
+
+    def _run_in_container(self, container_image_name, command_args: [str], binding: Tuple[Path, Path] = None, same_user=False, port_mapping=None, is_service=False, share_network=False, stream=False):
         '''Runs a command in a new container.
         command_args: list of items
             NO (the first item is the image name)
@@ -398,6 +795,9 @@ class Operator(ABC):
         TODO: clearer to completely separate singularity from docker? two different sub-functions?
         TODO: pass the image name in a separate argument, rather than at the beginning of command_args
         '''
+        if self._can_run_in_worker(container_image_name, binding, port_mapping, is_service, share_network):
+            return self._run_in_worker(command_args, same_user, stream)
+
         engine = self._detect_installed_container_engine()
 
         command_args = command_args[:]
@@ -426,43 +826,19 @@ class Operator(ABC):
         if binding:
             bindings.append(binding)
 
-        # bind ./app to /app
+        # ./app and hugging face cache
+        bindings += self._get_default_bindings()
+
         app_folder_path = self._get_operator_folder_path() / 'app'
         if app_folder_path.is_dir():
-            bindings.append([
-                app_folder_path,
-                '/app'
-            ])
-
             if engine == 'singularity' and not is_service:
                 engine_command_args += [
                     '--pwd',
                     '/app'
                 ]
-        
-        # hugging face cache
-        hf_cache_path: Path = self.context['framesense_folder_path'] / 'hf_cache'
-        if not hf_cache_path.exists():
-            hf_cache_path.mkdir(exist_ok=True)
-        bindings.append([
-            hf_cache_path,
-            '/hf_cache'
-        ])
-
-        # user-defined binding
-        for abinding in bindings: 
-            mounted_path = abinding[0].absolute().resolve()
 
-            command_args = [
-                str(abinding[1] / a.relative_to(mounted_path)) if isinstance(a, Path) and a.is_relative_to(mounted_path) else a
-                for a in command_args
-            ]
-        
-            flag = '-v'
-            if engine == 'singularity':
-                flag = '-B'
-
-            engine_command_args += [flag, f'{mounted_path}:{abinding[1]}']
+        command_args = self._map_paths_to_container(command_args, bindings)
+        engine_command_args += self._get_binding_arguments(bindings)
         
         if engine == 'docker':
             engine_command_args.append('--rm')
@@ -517,10 +893,68 @@ class Operator(ABC):
 
             if is_service:
                 return self._run_service(engine_command_args)
+            elif stream:
+                return self._start_command_stream(engine_command_args)
             else:
                 return self._run_command(engine_command_args)
 
     
+    def _get_default_bindings(self):
+        '''Returns the bindings needed by all containers of this operator.
+        Each binding is a pair [host path, container path].'''
+        ret = []
+
+        # bind ./app to /app
+        app_folder_path = self._get_operator_folder_path() / 'app'
+        if app_folder_path.is_dir():
+            ret.append([
+                app_folder_path,
+                '/app'
+            ])
+
+        # hugging face cache
+        hf_cache_path: Path = self.context['framesense_folder_path'] / 'hf_cache'
+        if not hf_cache_path.exists():
+            hf_cache_path.mkdir(exist_ok=True)
+        ret.append([
+            hf_cache_path,
+            '/hf_cache'
+        ])
+
+        return ret
+
+    def _get_binding_arguments(self, bindings):
+        '''Converts bindings into container engine arguments.
+        e.g. ['-v', '/host/path:/container/path', ...]'''
+        ret = []
+
+        engine = self._detect_installed_container_engine()
+
+        flag = '-v'
+        if engine == 'singularity':
+            flag = '-B'
+
+        for abinding in bindings:
+            mounted_path = Path(abinding[0]).absolute().resolve()
+            ret += [flag, f'{mounted_path}:{abinding[1]}']
+
+        return ret
+
+    def _map_paths_to_container(self, command_args, bindings):
+        '''Returns a copy of command_args where each host Path
+        is converted to its location within the container.'''
+        ret = command_args[:]
+
+        for abinding in bindings: 
+            mounted_path = Path(abinding[0]).absolute().resolve()
+
+            ret = [
+                str(Path(abinding[1]) / a.relative_to(mounted_path)) if isinstance(a, Path) and a.is_relative_to(mounted_path) else a
+                for a in ret
+            ]
+
+        return ret
+
     def _run_command(self, command_args: [str]) -> subprocess.CompletedProcess[str]:
         res = None
 
@@ -544,6 +978,49 @@ class Operator(ABC):
         
         return res
 
+    def _start_command_stream(self, command_args: [str]) -> subprocess.Popen:
+        '''Starts a command which binary standard output is read by the caller
+        (see _read_command_stream).'''
+        command_as_string = ' '.join([str(a) for a in command_args])
+
+        self._debug(f'running command: {command_as_string}')
+
+        # stderr goes to a file rather than a pipe,
+        # so a verbose command never blocks while we only read stdout
+        stderr = tempfile.TemporaryFile()
+        ret = subprocess.Popen([str(a) for a in command_args], stdout=subprocess.PIPE, stderr=stderr, cwd=self._get_operator_folder_path())
+        ret.framesense_stderr = stderr
+        ret.framesense_command = command_as_string
+
+        return ret
+
+    def _read_command_stream(self, process: subprocess.Popen, chunk_size: int):
+        '''Yields the standard output of a process started by _start_command_stream
+        by chunks of chunk_size bytes, then checks how the process has ended.'''
+        completed = False
+        try:
+            while True:
+                chunk = process.stdout.read(chunk_size)
+                if not chunk:
+                    break
+                yield chunk
+            completed = True
+        finally:
+            if not completed:
+                # the reader stopped early
+                process.kill()
+            process.stdout.close()
+            process.wait()
+            process.framesense_stderr.seek(0)
+            stderr = process.framesense_stderr.read().decode('utf-8', errors='replace')
+            process.framesense_stderr.close()
+
+        if process.returncode > 0:
+            self._log('[START COMMAND ERROR--------------------')
+            self._log(stderr)
+            self._log('END COMMAND ERROR----------------------]')
+            self._error(f'Execution of the command has failed: {process.framesense_command}')
+
     def _run_service(self, command_args: [str]):
         # TODO: remove code duplication with _run_command
         ret = None
@@ -576,15 +1053,20 @@ class Operator(ABC):
         if ret is not None:
             return ret
 
-        for engine in ENGINES:
-            try:
-                output = subprocess.check_output([engine, '--version'])
-                ret = engine
-                break
-            except subprocess.CalledProcessError:
-                pass
-            except FileNotFoundError:
-                pass
+        def probe():
+            ret = None
+            for engine in ENGINES:
+                try:
+                    output = subprocess.check_output([engine, '--version'])
+                    ret = engine
+                    break
+                except subprocess.CalledProcessError:
+                    pass
+                except FileNotFoundError:
+                    pass
+            return ret
+
+        ret = self._get_host_capability('container_engine', probe)
 
         if not ret and not ignore_if_not_found:
             self._error(f'Container engine is not installed. Please install one of these applications: {", ".join(ENGINES)}.')
@@ -612,13 +1094,90 @@ class Operator(ABC):
 
     def _log(self, message, status='INFO'):
         now = datetime.now()
-        print(
-            f'{now.hour:02d}:{now.minute:02d}:{now.second:02d}.{int(now.microsecond / 10e5)} [{status:<5}] [{self._get_operator_name()}] {message}', 
-            file=sys.stderr if status == 'ERROR' else sys.stdout
-        )
+        line = f'{now.hour:02d}:{now.minute:02d}:{now.second:02d}.{int(now.microsecond / 10e5)} [{status:<5}] [{self._get_operator_name()}] {message}'
+        
+        log_lines = getattr(THREAD_DATA, 'log_lines', None)
+        if log_lines is not None and status != 'ERROR':
+            # held back until the work unit completes (see _run_work_unit)
+            log_lines.append([status, line])
+        else:
+            self._flush_log_lines()
+            with LOG_LOCK:
+                print(line, file=sys.stderr if status == 'ERROR' else sys.stdout)
+
         if status == 'ERROR':
             sys.exit(1)
 
+    def _flush_log_lines(self):
+        '''Print the log lines held back by the current work unit.'''
+        log_lines = getattr(THREAD_DATA, 'log_lines', None)
+        if log_lines:
+            with LOG_LOCK:
+                for status, line in log_lines:
+                    print(line, file=sys.stderr if status == 'ERROR' else sys.stdout)
+            log_lines.clear()
+
+    def _run_work_units(self, work_units: list) -> list:
+        '''Run a list of work units and return their results in the same order.
+
+        A work unit is a pair (function, arguments), 
+        e.g. (self._make_frames, [shot_file_path]).
+
+        Units run on a pool of threads, as many as the --jobs argument
+        (by default only one, i.e. sequentially).
+        Threads are enough because a unit mostly waits for a command 
+        running in a container.
+
+        With more than one job, the log lines of a unit are held back
+        and printed together when the unit completes,
+        so the output of concurrent units doesn't get interleaved.
+        '''
+        ret = []
+
+        jobs = self._get_jobs()
+
+        if jobs < 2 or len(work_units) < 2:
+            for function, arguments in work_units:
+                ret.append(function(*arguments))
+            return ret
+
+        self._debug(f'Running {len(work_units)} work units on {jobs} jobs')
+
+        executor = ThreadPoolExecutor(max_workers=jobs)
+        futures = [
+            executor.submit(self._run_work_unit, function, arguments)
+            for function, arguments
+            in work_units
+        ]
+        try:
+            for future in futures:
+                ret.append(future.result())
+        except BaseException as e:
+            # e.g. SystemExit raised by self._error() within a unit
+            executor.shutdown(wait=True, cancel_futures=True)
+            raise e
+        executor.shutdown()
+
+        return ret
+
+    def _run_work_unit(self, function, arguments):
+        THREAD_DATA.log_lines = []
+        try:
+            return function(*arguments)
+        finally:
+            self._flush_log_lines()
+            THREAD_DATA.log_lines = None
+
+    def _get_jobs(self) -> int:
+        '''Returns the number of work units that can run concurrently (--jobs).'''
+        ret = self._get_framesense_argument('jobs', None)
+        if ret is None or ret == '':
+            ret = 1
+        ret = int(ret)
+        if ret < 1:
+            self._error(f'Invalid number of jobs: {ret}. Please use a number greater than 0 (e.g. -j {os.cpu_count() or 1} for one job per CPU core).')
+        return ret
+
     def _is_verbose(self):
         return bool(self._get_framesense_argument('verbose'))
 
@@ -633,9 +1192,14 @@ class Operator(ABC):
         return re.sub(r'\W+', '-', str(string).lower()).strip('-')
 
     def _get_video_file_path(self, parent_folder_path: Path, direct_child_only=False):
-        video_extensions = [".mp4", ".mkv"]        
+        video_extensions = VIDEO_EXTENSIONS
         
-        parent_folder_path.stat
+        manifest = self._get_manifest(self._get_collection_from_path(parent_folder_path))
+        if manifest and manifest.has_folder(parent_folder_path):
+            # the largest file: sizes from the file system, not from the records
+            videos = manifest.get_file_entries(parent_folder_path, direct_child_only, video_extensions, restat=True)
+            return max(videos, key=lambda v: v['size'])['path'] if videos else None
+
         pattern = '**/*'
         if direct_child_only:
             pattern = '*'
@@ -649,7 +1213,499 @@ class Operator(ABC):
         ]
         
         return max(videos, key=lambda v: v.stat().st_size) if videos else None
+
+    def _read_shots_table(self, shots_folder_path: Path) -> [dict]:
+        '''Returns the shots listed in shots/shots.csv (written by PySceneDetect list-scenes)
+        as dictionaries with keys:
+        number (1, 2, ...), folder_name (e.g. '001'),
+        start_frame and end_frame (0-based, end included),
+        start_time and end_time (seconds, end excluded).
+        Returns an empty list if the table doesn't exist.'''
+        ret = []
+
+        table_path = shots_folder_path / 'shots.csv'
+        if not table_path.is_file():
+            return ret
+
+        with open(table_path, newline='') as fh:
+            rows = list(csv.reader(fh))
+
+        # the first row may be the list of cuts (Timecode List:, ...)
+        header = None
+        for row in rows:
+            if header is None:
+                if row and row[0].strip() == 'Scene Number':
+                    header = [c.strip() for c in row]
+                continue
+            if not row or not row[0].strip():
+                continue
+            shot = dict(zip(header, row))
+            number = int(shot['Scene Number'])
+            ret.append({
+                'number': number,
+                # same as PySceneDetect split-video ($SCENE_NUMBER)
+                'folder_name': f'{number:03d}',
+                # PySceneDetect frame numbers start at 1
+                'start_frame': int(shot['Start Frame']) - 1,
+                'end_frame': int(shot['End Frame']) - 1,
+                'start_time': float(shot['Start Time (seconds)']),
+                'end_time': float(shot['End Time (seconds)']),
+            })
+
+        return ret
+
+    def _read_shot_descriptor(self, shot_folder_path: Path) -> dict:
+        '''Returns the descriptor of a shot (shots/XXX/shot.json),
+        which locates the shot as a range of frames in its clip,
+        with an additional clip_path key (absolute path of the clip).
+        Returns None if the shot has no descriptor.'''
+        ret = None
+
+        descriptor_path = shot_folder_path / 'shot.json'
+        if descriptor_path.is_file():
+            ret = json.loads(descriptor_path.read_text())
+            # clip path is relative to the clip folder
+            ret['clip_path'] = shot_folder_path.parent.parent / ret['clip']
+
+        return ret
+
+    def _probe_video(self, video_path: Path, count='') -> dict:
+        '''Returns the duration (seconds), frame_rate (frames per second), 
+        frame_count, width and height of the first video stream of a video file.
+        Uses ffprobe, which must be installed in the operator container.
+
+        count: how the frames are counted:
+        * '': read from the container metadata, fast but not always available;
+        * 'packets': count the packets of the stream, demuxes but doesn't decode the video;
+        * 'frames': count the decoded frames, exact but decodes the whole video.
+        frame_count is None if unknown.
+        '''
+        ret = {
+            'duration': None,
+            'frame_rate': None,
+            'frame_count': None,
+            'width': None,
+            'height': None,
+        }
+
+        entries = {
+            '': 'nb_frames',
+            'packets': 'nb_read_packets',
+            'frames': 'nb_read_frames',
+        }[count]
+
+        binding = [video_path.parent, Path('/data')]
+        command_args = [
+            'ffprobe', 
+            '-v', 'error', 
+            '-select_streams', 'v:0', 
+        ]
+        if count:
+            command_args += [f'-count_{count}']
+        command_args += [
+            '-show_entries', 
+            f'format=duration:stream=avg_frame_rate,width,height,{entries}', 
+            '-of', 'json', 
+            video_path,
+        ]
+        res = self._run_in_operator_container(command_args, binding)
+
+        '''
+        {
+            "programs": [],
+            "streams": [
+                {
+                    "avg_frame_rate": "24/1",
+                    "nb_frames": "30"
+                }
+            ],
+            "format": {
+                "duration": "1.250000"
+            }
+        }
+        '''
+        try:
+            metadata = json.loads(res.stdout)
+        except json.JSONDecodeError:
+            self._error(f'Could not probe video {video_path}: {res.stderr}')
+
+        def to_number(value):
+            # e.g. 'N/A', '0/0', '24000/1001'
+            ret = None
+            try:
+                parts = str(value).split('/')
+                ret = float(parts[0]) / float(parts[1]) if len(parts) == 2 else float(parts[0])
+            except (ValueError, ZeroDivisionError):
+                pass
+            return ret
+
+        streams = metadata.get('streams', None) or [{}]
+        ret['duration'] = to_number(metadata.get('format', {}).get('duration', None))
+        ret['frame_rate'] = to_number(streams[0].get('avg_frame_rate', None)) or None
+        frame_count = to_number(streams[0].get(entries, None))
+        if frame_count:
+            ret['frame_count'] = int(frame_count)
+        for dimension in ['width', 'height']:
+            if streams[0].get(dimension, None):
+                ret[dimension] = int(streams[0][dimension])
+
+        return ret
     
+    def _get_manifest(self, collection=None):
+        '''Returns the manifest of the collections (see manifest.py).
+        The manifest of the given collection is refreshed 
+        the first time it is requested during a run.
+        Returns None if the manifest is disabled (FRAMESENSE_MANIFEST=0).'''
+        ret = None
+
+        is_enabled = os.getenv('FRAMESENSE_MANIFEST', '1')
+        if str(is_enabled).lower() not in ['1', 'true', 'yes', 'on']:
+            return ret
+
+        # e.g. collections.json => collections.manifest.sqlite
+        database_path = self.context['collections_path'].with_suffix('.manifest.sqlite')
+
+        with MANIFESTS_LOCK:
+            ret = MANIFESTS.get(database_path, None)
+            if ret is None:
+                ret = Manifest(database_path)
+                MANIFESTS[database_path] = ret
+
+            if collection and not ret.is_refreshed(collection['id']):
+                t0 = time.time()
+                folders_count = ret.refresh(collection['id'], collection['attributes']['path'])
+                self._debug(f'Manifest of collection {collection["id"]} refreshed ({folders_count} folders listed in {time.time() - t0:.1f} s.)')
+
+        return ret
+
+    def _get_provenance(self):
+        '''Returns the provenance database of the outputs (see provenance.py).
+        Returns None if disabled (FRAMESENSE_PROVENANCE=0).'''
+        ret = None
+
+        is_enabled = os.getenv('FRAMESENSE_PROVENANCE', '1')
+        if str(is_enabled).lower() not in ['1', 'true', 'yes', 'on']:
+            return ret
+
+        # e.g. collections.json => collections.provenance.sqlite
+        database_path = self.context['collections_path'].with_suffix('.provenance.sqlite')
+
+        with PROVENANCES_LOCK:
+            ret = PROVENANCES.get(database_path, None)
+            if ret is None:
+                ret = Provenance(database_path)
+                PROVENANCES[database_path] = ret
+
+        return ret
+
+    def _get_content_cache(self):
+        '''Returns the cache of the model results indexed by the content of their inputs 
+        (see cache.py), shared by all the collections.
+        Returns None if disabled (FRAMESENSE_CONTENT_CACHE_SIZE=0).'''
+        ret = None
+
+        max_size = float(os.getenv('FRAMESENSE_CONTENT_CACHE_SIZE', CONTENT_CACHE_SIZE_DEFAULT) or 0)
+        if max_size <= 0:
+            return ret
+
+        # next to framesense.py
+        database_path = self.context['framesense_folder_path'] / 'content_cache.sqlite'
+
+        with CONTENT_CACHES_LOCK:
+            ret = CONTENT_CACHES.get(database_path, None)
+            if ret is None:
+                ret = ContentCache(database_path, int(max_size * 1024 * 1024))
+                CONTENT_CACHES[database_path] = ret
+
+        return ret
+
+    def _get_content_hash(self, file_path: Path, sampled=False) -> str:
+        '''Returns a hash of the whole content of a file,
+        identical for two copies of the same file.
+        sampled: for large files (e.g. videos), the size and a hash of CONTENT_HASH_SAMPLES 
+        evenly spaced samples of the content, computed once per file by this process.'''
+        if not sampled:
+            digest = hashlib.sha256()
+            with open(file_path, 'rb') as fh:
+                for chunk in iter(lambda: fh.read(1024 * 1024), b''):
+                    digest.update(chunk)
+            return digest.hexdigest()
+
+        stat = Path(file_path).stat()
+        key = (str(file_path), stat.st_size, stat.st_mtime_ns)
+        with CONTENT_HASHES_LOCK:
+            ret = CONTENT_HASHES.get(key, None)
+        if ret is None:
+            digest = hashlib.sha256()
+            last_offset = max(0, stat.st_size - FINGERPRINT_SAMPLE_SIZE)
+            with open(file_path, 'rb') as fh:
+                for i in range(CONTENT_HASH_SAMPLES):
+                    fh.seek(last_offset * i // (CONTENT_HASH_SAMPLES - 1))
+                    digest.update(fh.read(FINGERPRINT_SAMPLE_SIZE))
+            ret = f'{stat.st_size}:{digest.hexdigest()}'
+            with CONTENT_HASHES_LOCK:
+                CONTENT_HASHES[key] = ret
+
+        return ret
+
+    def _get_answer_cache_key(self, input_hash: str, prompt: str, param_names=[]) -> str:
+        '''Returns the key of an answer in the content cache:
+        a hash of the operator, the content of the input (see _get_content_hash), 
+        the model, the prompt, the seed 
+        and the other parameters affecting the answer (param_names, e.g. context_length).'''
+        parts = [
+            self._get_operator_name(), 
+            input_hash, 
+            self.params.get('model', None), 
+            prompt, 
+            self.params.get('seed', None)
+        ] + [self.params.get(name, None) for name in param_names]
+        return hashlib.sha256(json.dumps(parts, default=str).encode('utf-8')).hexdigest()
+
+    def _get_cached_answers(self, keys: [str]) -> dict:
+        '''Returns {key: answer} for the answers found in the content cache.
+        Empty with -r, so the answers are produced again.'''
+        ret = {}
+
+        cache = self._get_content_cache()
+        if cache is None or self._is_redo():
+            return ret
+
+        for key, value in cache.get_many(ANSWER_CACHE_NAMESPACE, keys).items():
+            ret[key] = json.loads(value.decode('utf-8'))
+
+        return ret
+
+    def _cache_answers(self, answers: dict):
+        '''Adds {key: answer} to the content cache, answers must be json serialisable.'''
+        cache = self._get_content_cache()
+        if cache is None:
+            return
+
+        cache.set_many(ANSWER_CACHE_NAMESPACE, {
+            key: json.dumps(answer).encode('utf-8')
+            for key, answer in answers.items()
+        })
+
+    def _log_content_cache_stats(self):
+        '''Logs the hits and misses of the content cache lookups by this process.'''
+        with CONTENT_CACHES_LOCK:
+            caches = list(CONTENT_CACHES.values())
+
+        for cache in caches:
+            for namespace in cache.get_session_namespaces():
+                stats = cache.get_stats(namespace)
+                lookups = stats['session_hits'] + stats['session_misses']
+                if not lookups:
+                    continue
+                self._log(
+                    f'Content cache ({namespace}): {stats["session_hits"]} hits, {stats["session_misses"]} misses '
+                    f'({stats["session_hits"] / lookups:.0%} hit rate; {stats["entries"]} entries)'
+                )
+
+    def _needs_update(self, output_path: Path, input_paths: [Path], output_exists=None) -> bool:
+        '''Returns True if the output has to be (re)produced from its inputs:
+        redo, output not found, or inputs or parameters changed since it was produced.
+        output_exists: overrides the existence test of output_path
+        (e.g. when the output is a set of files in a folder).
+
+        An existing output without provenance record (e.g. produced by an older version)
+        is considered up to date and its current inputs are recorded.
+        '''
+        ret = True
+
+        if output_exists is None:
+            output_exists = output_path.exists()
+
+        if self._is_redo() or not output_exists:
+            return ret
+
+        provenance = self._get_provenance()
+        if provenance is None:
+            return False
+
+        record = provenance.get(output_path)
+        current = self._get_provenance_record(input_paths)
+        if record is None:
+            provenance.set(output_path, current)
+            ret = False
+        else:
+            changes = provenance.get_changes(record, current)
+            ret = bool(changes)
+            if ret:
+                self._log(f'{output_path} is out of date ({"; ".join(changes)})')
+
+        return ret
+
+    def _record_provenance(self, output_path: Path, input_paths: [Path]):
+        '''Records that the output has just been produced from those inputs
+        with the current parameters.'''
+        provenance = self._get_provenance()
+        if provenance is not None:
+            provenance.set(output_path, self._get_provenance_record(input_paths))
+        self._update_manifest_folder(output_path if output_path.is_dir() else output_path.parent)
+
+    def _update_manifest_folder(self, folder_path: Path):
+        '''Brings the manifest up to date after writing into a folder,
+        so it lists the new outputs to the next stages of the same run.'''
+        collection = self._get_collection_from_path(folder_path)
+        if collection:
+            manifest = self._get_manifest()
+            if manifest:
+                manifest.update_folder(collection['id'], collection['attributes']['path'], Path(folder_path).absolute())
+
+    def _get_provenance_record(self, input_paths: [Path]) -> dict:
+        return {
+            'operator': self._get_operator_name(),
+            'params_hash': self._get_params_hash(),
+            'inputs': {
+                str(input_path): self._get_file_fingerprint(input_path)
+                for input_path in input_paths
+            },
+        }
+
+    def _get_provenance_ignored_params(self) -> [str]:
+        '''Returns the names of the parameters which don't affect the outputs of this operator,
+        so changing them doesn't make the outputs out of date.
+        Overridden by operators with other such parameters 
+        (e.g. a choice between two methods producing the same output).'''
+        return PROVENANCE_IGNORED_PARAMS
+
+    def _get_params_hash(self) -> str:
+        ignored_params = self._get_provenance_ignored_params()
+        params = {
+            k: v
+            for k, v in self.params.items()
+            if k not in ignored_params
+        }
+        return hashlib.sha256(json.dumps(params, sort_keys=True, default=str).encode('utf-8')).hexdigest()[:16]
+
+    def _get_file_fingerprint(self, file_path: Path) -> str:
+        '''Returns a string which changes when the content of the file changes.
+        By default: size and modification time.
+        FRAMESENSE_FINGERPRINT=hash: size and hash of three samples of the content,
+        (slower but robust to copies and to file systems with imprecise mtime).
+        Empty string if the file doesn't exist.'''
+        ret = ''
+
+        try:
+            stat = Path(file_path).stat()
+        except FileNotFoundError:
+            return ret
+
+        if os.getenv('FRAMESENSE_FINGERPRINT', 'stat') == 'hash':
+            digest = hashlib.sha1()
+            with open(file_path, 'rb') as fh:
+                for offset in [0, stat.st_size // 2, max(0, stat.st_size - FINGERPRINT_SAMPLE_SIZE)]:
+                    fh.seek(offset)
+                    digest.update(fh.read(FINGERPRINT_SAMPLE_SIZE))
+            ret = f'{stat.st_size}:{digest.hexdigest()}'
+        else:
+            ret = f'{stat.st_size}:{stat.st_mtime_ns}'
+
+        return ret
+
+    def _get_collection_data_folder_path(self, collection_path: Path) -> Path:
+        '''Returns the hidden folder where operators keep 
+        the stores and indices of a collection (e.g. embeddings).'''
+        return Path(collection_path) / COLLECTION_DATA_FOLDER
+
+    def _get_embedding_store(self, collection_path: Path, model: str):
+        '''Returns the binary store of the vectors computed 
+        by a model over a collection (see embeddings.py).'''
+        # numpy is only needed by operators working with embeddings
+        from .embeddings import EmbeddingStore
+
+        folder_path = self._get_collection_data_folder_path(collection_path) / 'embeddings' / self._sluggify(model)
+
+        with EMBEDDING_STORES_LOCK:
+            ret = EMBEDDING_STORES.get(folder_path, None)
+            if ret is None:
+                ret = EmbeddingStore(folder_path, model)
+                EMBEDDING_STORES[folder_path] = ret
+
+        return ret
+
+    def _read_embedding(self, collection_path: Path, embedding: dict):
+        '''Returns the vector of an embedding entry from frames.json,
+        either stored in the entry itself (value) or in the embedding store (store).
+        None if not found.'''
+        ret = embedding.get('value', None)
+        store_key = embedding.get('store', None)
+        if ret is None and store_key:
+            ret = self._get_embedding_store(collection_path, embedding['model']).get(store_key)
+        return ret
+
+    def _get_collection_from_path(self, path: Path):
+        '''Returns the collection which folder contains the given path.
+        None if not found.'''
+        ret = None
+
+        path = Path(path).absolute()
+        for col in self.context['collections']:
+            if path.is_relative_to(col['attributes']['path']):
+                ret = col
+                break
+
+        return ret
+
+    def _get_video_folder_paths(self, collection) -> [Path]:
+        '''Returns the sorted paths of all video folders in a collection.'''
+        collection_path = collection['attributes']['path']
+        if not collection_path.is_dir():
+            return []
+
+        manifest = self._get_manifest(collection)
+        if manifest:
+            return manifest.get_folder_paths(collection['id'], 1)
+
+        return sorted(p for p in collection_path.iterdir() if p.is_dir() and not p.name.startswith('.'))
+
+    def _get_clip_folder_paths(self, collection) -> [Path]:
+        '''Returns the sorted paths of all clip folders in a collection.'''
+        collection_path = collection['attributes']['path']
+        if not collection_path.is_dir():
+            return []
+
+        manifest = self._get_manifest(collection)
+        if manifest:
+            return manifest.get_folder_paths(collection['id'], 2)
+
+        return sorted(
+            p 
+            for video_folder_path in self._get_video_folder_paths(collection) 
+            for p in video_folder_path.iterdir() 
+            if p.is_dir()
+        )
+
+    def _get_shot_folder_paths(self, collection) -> [Path]:
+        '''Returns the sorted paths of all shot folders (shots/XXX/) in a collection.'''
+        collection_path = collection['attributes']['path']
+        if not collection_path.is_dir():
+            return []
+
+        manifest = self._get_manifest(collection)
+        if manifest:
+            return manifest.get_folder_paths(collection['id'], 4, 'shots')
+
+        return sorted(collection_path.glob('**/shots/*/'))
+
+    def _get_shot_file_paths(self, collection) -> [Path]:
+        '''Returns the sorted paths of all shot videos (shots/XXX/*.mp4) in a collection.'''
+        ret = []
+
+        manifest = self._get_manifest(collection)
+        for shot_folder_path in self._get_shot_folder_paths(collection):
+            if manifest:
+                ret += [
+                    e['path'] 
+                    for e in manifest.get_file_entries(shot_folder_path, True, ['.mp4'])
+                ]
+            else:
+                ret += sorted(shot_folder_path.glob('*.mp4'))
+
+        return ret
+
     def _is_path_selected(self, path: Path):
         ret = True
         filter = self._get_framesense_argument('filter')
@@ -660,7 +1716,15 @@ class Operator(ABC):
     def _read_data_file(self, data_file_path: Path, is_data_dict=False):
         ret = {}
 
-        if data_file_path.is_file():
+        results, file = self._get_results(data_file_path)
+        if results:
+            if not results.has_file(file) and data_file_path.is_file():
+                # first read from this backend, import the existing json file
+                results.write(file, flatten(self.read_json(data_file_path)), [])
+            rows = results.read(file)
+            # keeps the rows to only write back what the operator has changed (see _write_data_file)
+            ret = DataFileContent(unflatten(rows), rows)
+        elif data_file_path.is_file():
             ret = self.read_json(data_file_path)
         
         if not ret:
@@ -675,26 +1739,219 @@ class Operator(ABC):
         return ret
 
     def _write_data_file(self, data_file_path: Path, content: dict):
-        self.write_json(data_file_path, content)
+        results, file = self._get_results(data_file_path)
+        if results:
+            rows = flatten(content)
+            # not read from the database: all the rows are written, none is deleted
+            snapshot = getattr(content, 'snapshot', {})
+            changed = {
+                k: v
+                for k, v in rows.items()
+                if snapshot.get(k, None) != v
+            }
+            deleted = [k for k in snapshot if k not in rows]
+            results.write(file, changed, deleted)
+            if isinstance(content, DataFileContent):
+                # the next write of the same content only sends the new changes
+                content.snapshot = rows
+        else:
+            self.write_json(data_file_path, content)
+
+    def _delete_data_file(self, data_file_path: Path):
+        results, file = self._get_results(data_file_path)
+        if results:
+            results.delete(file)
+        if data_file_path.is_file():
+            data_file_path.unlink()
+
+    def _delete_data_folder(self, folder_path: Path):
+        '''Removes a folder and the results of all the data files under it.'''
+        results, folder = self._get_results(folder_path)
+        if results:
+            results.delete(folder, is_folder=True)
+        if folder_path.exists():
+            shutil.rmtree(folder_path)
+
+    def _get_results(self, data_file_path: Path):
+        '''Returns (results database, file key) for a data file 
+        if the sqlite results backend is enabled (FRAMESENSE_RESULTS_BACKEND=sqlite),
+        (None, None) otherwise.'''
+        ret = [None, None]
+
+        backend = os.getenv('FRAMESENSE_RESULTS_BACKEND', 'json')
+        if backend not in ['json', 'sqlite']:
+            self._error(f'Unsupported value for FRAMESENSE_RESULTS_BACKEND: "{backend}". Please use "json" or "sqlite".')
+
+        if backend == 'sqlite':
+            collection = self._get_collection_from_path(data_file_path)
+            if collection:
+                collection_path = collection['attributes']['path']
+                ret = [
+                    self._get_results_database(collection_path),
+                    Path(data_file_path).absolute().relative_to(collection_path).as_posix(),
+                ]
+
+        return ret
+
+    def _get_results_database(self, collection_path: Path, create=True):
+        '''Returns the results database of a collection (see results.py).
+        None if it doesn't exist and create is False.'''
+        database_path = self._get_collection_data_folder_path(collection_path) / 'results.sqlite'
+
+        with RESULTS_LOCK:
+            ret = RESULTS.get(database_path, None)
+            if ret is None and (create or database_path.is_file()):
+                ret = Results(database_path)
+                RESULTS[database_path] = ret
+
+        return ret
 
     # def _get_operator_parameters(self):
     #     # deprecated
     #     return self._get_framesense_argument('parameters')
 
-    def _fetch_json(self, url):
+    def _fetch_json(self, url, data=None, stream=None):
+        '''Returns the json response to a GET request,
+        or to a POST request if data (a json-serialisable structure) is provided,
+        or to a POST request with a chunked binary body if stream (an iterable of bytes) is provided.
+        
+        The connection to the server is kept alive and reused 
+        by the following requests from the same thread.
+        '''
+        ret = None
+
+        self._debug(f'fetching: {url}')
+
+        parts = urllib.parse.urlsplit(url)
+        path = parts.path or '/'
+        if parts.query:
+            path += '?' + parts.query
+
+        method = 'GET'
+        body = None
+        headers = {}
+        if data is not None:
+            method = 'POST'
+            body = json.dumps(data).encode('utf-8')
+            headers['Content-Type'] = 'application/json'
+        if stream is not None:
+            method = 'POST'
+            body = stream
+            headers['Content-Type'] = 'application/octet-stream'
+            # a stream can't be sent twice, so we don't retry on a kept-alive connection
+            self._close_http_connection(parts.scheme, parts.netloc)
+
+        timeout = self._get_service_timeout()
+
+        # a kept-alive connection may have been closed by the server in the meantime,
+        # in which case we retry once with a new connection.
+        for attempt in range(2):
+            connection, is_reused = self._get_http_connection(parts.scheme, parts.netloc, timeout)
+            try:
+                connection.request(method, path, body=body, headers=headers, encode_chunked=stream is not None)
+                res = connection.getresponse()
+                content = res.read()
+                break
+            except (http.client.RemoteDisconnected, BrokenPipeError, ConnectionResetError) as e:
+                self._close_http_connection(parts.scheme, parts.netloc)
+                if not is_reused or attempt > 0:
+                    self._error(f'error while fetching {url}, connection closed by the server ({str(e)})')
+            except ConnectionRefusedError as e:
+                self._close_http_connection(parts.scheme, parts.netloc)
+                self._error(f'error while fetching {url}, connection refused, is the service running?')
+            except (TimeoutError, socket.timeout) as e:
+                self._close_http_connection(parts.scheme, parts.netloc)
+                self._error(f'error while fetching {url}, no response after {timeout} s. (see FRAMESENSE_SERVICE_TIMEOUT)')
+            except OSError as e:
+                self._close_http_connection(parts.scheme, parts.netloc)
+                self._error(f'error while fetching {url}, {str(e)}')
+            except http.client.HTTPException as e:
+                # e.g. IncompleteRead, BadStatusLine, LineTooLong
+                self._close_http_connection(parts.scheme, parts.netloc)
+                self._error(f'error while fetching {url}, invalid response ({type(e).__name__}: {str(e)})')
+
+        content = content.decode('utf-8', errors='replace')
+
+        if res.status >= 400:
+            self._debug(f'fetch error: {content}')
+            self._error(f'error while fetching {url}, HTTP {res.status} {res.reason}')
+
         try:
-            self._debug(f'fetching: {url}')
-            res = urllib.request.urlopen(url)
-        except urllib.error.URLError as e:
-            error_message = e.read()
-            error_message = error_message.decode('utf-8')
-            self._debug(f'fetch error: {error_message}')
-            self._error(f'error while fetching {url}, {str(e.reason)}')
-        except http.client.RemoteDisconnected as e:
-            self._error(f'error while fetching {url}, {str(e)}')
+            ret = json.loads(content)
+        except json.JSONDecodeError as e:
+            self._debug(f'fetch response: {content[:1000]}')
+            self._error(f'error while fetching {url}, invalid json response ({str(e)})')
+
+        return ret
+
+    def _fetch_json_many(self, requests: [list]) -> list:
+        '''Fetches many json responses, keeping up to FRAMESENSE_SERVICE_CONCURRENCY
+        requests in flight at once.
+        requests: list of [url, data]; see _fetch_json().
+        Returns the responses in the same order as the requests.'''
+        ret = []
+
+        concurrency = self._get_service_concurrency()
+
+        if concurrency < 2 or len(requests) < 2:
+            for url, data in requests:
+                ret.append(self._fetch_json(url, data))
+        else:
+            # the threads of the executor are reused across calls,
+            # so are their kept-alive connections.
+            executor = getattr(self, 'service_executor', None)
+            if executor is None:
+                executor = ThreadPoolExecutor(max_workers=concurrency, thread_name_prefix='fetch')
+                self.service_executor = executor
+            futures = [
+                executor.submit(self._fetch_json, url, data)
+                for url, data in requests
+            ]
+            ret = [future.result() for future in futures]
+
+        return ret
+
+    def _get_http_connection(self, scheme, netloc, timeout):
+        '''Returns (connection, is_reused): a keep-alive http connection 
+        to netloc owned by the current thread.'''
+        connections = getattr(THREAD_DATA, 'http_connections', None)
+        if connections is None:
+            connections = {}
+            THREAD_DATA.http_connections = connections
+
+        key = (scheme, netloc)
+        connection = connections.get(key, None)
+        is_reused = connection is not None
+        if connection is None:
+            if scheme == 'https':
+                connection = http.client.HTTPSConnection(netloc, timeout=timeout)
+            else:
+                connection = http.client.HTTPConnection(netloc, timeout=timeout)
+            connections[key] = connection
+
+        return connection, is_reused
+
+    def _close_http_connection(self, scheme, netloc):
+        connections = getattr(THREAD_DATA, 'http_connections', {})
+        connection = connections.pop((scheme, netloc), None)
+        if connection is not None:
+            connection.close()
+
+    def _get_service_concurrency(self) -> int:
+        ret = os.getenv('FRAMESENSE_SERVICE_CONCURRENCY', None)
+        try:
+            ret = int(ret) if ret else SERVICE_CONCURRENCY_DEFAULT
+        except ValueError:
+            self._error(f'FRAMESENSE_SERVICE_CONCURRENCY should be an integer ({ret})')
+        return max(1, ret)
 
-        content = res.read().decode('utf-8')
-        return json.loads(content)
+    def _get_service_timeout(self) -> float:
+        ret = os.getenv('FRAMESENSE_SERVICE_TIMEOUT', None)
+        try:
+            ret = float(ret) if ret else SERVICE_TIMEOUT_DEFAULT
+        except ValueError:
+            self._error(f'FRAMESENSE_SERVICE_TIMEOUT should be a number of seconds ({ret})')
+        return ret
 
     def _is_debug(self):
         ret = self.context.get('debug', False)
@@ -746,9 +2003,12 @@ class Operator(ABC):
         ret = False
         cuda_visible_devices = os.environ.get("CUDA_VISIBLE_DEVICES", None)
         if cuda_visible_devices != '':
-            command_args = ['docker', 'run', '--rm', '--gpus', 'all', 'alpine']
-            res = subprocess.run(command_args, capture_output=True, text=True, cwd=self._get_operator_folder_path())
-            ret = res.returncode == 0
+            def probe():
+                command_args = ['docker', 'run', '--rm', '--gpus', 'all', 'alpine']
+                res = subprocess.run(command_args, capture_output=True, text=True, cwd=self._get_operator_folder_path())
+                return res.returncode == 0
+
+            ret = self._get_host_capability('docker_gpu', probe)
 
         return ret
 
@@ -818,13 +2078,19 @@ class Operator(ABC):
 
         return ret
 
-    def send_prompt_to_openai_api_from_params(self, image_path=None):
+    def send_prompt_to_openai_api_from_params(self, image_path=None, prompt=None):
+        '''Sends a prompt (by default the `prompt` parameter) 
+        and an image to an openai-compatible inference platform.
+        Returns error, result and status (http status, 0 if not reached).
+        Thread-safe as long as the prompt is passed as an argument.'''
         import json
         import urllib.request
 
         # Define your parameters and arguments
         # TODO: call  getter instead
         params = self.params
+        if prompt is None:
+            prompt = params['prompt']
         # TODO:
         images = []
         if image_path:
@@ -846,7 +2112,7 @@ class Operator(ABC):
                 {
                     'role': 'user',
                     'content': [
-                        {'type': 'text', 'text': params['prompt']},
+                        {'type': 'text', 'text': prompt},
                         {'type': 'image_url', 'image_url': f'data:image/png;base64,{images[0]}'}  
                     ],
                     # 'images': images,
@@ -877,8 +2143,10 @@ class Operator(ABC):
 
         res = ''
         error = ''
+        status = 0
         try:
-            with urllib.request.urlopen(req) as response:
+            with urllib.request.urlopen(req, timeout=self._get_service_timeout()) as response:
+                status = response.status
                 # Parse the JSON response
                 res = response.read().decode('utf-8')
                 # print(res)
@@ -890,12 +2158,87 @@ class Operator(ABC):
                 # print(res)
         except urllib.error.HTTPError as e:
             error = f"HTTP Error: {e.code} - {e.reason}"
+            status = e.code
             if '404' in error:
                 self._warn(f'404 error returned by inferrence platform. Check validity of address ({url}) and availability or model ({params["model"]})')
         except urllib.error.URLError as e:
             error = f"URL Error: {e.reason}"
+        except (TimeoutError, socket.timeout) as e:
+            error = f"Timeout: no response after {self._get_service_timeout()} s."
+        except (http.client.HTTPException, ConnectionError) as e:
+            error = f"Connection Error: {str(e)}"
 
         return {
             'error': error,
-            'result': res
+            'result': res,
+            'status': status,
         }
+
+    def _dispatch_prompts(self, requests: [dict]) -> [dict]:
+        '''Sends many requests to the openai-compatible inference platform.
+        requests: list of dictionaries with `prompt` and `image_path` keys.
+        Returns the responses (see send_prompt_to_openai_api_from_params) 
+        in the same order as the requests.
+
+        Operator parameters:
+        * concurrency: maximum number of requests in flight (default: 1)
+        * max_retries: number of retries after a timeout, 
+            connection error or a 429/5xx status (default: 3)
+        * requests_per_second: maximum rate of requests, 0 for no limit (default: 0)
+        '''
+        ret = []
+
+        concurrency = max(1, int(self.params.get('concurrency', 1) or 1))
+
+        if getattr(self, 'prompt_rate_lock', None) is None:
+            self.prompt_rate_lock = threading.Lock()
+            self.prompt_next_time = 0
+
+        if concurrency < 2 or len(requests) < 2:
+            for request in requests:
+                ret.append(self._send_prompt_with_retries(request))
+        else:
+            with ThreadPoolExecutor(max_workers=concurrency, thread_name_prefix='prompt') as executor:
+                futures = [
+                    executor.submit(self._send_prompt_with_retries, request)
+                    for request in requests
+                ]
+                ret = [future.result() for future in futures]
+
+        return ret
+
+    def _send_prompt_with_retries(self, request: dict) -> dict:
+        ret = None
+
+        max_retries = int(self.params.get('max_retries', 3) or 0)
+
+        for attempt in range(max_retries + 1):
+            self._wait_for_prompt_rate()
+            ret = self.send_prompt_to_openai_api_from_params(
+                image_path=request.get('image_path', None), 
+                prompt=request['prompt']
+            )
+            is_retryable = ret['status'] in RETRYABLE_HTTP_STATUSES or (ret['error'] and not ret['status'])
+            if not ret['error'] or not is_retryable or attempt >= max_retries:
+                break
+            # exponential backoff with jitter: ~1, 2, 4, ... seconds
+            delay = (2 ** attempt) * (0.5 + random.random())
+            self._warn(f'Inference platform error ({ret["error"]}), retry in {delay:.1f} s.')
+            time.sleep(delay)
+
+        return ret
+
+    def _wait_for_prompt_rate(self):
+        '''Waits until the next request can be sent 
+        without exceeding the `requests_per_second` parameter.'''
+        requests_per_second = float(self.params.get('requests_per_second', 0) or 0)
+        if requests_per_second <= 0:
+            return
+
+        with self.prompt_rate_lock:
+            now = time.monotonic()
+            send_time = max(now, self.prompt_next_time)
+            self.prompt_next_time = send_time + 1 / requests_per_second
+
+        if send_time > now:
+            time.sleep(send_time - now)
@@ -0,0 +1,86 @@
+import sqlite3
+import threading
+import json
+import time
+from pathlib import Path
+
+
+class Provenance:
+    '''Records how each output (file or folder) of the operators was produced,
+    in a SQLite database next to collections.json:
+    * the operator which wrote it;
+    * a hash of the operator parameters;
+    * the fingerprint of each of its input files when it was produced.
+
+    Inputs are often the outputs of upstream operators (e.g. clip => sound => transcription),
+    so the fingerprint of an input also identifies the version of the upstream artifact.
+    An output is stale when any of those has changed since it was recorded.
+    '''
+
+    def __init__(self, database_path: Path):
+        self.database_path = database_path
+        self.lock = threading.RLock()
+        # default journal mode, WAL doesn't work on network file systems
+        self.connection = sqlite3.connect(str(database_path), check_same_thread=False)
+        self.connection.executescript('''
+            CREATE TABLE IF NOT EXISTS outputs (
+                path TEXT PRIMARY KEY,
+                operator TEXT NOT NULL,
+                params_hash TEXT NOT NULL,
+                inputs TEXT NOT NULL,
+                updated REAL NOT NULL
+            );
+        ''')
+        self.connection.commit()
+
+    def get(self, output_path: Path) -> dict:
+        '''Returns the record of an output, None if not found.'''
+        ret = None
+
+        with self.lock:
+            row = self.connection.execute(
+                'SELECT operator, params_hash, inputs, updated FROM outputs WHERE path = ?', (str(output_path),)
+            ).fetchone()
+
+        if row:
+            ret = {
+                'operator': row[0],
+                'params_hash': row[1],
+                'inputs': json.loads(row[2]),
+                'updated': row[3],
+            }
+
+        return ret
+
+    def set(self, output_path: Path, record: dict):
+        with self.lock:
+            self.connection.execute('''
+                INSERT INTO outputs (path, operator, params_hash, inputs, updated)
+                VALUES (?, ?, ?, ?, ?)
+                ON CONFLICT (path) DO UPDATE SET
+                    operator = excluded.operator, params_hash = excluded.params_hash,
+                    inputs = excluded.inputs, updated = excluded.updated
+            ''', (str(output_path), record['operator'], record['params_hash'], json.dumps(record['inputs']), time.time()))
+            self.connection.commit()
+
+    def get_changes(self, record: dict, current: dict) -> [str]:
+        '''Returns the differences between a record and the current state
+        (e.g. ['parameters', 'input: /path/to/clip.mp4']). Empty if up to date.'''
+        ret = []
+
+        if record['operator'] != current['operator']:
+            ret.append('operator')
+        if record['params_hash'] != current['params_hash']:
+            ret.append('parameters')
+        for input_path, fingerprint in current['inputs'].items():
+            if record['inputs'].get(input_path, None) != fingerprint:
+                ret.append(f'input: {input_path}')
+        for input_path in record['inputs']:
+            if input_path not in current['inputs']:
+                ret.append(f'input: {input_path}')
+
+        return ret
+
+    def close(self):
+        with self.lock:
+            self.connection.close()
@@ -0,0 +1,159 @@
+import sqlite3
+import threading
+import json
+import time
+from pathlib import Path
+
+# depth of the keys stored as separate rows,
+# e.g. ['data', 'middle.jpg', 'shot_scale'] in a frames.json
+KEY_DEPTH = 3
+
+
+class Results:
+    '''Results of the operators for a collection (e.g. the content of all frames.json),
+    stored in a SQLite database rather than in the json files.
+
+    Each data file is split into rows, one per key path down to KEY_DEPTH levels
+    (e.g. data > middle.jpg > shot_scale).
+    A writer only updates the rows it has changed since it read the file,
+    in a single transaction, so concurrent writers
+    (e.g. two operators adding different attributes to the same frames)
+    don't overwrite each other's results.
+
+    The database uses WAL mode so readers don't block the writer.
+    '''
+
+    def __init__(self, database_path: Path):
+        self.database_path = database_path
+        self.lock = threading.RLock()
+        database_path.parent.mkdir(parents=True, exist_ok=True)
+        # isolation_level None: transactions are explicit (BEGIN IMMEDIATE)
+        self.connection = sqlite3.connect(str(database_path), check_same_thread=False, timeout=60, isolation_level=None)
+        self.connection.execute('PRAGMA journal_mode=WAL')
+        self.connection.executescript('''
+            CREATE TABLE IF NOT EXISTS files (
+                file TEXT PRIMARY KEY,
+                updated REAL NOT NULL
+            );
+            CREATE TABLE IF NOT EXISTS results (
+                file TEXT NOT NULL,
+                key TEXT NOT NULL,
+                value TEXT NOT NULL,
+                PRIMARY KEY (file, key)
+            );
+        ''')
+
+    def has_file(self, file: str) -> bool:
+        with self.lock:
+            row = self.connection.execute('SELECT 1 FROM files WHERE file = ?', (file,)).fetchone()
+        return row is not None
+
+    def get_files(self) -> [str]:
+        with self.lock:
+            ret = [r[0] for r in self.connection.execute('SELECT file FROM files ORDER BY file')]
+        return ret
+
+    def read(self, file: str) -> dict:
+        '''Returns the rows of a file: {key path (json list): value (json)}.'''
+        with self.lock:
+            ret = {
+                r[0]: r[1]
+                for r in self.connection.execute('SELECT key, value FROM results WHERE file = ? ORDER BY rowid', (file,))
+            }
+        return ret
+
+    def write(self, file: str, changed: dict, deleted: [str]):
+        '''Upserts the changed rows {key: value} and removes the deleted keys
+        of a file, in a single transaction.'''
+        with self.lock:
+            self.connection.execute('BEGIN IMMEDIATE')
+            try:
+                self.connection.execute('''
+                    INSERT INTO files (file, updated) VALUES (?, ?)
+                    ON CONFLICT (file) DO UPDATE SET updated = excluded.updated
+                ''', (file, time.time()))
+                self.connection.executemany(
+                    'DELETE FROM results WHERE file = ? AND key = ?',
+                    [(file, key) for key in deleted]
+                )
+                self.connection.executemany('''
+                    INSERT INTO results (file, key, value) VALUES (?, ?, ?)
+                    ON CONFLICT (file, key) DO UPDATE SET value = excluded.value
+                ''', [(file, key, value) for key, value in changed.items()])
+                self.connection.execute('COMMIT')
+            except BaseException as e:
+                self.connection.execute('ROLLBACK')
+                raise e
+
+    def delete(self, file: str, is_folder=False):
+        '''Removes a file, or all the files under a folder.'''
+        if is_folder:
+            # '/' + 1 == '0', so this range covers all paths under folder/
+            condition, args = 'file >= ? AND file < ?', (file + '/', file + '0')
+        else:
+            condition, args = 'file = ?', (file,)
+
+        with self.lock:
+            self.connection.execute('BEGIN IMMEDIATE')
+            try:
+                self.connection.execute(f'DELETE FROM results WHERE {condition}', args)
+                self.connection.execute(f'DELETE FROM files WHERE {condition}', args)
+                self.connection.execute('COMMIT')
+            except BaseException as e:
+                self.connection.execute('ROLLBACK')
+                raise e
+
+    def close(self):
+        with self.lock:
+            self.connection.close()
+
+
+class DataFileContent(dict):
+    '''Content of a data file read from the database.
+    Also holds the rows as they were read (snapshot),
+    so only the rows the operator has changed are written back.
+    The snapshot is released with the content, 
+    whether or not the operator writes it.'''
+
+    def __init__(self, content: dict, snapshot: dict):
+        super().__init__(content)
+        self.snapshot = snapshot
+
+
+def flatten(content: dict) -> dict:
+    '''Returns the rows of a content: {key path (json list): value (json)}.'''
+    ret = {}
+
+    def flatten_value(value, path):
+        if isinstance(value, dict) and value and len(path) < KEY_DEPTH:
+            for k, v in value.items():
+                flatten_value(v, path + [k])
+        else:
+            ret[json.dumps(path)] = json.dumps(value)
+
+    flatten_value(content, [])
+
+    return ret
+
+
+def unflatten(rows: dict) -> dict:
+    '''Rebuilds a content from its rows (see flatten).'''
+    ret = {}
+
+    for key, value in rows.items():
+        path = json.loads(key)
+        value = json.loads(value)
+        if not path:
+            ret = value
+            continue
+        parent = ret
+        for k in path[:-1]:
+            if not isinstance(parent.get(k, None), dict):
+                parent[k] = {}
+            parent = parent[k]
+        if isinstance(value, dict) and isinstance(parent.get(path[-1], None), dict):
+            parent[path[-1]].update(value)
+        else:
+            parent[path[-1]] = value
+
+    return ret
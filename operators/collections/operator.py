@@ -19,11 +19,10 @@ class Collections(Operator):
             is_dir = (col_path).is_dir()
             video_paths = []
             if is_dir:
-                for video_folder_path in col_path.iterdir():
-                    if video_folder_path.is_dir():
-                        video_path = self._get_video_file_path(video_folder_path, True)
-                        if video_path:
-                            video_paths.append(video_path)
+                for video_folder_path in self._get_video_folder_paths(col):
+                    video_path = self._get_video_file_path(video_folder_path, True)
+                    if video_path:
+                        video_paths.append(video_path)
                 col_summary = f'has {len(video_paths)} videos under {col_path}'
             else:
                 col_summary = "NOT FOUND"
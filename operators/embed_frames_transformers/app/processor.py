@@ -8,6 +8,7 @@ from transformers import AutoModel
 import signal
 import os
 import re
+import threading
 # from qwen_vl_utils import process_vision_info
 from datetime import datetime
 
@@ -64,6 +65,9 @@ def format_time(delta):
     minutes, seconds = divmod(remainder, 60)
     return f"{hours:02d}:{minutes:02d}:{seconds:02d}"    
 
+def is_image(input):
+    return bool(re.search(r'\.(jpg|png)$', input))
+
 class Processor: 
     '''...
     '''
@@ -89,40 +93,94 @@ class Processor:
         )
 
         self.model = model
+        # the service handles requests in parallel threads but the model isn't thread-safe,
+        # so only the reception of the requests overlaps, not the inference
+        self.lock = threading.Lock()
 
     def process(self, input):
         # we need to read it again
         # PARAMS = json.loads(Path('/app/params.json').read_text())
         ret = None
 
-        is_image = False
-        is_image = re.search(r'\.(jpg|png)$', input)
+        if is_image(input):
+            ret = self.encode_images([input])
+        else:
+            with self.lock:
+                if 'jina-clip-v2' in MODEL:
+                    # https://huggingface.co/jinaai/jina-clip-v2
+                    ret = [self.model.encode_text(
+                        input,
+                        task="retrieval.query",
+                    )]
+                if 'jina-embeddings-v4' in MODEL:
+                    ret = self.model.encode_text(
+                        texts=[input],
+                        task="retrieval",
+                        prompt_name="query",
+                    )
+
+        return ret[0].tolist()
 
-        if is_image:
+    def encode_images(self, image_paths):
+        '''Returns one vector per image, the images are encoded together.'''
+        ret = None
+
+        with self.lock:
             if 'jina-clip-v2' in MODEL:
                 ret = self.model.encode_image(
-                    [input]
-                )        
+                    image_paths,
+                    batch_size=len(image_paths),
+                )
             if 'jina-embeddings-v4' in MODEL:
                 ret = self.model.encode_image(
-                    images=[input],
+                    images=image_paths,
                     task="retrieval",
-                )        
-        else:
-            if 'jina-clip-v2' in MODEL:
-                # https://huggingface.co/jinaai/jina-clip-v2
-                ret = [self.model.encode_text(
-                    input,
-                    task="retrieval.query",
-                )]
-            if 'jina-embeddings-v4' in MODEL:
-                ret = self.model.encode_text(
-                    texts=[input],
-                    task="retrieval",
-                    prompt_name="query",
+                    batch_size=len(image_paths),
                 )
 
-        return ret[0].tolist()
+        return ret
+
+    def process_batch(self, inputs):
+        '''Returns one response (error & result) per input, in the same order.
+        The images are encoded by batches of `batch_size` images.
+        If a batch fails, its images are encoded one by one to find the faulty ones.'''
+        ret = [None] * len(inputs)
+
+        batch_size = max(1, int(PARAMS.get('batch_size', 1) or 1))
+
+        image_indices = [i for i, input in enumerate(inputs) if is_image(input)]
+        for start in range(0, len(image_indices), batch_size):
+            indices = image_indices[start:start + batch_size]
+            try:
+                vectors = self.encode_images([inputs[i] for i in indices])
+                for i, vector in zip(indices, vectors):
+                    ret[i] = {
+                        'error': '',
+                        'result': vector.tolist(),
+                    }
+            except Exception as e:
+                if len(indices) == 1:
+                    ret[indices[0]] = {
+                        'error': f'{type(e)}: {str(e)}',
+                        'result': [],
+                    }
+
+        # texts and images of failed batches
+        for i, input in enumerate(inputs):
+            if ret[i] is not None:
+                continue
+            try:
+                ret[i] = {
+                    'error': '',
+                    'result': self.process(input),
+                }
+            except Exception as e:
+                ret[i] = {
+                    'error': f'{type(e)}: {str(e)}',
+                    'result': [],
+                }
+
+        return ret
 
 if __name__ == '__main__':
     response = {
@@ -187,12 +245,55 @@ if __name__ == '__main__':
 
                 return ret
 
+            @app.route('/process_batch', methods=['POST'])
+            def process_batch():
+                try:
+                    inputs = (request.get_json(silent=True) or {}).get('input_paths', None)
+
+                    if inputs:
+                        vram_before = get_vram()
+                        t0 = datetime.now()
+                        res = processor.process_batch(inputs)
+                        t1 = datetime.now()
+                        response = {
+                            'error': '',
+                            'result': res,
+                            'stats': {
+                                'vram_before': vram_before,
+                                'vram_after': get_vram(),
+                                'duration': format_time(t1 - t0),
+                            }
+                        }
+                    else:
+                        response = {
+                            'error': 'inputs not provided',
+                            'result': [],
+                        }
+
+                except Exception as e:
+                    error_message = str(e)
+                    stack_trace = traceback.format_exc()
+                    error_path = Path('/app/error.log')
+                    log_message = f'''Message: {error_message}\nStack Trace:\n{stack_trace}'''
+                    error_path.write_text(log_message)
+                    response = {
+                        'error': f'{type(e)}: {error_message}',
+                        'result': [],
+                        'stack': stack_trace
+                    }
+
+                ret = jsonify(response)
+                ret.headers.add('Access-Control-Allow-Origin', '*')
+
+                return ret
+
             @app.route('/stop', methods=['GET'])
             def stop():
                 # yes... Flask does NOT have a shutdown function.
                 os.kill(os.getpid(), signal.SIGINT)
 
-            app.run(debug=True, host='0.0.0.0', port=PORT)
+            # e.g. serve 5001, when another service already listens on the default port
+            app.run(debug=True, host='0.0.0.0', port=int(arguments[2]) if len(arguments) > 2 else PORT)
 
         elif first_arg == 'load_model':
             response = {
@@ -1,9 +1,13 @@
 from pathlib import Path
-from ..base.operator import Operator
+from ..base.operator import Operator, SERVICE_BATCH_SIZE_DEFAULT
 import re
 import json
 import datetime
 import hashlib
+from array import array
+
+# entries of the content cache for this operator (see base/cache.py)
+CACHE_NAMESPACE = 'embedding'
 
 class EmbedFramesTransformers(Operator):
     '''Generate a vector from a frame using an embedding model'''
@@ -19,27 +23,59 @@ class EmbedFramesTransformers(Operator):
 
         for col in self.context['collections']:
             collection_path = col['attributes']['path']
-            for frames_folder_path in sorted(collection_path.glob('**/shots/*/')):
-                self._process_frame(frames_folder_path, collection_path)
+            self._process_frames(self._get_shot_folder_paths(col), collection_path)
 
         return ret
 
-    def _process_frame(self, frames_folder_path: Path, collection_path: Path):
-        frames_meta_path = Path(frames_folder_path / 'frames.json')
-        frames_meta_content = self._read_data_file(frames_meta_path, is_data_dict=True)
-        frames_data = frames_meta_content['data']
-        
+    def _process_clip(self, clip_path: Path, collection_path: Path):
+        self._process_frames(sorted(clip_path.parent.glob('shots/*/')), collection_path)
+
+    def _process_frames(self, frames_folder_paths: [Path], collection_path: Path):
+        '''Embeds the pending frames of many shots together, 
+        so the model receives full batches rather than the frame or two of each shot.
+        The frames.json of the shots are written after each window of shots.'''
+        store = None
+        if self._get_storage() == 'binary':
+            store = self._get_embedding_store(collection_path, self.get_param('model'))
+
+        # [frames_meta_path, frames_meta_content]
+        shots = []
+        # [frame_file_path, frame_data, prompt_hash]
+        pending_frames = []
+
+        # embed enough frames at once to keep all the batches in flight full
+        window_size = int(self.get_param('batch_size') or SERVICE_BATCH_SIZE_DEFAULT) * self._get_service_concurrency() * 4
+
+        for frames_folder_path in frames_folder_paths:
+            frames_meta_path = Path(frames_folder_path / 'frames.json')
+            frames_meta_content = self._read_data_file(frames_meta_path, is_data_dict=True)
+            shot_pending_frames = self._get_pending_frames(frames_folder_path, frames_meta_content['data'], store)
+            if not shot_pending_frames:
+                continue
+
+            shots.append([frames_meta_path, frames_meta_content])
+            pending_frames += shot_pending_frames
+
+            if len(pending_frames) >= window_size:
+                self._embed_pending_frames(shots, pending_frames, store, collection_path)
+                shots, pending_frames = [], []
+
+        self._embed_pending_frames(shots, pending_frames, store, collection_path)
+
+    def _get_pending_frames(self, frames_folder_path: Path, frames_data: dict, store) -> [list]:
+        '''Returns [frame_file_path, frame_data, prompt_hash] for the frames of a shot
+        which need to be embedded.'''
         frame_file_paths = list(frames_folder_path.glob('*.jpg'))
 
-        has_changed = False
+        data_key = 'embedding'
+
+        pending_frames = []
         for frame_file_path in frame_file_paths:
             if self.get_param('frame_filter') not in str(frame_file_path):
                 continue
 
             if not self._is_path_selected(frame_file_path):
-                return
-
-            data_key = 'embedding'
+                return []
 
             frame_id = re.sub(r'^(\d+).*$', r'\1', frame_file_path.name)
             frame_data = frames_data.get(frame_id, None)
@@ -57,22 +93,82 @@ class EmbedFramesTransformers(Operator):
                 ]
             ]))
 
-            if not self._is_redo() and frame_data.get(data_key, {}).get('prompt_hash', None) == prompt_hash:
-                # we already got that answer, skip
-                continue
-
-            answer = '[]'
-            res = self._call_service_processor(frame_file_path, collection_path)
-            if res['error']:
-                self._error(res['error'])
-
-            # res = self._run_in_operator_container(command_args, binding, share_network=True)
-            # response = json.loads(res.stdout)
-            # TODO: check for errors
-            answer = res['result']
-
+            embedding = frame_data.get(data_key, {})
+            if not self._is_redo() and embedding.get('prompt_hash', None) == prompt_hash:
+                if store is None or embedding.get('store', None) in store:
+                    # we already got that answer, skip
+                    continue
+
+            pending_frames.append([frame_file_path, frame_data, prompt_hash])
+
+        return pending_frames
+
+    def _embed_pending_frames(self, shots: [list], pending_frames: [list], store, collection_path: Path):
+        if not pending_frames:
+            return
+
+        data_key = 'embedding'
+
+        # identical images (e.g. overlapping clips, or the last and first frames of two shots)
+        # are embedded once, and only if their vector is not already in the cache
+        cache = self._get_content_cache()
+        keys = [p[0] for p in pending_frames]
+        cached_vectors = {}
+        if cache is not None:
+            keys = [
+                f'{self.get_param("model")}:{self._get_content_hash(frame_file_path)}'
+                for frame_file_path, frame_data, prompt_hash in pending_frames
+            ]
+            if not self._is_redo():
+                # an empty value is not a valid embedding, the frame is embedded again
+                cached_vectors = {
+                    key: list(array('f', value))
+                    for key, value in cache.get_many(CACHE_NAMESPACE, keys).items()
+                    if value
+                }
+
+        # key => path of the first frame with that key
+        missing_frames = {}
+        for key, [frame_file_path, frame_data, prompt_hash] in zip(keys, pending_frames):
+            if key not in cached_vectors and key not in missing_frames:
+                missing_frames[key] = frame_file_path
+
+        self._debug(f'{len(pending_frames)} frames, {len(pending_frames) - len(missing_frames)} embeddings reused')
+
+        # embed all the missing frames in as few requests as possible
+        new_vectors = {}
+        if missing_frames:
+            responses = self._call_service_processor_batch(list(missing_frames.values()), collection_path)
+            for [key, frame_file_path], res in zip(missing_frames.items(), responses):
+                # nothing is stored or recorded for a failed frame, so it's embedded again next time
+                if res.get('error', ''):
+                    self._error(f'Processing service returned error. Input = {frame_file_path}; Error = {res["error"]}.')
+                vector = self._parse_dirty_json(res['result'])
+                if not vector:
+                    self._error(f'Processing service returned no embedding. Input = {frame_file_path}.')
+                new_vectors[key] = vector
+
+        if cache is not None:
+            # float32, as returned by the model
+            cache.set_many(CACHE_NAMESPACE, {
+                key: array('f', vector).tobytes()
+                for key, vector in new_vectors.items()
+                if vector
+            })
+
+        vectors = [cached_vectors[key] if key in cached_vectors else new_vectors[key] for key in keys]
+
+        store_keys = [None] * len(pending_frames)
+        if store is not None:
+            # vectors go to the binary store, frames.json only references them
+            store_keys = [
+                frame_file_path.relative_to(collection_path).as_posix()
+                for frame_file_path, frame_data, prompt_hash in pending_frames
+            ]
+            store.add(store_keys, vectors)
+
+        for [frame_file_path, frame_data, prompt_hash], vector, store_key in zip(pending_frames, vectors, store_keys):
             frame_data[data_key] = {
-                'value': self._parse_dirty_json(answer),
                 'operator': self._get_operator_name(),
                 'model': self.get_param('model'),
                 # 'context_length': self.get_param('context_length'),
@@ -80,11 +176,21 @@ class EmbedFramesTransformers(Operator):
                 'updated': datetime.datetime.now(datetime.timezone.utc).isoformat(),
                 'prompt_hash': prompt_hash,
             }
-            has_changed = True
-                
-        if has_changed:
+            if store_key is None:
+                frame_data[data_key]['value'] = vector
+            else:
+                frame_data[data_key]['store'] = store_key
+                frame_data[data_key]['dimension'] = len(vector)
+
+        for frames_meta_path, frames_meta_content in shots:
             self._write_data_file(frames_meta_path, frames_meta_content)
 
+    def _get_storage(self):
+        ret = self.get_param('storage') or 'binary'
+        if ret not in ['binary', 'json']:
+            self._error(f'Unsupported value for `storage` parameter: "{ret}". Please use "binary" or "json".')
+        return ret
+
     def short_hash(self, s, length=8):
         hash_object = hashlib.sha256(s.encode('utf-8'))
         return hash_object.hexdigest()[:length]
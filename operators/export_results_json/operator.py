@@ -0,0 +1,36 @@
+from ..base.operator import Operator
+from ..base.results import unflatten
+
+
+class ExportResultsJson(Operator):
+    '''Write the results stored in the sqlite backend into the json data files'''
+
+    def get_supported_arguments(self):
+        ret = super().get_supported_arguments()
+        ret['filter'] = True
+        return ret
+
+    def _apply(self):
+        ret = None
+
+        for col in self.context['collections']:
+            collection_path = col['attributes']['path']
+            results = self._get_results_database(collection_path, create=False)
+            if results is None:
+                self._log(f'{col["id"]} has no results database')
+                continue
+
+            count = 0
+            for file in results.get_files():
+                data_file_path = collection_path / file
+                if not self._is_path_selected(data_file_path):
+                    continue
+                if not data_file_path.parent.exists():
+                    # e.g. shots folder removed since then
+                    continue
+                self.write_json(data_file_path, unflatten(results.read(file)))
+                count += 1
+
+            self._log(f'{col["id"]}: {count} data files exported')
+
+        return ret
@@ -1,8 +1,17 @@
 from pathlib import Path
 from ..base.operator import Operator
+import re
+import os
+import wave
 
 # quality of mp3 output from 0 (poorest) to 9 (best)
 SOUND_QUALITY_DEFAULT = 4
+# name of the clip folders made by make_clips_ffmpeg: start time code (HH.MM.SS) and duration in seconds
+CLIP_FOLDER_NAME_PATTERN = r'^(\d\d)\.(\d\d)\.(\d\d)-(\d+)$'
+# bytes per sample of the PCM stream (s16le)
+SAMPLE_WIDTH = 2
+# duration of the PCM stream read at once, in seconds
+STREAM_CHUNK_DURATION = 10
 
 class ExtractSoundFFMPEG(Operator):
     '''Extract sound from clips using FFMPEG'''
@@ -11,22 +20,50 @@ class ExtractSoundFFMPEG(Operator):
         ret = super().get_supported_arguments()
         ret['redo'] = True
         ret['filter'] = True
+        ret['jobs'] = True
         # TODO: add parameter for mp3 vs wav
         # TODO: add parameter for quality or frequency
         return ret
 
+    def _use_worker_container(self):
+        return True
+
+    def _get_provenance_ignored_params(self):
+        # the same sound is extracted from the clip or from the video
+        return super()._get_provenance_ignored_params() + ['source']
+
     def _apply(self):
         ret = None
 
+        work_units = []
         for col in self.context['collections']:
-            for video_folder_path in col['attributes']['path'].iterdir():
-                if video_folder_path.is_dir():
-                    for clip_folder_path in sorted(video_folder_path.iterdir()):
-                        if clip_folder_path.is_dir():
-                            clip_path = self._get_video_file_path(clip_folder_path)
-                            if clip_path:
-                                self._extract_sound(clip_path)
+            if self._get_source() == 'video':
+                # one work unit per video, which sound is decoded once for all its clips
+                clip_folder_paths_by_video = {}
+                for clip_folder_path in self._get_clip_folder_paths(col):
+                    clip_folder_paths_by_video.setdefault(clip_folder_path.parent, []).append(clip_folder_path)
+                for video_folder_path, clip_folder_paths in clip_folder_paths_by_video.items():
+                    work_units.append([self._extract_sounds_from_video, [video_folder_path, clip_folder_paths]])
+            else:
+                for clip_folder_path in self._get_clip_folder_paths(col):
+                    clip_path = self._get_video_file_path(clip_folder_path)
+                    if clip_path:
+                        work_units.append([self._extract_sound, [clip_path]])
+
+        self._run_work_units(work_units)
+
+        return ret
 
+    def _process_clip(self, clip_path: Path, collection_path: Path):
+        if self._get_source() == 'video':
+            self._extract_sounds_from_video(clip_path.parent.parent, [clip_path.parent])
+        else:
+            self._extract_sound(clip_path)
+
+    def _get_source(self):
+        ret = self.get_param('source') or 'clip'
+        if ret not in ['clip', 'video']:
+            self._error(f'Unsupported value for `source` parameter: "{ret}". Please use "clip" or "video".')
         return ret
 
     def _extract_sound(self, clip_path: Path):
@@ -35,12 +72,12 @@ class ExtractSoundFFMPEG(Operator):
 
         sound_path = clip_path.with_suffix('.wav')
 
-        if self._is_redo() or not sound_path.exists():
-            print(sound_path)
+        if self._needs_update(sound_path, [clip_path]):
+            self._log(sound_path)
             command = [
                 "ffmpeg",
                 "-i", clip_path,
-                # "-vn", 
+                "-vn", # no need to decode the video
                 # "-acodec", "libmp3lame", # mp3
                 # "-acodec", "pcm_s16le", # wav
                 "-ar", str(self.get_param('audio_rate')), # sample rate
@@ -52,3 +89,100 @@ class ExtractSoundFFMPEG(Operator):
                 sound_path
             ]
             self._run_in_operator_container(command, [clip_path.parent, '/data'], same_user=True)
+            self._record_provenance(sound_path, [clip_path])
+
+    def _extract_sounds_from_video(self, video_folder_path: Path, clip_folder_paths: [Path]):
+        '''Extracts the sound of clips from the video they were cut from.
+        The start and duration of each clip are read from the name of its folder
+        (e.g. 00.58.16-298, see make_clips_ffmpeg).
+        Clips which can't be located in the video are processed from their own file.'''
+        video_path = self._get_video_file_path(video_folder_path, direct_child_only=True)
+
+        # [start (seconds), end (seconds), sound_path, input_path]
+        clips = []
+        for clip_folder_path in clip_folder_paths:
+            clip_path = self._get_video_file_path(clip_folder_path, direct_child_only=True)
+            match = re.match(CLIP_FOLDER_NAME_PATTERN, clip_folder_path.name)
+            if not (video_path and match):
+                # e.g. a clip which is not from annotations, or without its video
+                if clip_path:
+                    self._extract_sound(clip_path)
+                continue
+
+            sound_path = clip_folder_path / f'{clip_folder_path.name}.wav'
+            if not self._is_path_selected(clip_path or sound_path):
+                continue
+
+            # the same input as when the sound is extracted from the clip,
+            # so switching the `source` doesn't make the sounds out of date
+            input_path = clip_path or video_path
+            if not self._needs_update(sound_path, [input_path]):
+                continue
+
+            hours, minutes, seconds, duration = [int(g) for g in match.groups()]
+            start = hours * 3600 + minutes * 60 + seconds
+            clips.append([start, start + duration, sound_path, input_path])
+
+        if clips:
+            self._slice_sound(video_path, sorted(clips))
+
+    def _slice_sound(self, video_path: Path, clips: [list]):
+        '''Decodes the sound of a video once, from the start of the first clip to the end of the last,
+        and writes the sound of each clip [start, end, sound_path, input_path] 
+        (sorted by start, times in seconds) as it is streamed.
+        input_path is the provenance of the sound (the clip, or the video without clip file).'''
+        audio_rate = int(self.get_param('audio_rate'))
+        offset = clips[0][0]
+        end = max(clip[1] for clip in clips)
+
+        for clip in clips:
+            self._log(clip[2])
+
+        command = [
+            "ffmpeg",
+            "-loglevel", "error",
+            "-ss", str(offset),
+            "-t", str(end - offset),
+            "-i", video_path,
+            "-vn", "-sn",
+            "-ar", str(audio_rate),
+            "-ac", "1",
+            "-f", "s16le", # raw PCM
+            "pipe:1"
+        ]
+
+        # clip index => wav file being written
+        writers = {}
+        # number of samples read so far
+        position = 0
+        chunk_size = SAMPLE_WIDTH * audio_rate * STREAM_CHUNK_DURATION
+        for chunk in self._stream_from_operator_container(command, [video_path.parent, Path('/data')], chunk_size):
+            sample_count = len(chunk) // SAMPLE_WIDTH
+            for i, [start, end, sound_path, input_path] in enumerate(clips):
+                # range of the clip in this chunk, in samples
+                first = max(0, (start - offset) * audio_rate - position)
+                last = min(sample_count, (end - offset) * audio_rate - position)
+                if first >= last:
+                    continue
+                if i not in writers:
+                    writers[i] = self._open_wave_file(self._get_tmp_sound_path(sound_path), audio_rate)
+                writers[i].writeframes(chunk[first * SAMPLE_WIDTH:last * SAMPLE_WIDTH])
+            position += sample_count
+
+        for i, [start, end, sound_path, input_path] in enumerate(clips):
+            if i not in writers:
+                # e.g. a clip beyond the end of the sound
+                writers[i] = self._open_wave_file(self._get_tmp_sound_path(sound_path), audio_rate)
+            writers[i].close()
+            os.replace(self._get_tmp_sound_path(sound_path), sound_path)
+            self._record_provenance(sound_path, [input_path])
+
+    def _get_tmp_sound_path(self, sound_path: Path):
+        return sound_path.with_name(sound_path.name + '.tmp')
+
+    def _open_wave_file(self, sound_path: Path, audio_rate: int):
+        ret = wave.open(str(sound_path), 'wb')
+        ret.setnchannels(1)
+        ret.setsampwidth(SAMPLE_WIDTH)
+        ret.setframerate(audio_rate)
+        return ret
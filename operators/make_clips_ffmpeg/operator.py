@@ -5,6 +5,10 @@ import json
 from datetime import datetime
 import subprocess
 
+# maximum time (in seconds) between two clips cut by the same ffmpeg command,
+# beyond that seeking to the next clip is faster than decoding up to it
+MAX_DECODED_GAP = 30
+
 class MakeClipsFFMPEG(MakeClips):
     '''Extract clips from videos based on timecodes in annotation files'''
 
@@ -12,48 +16,172 @@ class MakeClipsFFMPEG(MakeClips):
         ret = super().get_supported_arguments()
         ret['filter'] = True
         ret['redo'] = True
+        ret['jobs'] = True
         return ret
 
+    def _use_worker_container(self):
+        return True
+
     def _apply(self):
         ret = None
         
+        # one work unit per video, so its clips can be cut by the same ffmpeg commands
+        work_units = [
+            [self._make_clips, [annotations, video_folder_path]]
+            for video_folder_path, annotations, col
+            in self._get_annotations_by_video()
+        ]
+
+        self._run_work_units(work_units)
+
+        return ret
+
+    def _iter_processed_clips(self):
+        for video_folder_path, annotations, col in self._get_annotations_by_video():
+            for clip_path in self._make_clips(annotations, video_folder_path):
+                yield clip_path, col['attributes']['path']
+
+    def _get_annotations(self):
+        '''Returns a list of (annotation, video_folder_path, collection)
+        for all the annotations matching a video folder.'''
+        ret = []
+
         self._index_annotation_files()
 
         for col in self.context['collections']:
-            for video_folder_path in col['attributes']['path'].iterdir():
-                if video_folder_path.is_dir():
-                    hash = self._get_hash_from_path(col, video_folder_path)
-                    annotations_path = self.annotations_index.get(hash, None)
-                    if annotations_path:
-                        for annotation in self._read_annotations(annotations_path):
-                            self._make_clip(annotation, video_folder_path)
+            for video_folder_path in self._get_video_folder_paths(col):
+                hash = self._get_hash_from_path(col, video_folder_path)
+                annotations_path = self.annotations_index.get(hash, None)
+                if annotations_path:
+                    for annotation in self._read_annotations(annotations_path):
+                        ret.append([annotation, video_folder_path, col])
+
+        return ret
+
+    def _get_annotations_by_video(self):
+        '''Returns a list of (video_folder_path, annotations, collection),
+        one per video folder with annotations.'''
+        ret = []
+
+        for annotation, video_folder_path, col in self._get_annotations():
+            if ret and ret[-1][0] == video_folder_path:
+                ret[-1][1].append(annotation)
+            else:
+                ret.append([video_folder_path, [annotation], col])
 
         return ret
 
-    def _make_clip(self, annotation, video_folder_path):
-        clip_info = self._get_annotation_info(annotation, video_folder_path)
-        if not clip_info: return
+    def _make_clips(self, annotations, video_folder_path):
+        '''Extracts the clips of annotations from their video.
+        The out of date clips are cut by batches of up to `batch_size` consecutive clips,
+        each batch with a single ffmpeg command (see _get_clip_batches).
+        Returns the paths of the clips, extracted or already up to date.'''
+        ret = []
 
         video_path = self._get_video_file_path(video_folder_path)
-        if not video_path: return
+        if not video_path: return ret
 
         if not self._is_path_selected(video_path):
-            return
+            return ret
+
+        # clip path => clip info, two annotations may have the same time codes
+        pending_clips = {}
+        for annotation in annotations:
+            clip_info = self._get_annotation_info(annotation, video_folder_path)
+            if not clip_info or clip_info['path'] in ret:
+                continue
+            ret.append(clip_info['path'])
+
+            if not clip_info['path'].parent.exists():
+                # exist_ok: two annotations may share the same clip folder
+                clip_info['path'].parent.mkdir(exist_ok=True)
+
+            if self._needs_update(clip_info['path'], [video_path]):
+                pending_clips[clip_info['path']] = clip_info
+
+        codec = self._get_codec()
+        for batch in self._get_clip_batches(list(pending_clips.values()), codec):
+            for clip_info in batch:
+                self._log(clip_info['path'])
+            self._run_in_operator_container(self._get_clips_command(batch, video_path, codec), [video_folder_path, '/config'], same_user=True)
+            for clip_info in batch:
+                self._record_provenance(clip_info['path'], [video_path])
 
-        if not clip_info['path'].parent.exists():
-            clip_info['path'].parent.mkdir()
-        
-        if self._is_redo() or not clip_info['path'].exists():
-            print(clip_info['path'])
-            command = [
-                # "linuxserver/ffmpeg",
-                "ffmpeg",
-                "-ss", clip_info['start'],
-                "-t", str(clip_info['duration']),
+        return ret
+
+    def _get_codec(self):
+        ret = self.get_param('codec') or 'encode'
+        if ret not in ['encode', 'copy']:
+            self._error(f'Unsupported value for `codec` parameter: "{ret}". Please use "encode" or "copy".')
+        return ret
+
+    def _get_clip_batches(self, clip_infos, codec: str) -> [list]:
+        '''Groups the clips, in chronological order, 
+        by batches of up to `batch_size` clips cut by the same ffmpeg command.
+        When encoding, a new batch also starts after a gap of more than MAX_DECODED_GAP seconds,
+        as the video is decoded from the start of the first clip of a batch to the end of its last clip.'''
+        ret = []
+
+        batch_size = max(1, int(self.get_param('batch_size') or 1))
+
+        batch_end = 0
+        for clip_info in sorted(clip_infos, key=lambda c: c['start_seconds']):
+            is_far = codec == 'encode' and clip_info['start_seconds'] > batch_end + MAX_DECODED_GAP
+            if not ret or len(ret[-1]) >= batch_size or is_far:
+                ret.append([])
+                batch_end = 0
+            ret[-1].append(clip_info)
+            batch_end = max(batch_end, clip_info['start_seconds'] + clip_info['duration'])
+
+        return ret
+
+    def _get_clips_command(self, clip_infos, video_path: Path, codec: str):
+        '''Returns a ffmpeg command which cuts several clips from a video.
+        encode: the video is opened and decoded once, 
+        from the start of the first clip to the end of the last,
+        and each output keeps the frames of its clip.
+        copy: nothing is decoded, so each clip has its own input
+        which seeks directly to the key frame before the start of the clip.'''
+        ret = [
+            # "linuxserver/ffmpeg",
+            "ffmpeg",
+            "-y", # overwrite the clip if redo or out of date
+        ]
+
+        if codec == 'copy':
+            for clip_info in clip_infos:
+                ret += [
+                    "-ss", clip_info['start'],
+                    "-t", str(clip_info['duration']),
+                    "-i", video_path,
+                ]
+
+            for i, clip_info in enumerate(clip_infos):
+                ret += [
+                    "-map", f"{i}:v:0",
+                    "-map", f"{i}:a:0?",
+                    # no re-encoding, the clip starts at the key frame before its start time
+                    "-c", "copy", "-avoid_negative_ts", "make_zero",
+                    clip_info['path'],
+                ]
+        else:
+            start = min(clip_info['start_seconds'] for clip_info in clip_infos)
+            ret += [
+                "-ss", str(start),
                 "-i", video_path,
-                clip_info['path']
             ]
-            self._run_in_operator_container(command, [video_folder_path, '/config'], same_user=True)
+
+            for clip_info in clip_infos:
+                ret += [
+                    "-map", "0:v:0",
+                    "-map", "0:a:0?",
+                    # relative to the start of the input, frame accurate
+                    "-ss", str(clip_info['start_seconds'] - start),
+                    "-t", str(clip_info['duration']),
+                    clip_info['path'],
+                ]
+
+        return ret
 
     def _get_annotation_info(self, annotation, video_folder_path):
         ret = None
@@ -72,6 +200,7 @@ class MakeClipsFFMPEG(MakeClips):
             name = f'{time_codes_str[0].replace(":", ".")}-{duration_seconds}'
             ret = {
                 'start': time_codes_str[0],
+                'start_seconds': int((time_codes[0] - datetime(1900, 1, 1)).total_seconds()),
                 'duration': duration_seconds,
                 'name': name,
                 'path': video_folder_path / name / f'{name}.mp4'
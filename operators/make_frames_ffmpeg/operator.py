@@ -1,6 +1,19 @@
 from pathlib import Path
 from ..base.operator import Operator
 import json
+import shutil
+
+# maximum number of frame numbers compared one by one in a selection expression,
+# above that the expression branches on the frame number (see _get_selection_expression)
+SELECTION_LEAF_SIZE = 4
+
+# position of the frames taken from a shot (0: start, 1: end) and their name
+# .99 or 1 won't match a frame with timecode
+PLACES = [
+    [0, 'first'], 
+    [0.5, 'middle'], 
+    [1, 'last'],
+]
 
 class MakeFramesFFMPEG(Operator):
     '''Extract frames from shots using ffmpeg'''
@@ -9,38 +22,227 @@ class MakeFramesFFMPEG(Operator):
         ret = super().get_supported_arguments()
         ret['filter'] = True
         ret['redo'] = True
+        ret['jobs'] = True
         return ret
 
+    def _use_worker_container(self):
+        return True
+
+    def _get_provenance_ignored_params(self):
+        # only change how and from where the same frames are read
+        return super()._get_provenance_ignored_params() + ['sampling_method', 'source']
+
     def _apply(self):
         ret = None
 
+        work_units = []
         for col in self.context['collections']:
-            for shot_file_path in col['attributes']['path'].glob('**/shots/*/*.mp4'):
-                self._make_frames(shot_file_path)
+            if self._get_source() == 'clip':
+                for clip_folder_path in self._get_clip_folder_paths(col):
+                    clip_path = self._get_video_file_path(clip_folder_path)
+                    if clip_path:
+                        work_units.append([self._make_frames_from_clip, [clip_path]])
+            else:
+                shot_file_paths = self._get_shot_file_paths(col)
+                for shot_file_path in shot_file_paths:
+                    work_units.append([self._make_frames, [shot_file_path]])
+                # shots without video file (make_shots_scenedetect with `"split_video": "none"`)
+                shot_folder_paths = set(p.parent for p in shot_file_paths)
+                for shot_folder_path in self._get_shot_folder_paths(col):
+                    if shot_folder_path not in shot_folder_paths and (shot_folder_path / 'shot.json').exists():
+                        work_units.append([self._make_frames_from_descriptor, [shot_folder_path]])
+
+        self._run_work_units(work_units)
 
         return ret
 
-    def _make_frames(self, shot_file_path: Path):           
-        shot_folder_path = shot_file_path.parent
+    def _process_clip(self, clip_path: Path, collection_path: Path):
+        if self._get_source() == 'clip':
+            self._make_frames_from_clip(clip_path)
+            return
 
-        if not self._is_path_selected(shot_file_path):
+        for shot_folder_path in sorted(clip_path.parent.glob('shots/*/')):
+            shot_file_paths = sorted(shot_folder_path.glob('*.mp4'))
+            if shot_file_paths:
+                for shot_file_path in shot_file_paths:
+                    self._make_frames(shot_file_path)
+            elif (shot_folder_path / 'shot.json').exists():
+                self._make_frames_from_descriptor(shot_folder_path)
+
+    def _make_frames_from_clip(self, clip_path: Path):
+        '''Extracts the first, middle and last frames of all the shots of a clip
+        in a single pass over the clip, using the shot boundaries in shots/shots.csv.'''
+        if not self._is_path_selected(clip_path):
             return
 
-        frame_file_paths = list(shot_folder_path.glob('*.jpg'))
+        shots_folder_path = clip_path.parent / 'shots'
+        shots_table_path = shots_folder_path / 'shots.csv'
+        shots = self._read_shots_table(shots_folder_path)
+        if not shots:
+            self._debug(f'{clip_path}: no shots table found ({shots_table_path})')
+            return
+
+        # shots which frames have to be extracted
+        pending_shots = []
+        for shot in shots:
+            shot_folder_path = shots_folder_path / shot['folder_name']
+            frame_file_paths = list(shot_folder_path.glob('*.jpg'))
+            if not self._needs_update(shot_folder_path, [clip_path, shots_table_path], bool(frame_file_paths)):
+                continue
 
-        if self._is_redo():
             # remove existing frames .jpg and frames.json
             for frame_file_path in frame_file_paths:
                 frame_file_path.unlink()
-            frame_file_paths = []
+            self._delete_data_file(shot_folder_path / 'frames.json')
 
-            for frame_file_path in shot_folder_path.glob('frames.json'):
-                frame_file_path.unlink()
-        
-        if frame_file_paths:
+            pending_shots.append(shot)
+
+        if not pending_shots:
+            return
+
+        self._log(f'{clip_path} ({len(pending_shots)} shots)')
+
+        # frame number in the clip => paths of the frame files
+        samples = {}
+        for shot in pending_shots:
+            frame_count = shot['end_frame'] - shot['start_frame'] + 1
+            for place, place_name in PLACES:
+                frame_index = shot['start_frame'] + int(place * (frame_count - 1))
+                samples.setdefault(frame_index, []).append(shots_folder_path / shot['folder_name'] / f'{place_name}.jpg')
+        frame_indices = sorted(samples.keys())
+
+        # hidden, so it is not mistaken for a shot folder
+        tmp_folder_path = shots_folder_path / '.frames.tmp'
+        if tmp_folder_path.exists():
+            shutil.rmtree(tmp_folder_path)
+        tmp_folder_path.mkdir(parents=True)
+
+        # one decode of the clip, the selected frames are written in order: 000001.jpg, ...
+        # the filter is read from a file, it can be too long for a command line
+        filter_path = tmp_folder_path / 'select.txt'
+        filter_path.write_text(f"select='{self._get_selection_expression(frame_indices)}'")
+        command_args = [
+            'ffmpeg',
+            '-i', clip_path,
+            '-filter_script:v', filter_path,
+            '-vsync', 'vfr',
+            # stop decoding after the last selected frame
+            '-frames:v', str(len(frame_indices)),
+            tmp_folder_path / '%06d.jpg'
+        ]
+        self._run_in_operator_container(command_args, [clip_path.parent, Path('/data')], same_user=True)
+
+        for i, frame_index in enumerate(frame_indices):
+            tmp_frame_path = tmp_folder_path / f'{i+1:06d}.jpg'
+            if not tmp_frame_path.exists():
+                self._warn(f'{clip_path}: frame {frame_index} not found')
+                continue
+            for frame_file_path in samples[frame_index]:
+                frame_file_path.parent.mkdir(exist_ok=True)
+                shutil.copyfile(tmp_frame_path, frame_file_path)
+
+        shutil.rmtree(tmp_folder_path)
+
+        for shot in pending_shots:
+            self._record_provenance(shots_folder_path / shot['folder_name'], [clip_path, shots_table_path])
+
+    def _get_selection_expression(self, frame_indices: [int]) -> str:
+        '''Returns an ffmpeg expression true for the given frame numbers (n), sorted.
+        The expression is a binary search on n, 
+        so ffmpeg evaluates a few comparisons per frame rather than one per selected frame.'''
+        if len(frame_indices) <= SELECTION_LEAF_SIZE:
+            return '+'.join(f'eq(n,{i})' for i in frame_indices)
+
+        middle = len(frame_indices) // 2
+        return (
+            f'if(lt(n,{frame_indices[middle]}),'
+            f'{self._get_selection_expression(frame_indices[:middle])},'
+            f'{self._get_selection_expression(frame_indices[middle:])})'
+        )
+
+    def _make_frames_from_descriptor(self, shot_folder_path: Path):
+        '''Extracts the frames of a shot without video file
+        from the range of its clip given by its descriptor (shot.json).'''
+        if not self._is_path_selected(shot_folder_path):
+            return
+
+        descriptor = self._read_shot_descriptor(shot_folder_path)
+        clip_path = descriptor['clip_path']
+        if not descriptor['frame_rate']:
+            self._warn(f'{shot_folder_path}: unknown frame rate in shot.json, please redo make_shots_scenedetect')
+            return
+
+        input_paths = [clip_path, shot_folder_path / 'shot.json']
+        frame_file_paths = list(shot_folder_path.glob('*.jpg'))
+        if not self._needs_update(shot_folder_path, input_paths, bool(frame_file_paths)):
+            return
+
+        for frame_file_path in frame_file_paths:
+            frame_file_path.unlink()
+
+        self._delete_data_file(shot_folder_path / 'frames.json')
+
+        video_filter = self.get_param('video_filter')
+        if video_filter:
+            # input seeking is frame accurate when the video is decoded
+            command_args = [
+                'ffmpeg',
+                '-ss', f"{descriptor['start_time']:.6f}",
+                '-t', f"{descriptor['end_time'] - descriptor['start_time']:.6f}",
+                '-i', clip_path,
+                '-vf', video_filter,
+                '-vsync', 'vfr',
+                shot_folder_path / '%04d.jpg'
+            ]
+        else:
+            command_args = self._get_seek_command_for_range(
+                clip_path, 
+                shot_folder_path,
+                descriptor['start_frame'],
+                descriptor['end_frame'] - descriptor['start_frame'] + 1,
+                descriptor['frame_rate']
+            )
+
+        self._run_in_operator_container(command_args, [clip_path.parent, Path('/data')], same_user=True)
+
+        missing = [
+            place_name 
+            for place, place_name in PLACES 
+            if not video_filter and not (shot_folder_path / f'{place_name}.jpg').exists()
+        ]
+        if missing:
+            self._warn(f'{shot_folder_path}: no frame found in {clip_path} for {", ".join(missing)}')
+
+        self._record_provenance(shot_folder_path, input_paths)
+
+    def _get_source(self):
+        ret = self.get_param('source') or 'shot'
+        if ret not in ['shot', 'clip']:
+            self._error(f'Unsupported value for `source` parameter: "{ret}". Please use "shot" or "clip".')
+        if ret == 'clip' and self.get_param('video_filter'):
+            self._error('`video_filter` parameter is not supported with `"source": "clip"`.')
+        return ret
+
+    def _make_frames(self, shot_file_path: Path):           
+        shot_folder_path = shot_file_path.parent
+
+        if not self._is_path_selected(shot_file_path):
+            return
+
+        frame_file_paths = list(shot_folder_path.glob('*.jpg'))
+
+        # the output is the set of frames in the shot folder
+        if not self._needs_update(shot_folder_path, [shot_file_path], bool(frame_file_paths)):
             return
 
+        # remove existing frames .jpg and frames.json
+        for frame_file_path in frame_file_paths:
+            frame_file_path.unlink()
+
+        self._delete_data_file(shot_folder_path / 'frames.json')
+
         video_filter = self.get_param('video_filter')
+        is_seeking = False
         # parameters = self._get_operator_parameters()
         # print(shot_file_path)
 
@@ -50,75 +252,118 @@ class MakeFramesFFMPEG(Operator):
             # ffmpeg -i input.mp4 -vf "select=not(mod(n\,10))" -vsync vfr 1_every_10/img_%03d.jpg
             # https://superuser.com/a/1274696
             # for 2 fps: 'fps=2'
-            samples = [
+            command_args = [
+                'ffmpeg', 
+                '-i', shot_file_path,
                 '-vf', video_filter,
                 '-vsync', 'vfr',
                 shot_folder_path / '%04d.jpg'
             ]
         else:
             # take first, middle and last frames
-            binding = [shot_folder_path, Path('/data')]
-            command_args = [
-                'ffprobe', 
-                '-v', 'error', 
-                '-select_streams', 'v:0', 
-                '-count_frames',
-                '-show_entries', 
-                # TODO: nb_read_frames is accurate but slower than nb_frames
-                'format=duration:stream=nb_read_frames', 
-                '-of', 'json', 
-                shot_file_path,
+            command_args = None
+            sampling_method = self._get_sampling_method()
+            if sampling_method == 'seek':
+                command_args = self._get_seek_command(shot_file_path)
+                is_seeking = command_args is not None
+            if command_args is None:
+                command_args = self._get_select_command(shot_file_path)
+
+        # ffmpeg -i input.mp4 -ss 00:00:10 -vframes 1 frame1.png -ss 00:00:20 -vframes 1 frame2.png -ss 00:00:30 -vframes 1 frame3.png
+        binding = [shot_folder_path, Path('/data')]
+        # print(command_args)
+        res = self._run_in_operator_container(command_args, binding, same_user=True)
+
+        if is_seeking:
+            missing = [
+                place_name 
+                for place, place_name in PLACES 
+                if not (shot_folder_path / f'{place_name}.jpg').exists()
+            ]
+            if missing:
+                # e.g. inaccurate frame count or rate in the metadata,
+                # seeking past the last frame. Take the slow exact path.
+                self._debug(f'{shot_file_path}: no frame found by seeking for {", ".join(missing)}, extracting by frame number')
+                res = self._run_in_operator_container(self._get_select_command(shot_file_path), binding, same_user=True)
+
+        self._record_provenance(shot_folder_path, [shot_file_path])
+
+    def _get_sampling_method(self):
+        ret = self.get_param('sampling_method') or 'seek'
+        if ret not in ['seek', 'select']:
+            self._error(f'Unsupported value for `sampling_method` parameter: "{ret}". Please use "seek" or "select".')
+        return ret
+
+    def _get_seek_command(self, shot_file_path: Path):
+        '''Returns a ffmpeg command which seeks to the first, middle and last frames
+        and decodes only those (plus the frames since their preceding key frame).
+        The frame count is read from the container metadata, or by counting packets.
+        Returns None if the frame count or rate is unknown.'''
+        ret = None
+
+        metadata = self._probe_video(shot_file_path)
+        if not metadata['frame_count']:
+            metadata = self._probe_video(shot_file_path, 'packets')
+
+        frame_count = metadata['frame_count']
+        frame_rate = metadata['frame_rate']
+        if not frame_count or not frame_rate:
+            return ret
+
+        ret = self._get_seek_command_for_range(shot_file_path, shot_file_path.parent, 0, frame_count, frame_rate)
+
+        return ret
+
+    def _get_seek_command_for_range(self, video_path: Path, frames_folder_path: Path, start_frame, frame_count, frame_rate):
+        '''Returns a ffmpeg command which seeks to the first, middle and last frames
+        of a range of frames in a video and saves them in frames_folder_path.'''
+        inputs = []
+        outputs = []
+        for i, [place, place_name] in enumerate(PLACES):
+            frame_index = start_frame + int(place * (frame_count - 1))
+            # half a frame before the target frame, 
+            # so rounding errors don't make us skip it
+            timestamp = max(0, (frame_index - 0.5) / frame_rate)
+            inputs += [
+                '-ss', f'{timestamp:.6f}',
+                '-i', video_path,
             ]
-            res = self._run_in_operator_container(command_args, binding)
-            
-            '''
-            {
-                "programs": [
-
-                ],
-                "streams": [
-                    {
-                        "nb_read_frames": "30"
-                    }
-                ],
-                "format": {
-                    "duration": "1.250000"
-                }
-            }
-            '''
-
-            metadata = json.loads(res.stdout)
-            duration_seconds = float(metadata['format']['duration'])
-            duration_frames = float(metadata['streams'][0]['nb_read_frames'])
-
-            # now get first, middle and last frames
-            # TODO: improve that sampling
-            samples = []
-            # .99 or 1 won't match a frame with timecode
-            places = [
-                [0, 'first'], 
-                [0.5, 'middle'], 
-                [1, 'last'],
+            outputs += [
+                '-map', f'{i}:v:0',
+                '-frames:v', '1',
+                '-update', '1', # this is to supress warning about no pattern in filename
+                frames_folder_path / f'{place_name}.jpg'
             ]
 
-            # ffmpeg -i shot.mp4 -vf "select=eq(n\,4)" -vframes 1 -update 1 00004.jpg
+        return ['ffmpeg'] + inputs + outputs
 
-            for i, place in enumerate(places):
-                samples += [
-                    # '-ss', str(timedelta(seconds=duration_seconds * place)),
-                    '-vf', f"""select='eq(n,{int(place[0] * (duration_frames - 1))})'""",
-                    '-vframes', '1',
-                    '-update', '1', # this is to supress warning about no pattern in filename
-                    # shot_folder_path / f'{i+1:04d}.jpg'
-                    shot_folder_path / f'{place[1]}.jpg'
-                ]
+    def _get_select_command(self, shot_file_path: Path):
+        '''Returns a ffmpeg command which selects the first, middle and last frames
+        by their number. Exact, but decodes the shot twice: 
+        once to count the frames and once to extract them.'''
+        shot_folder_path = shot_file_path.parent
 
-        # ffmpeg -i input.mp4 -ss 00:00:10 -vframes 1 frame1.png -ss 00:00:20 -vframes 1 frame2.png -ss 00:00:30 -vframes 1 frame3.png
-        binding = [shot_folder_path, Path('/data')]
-        command_args = [
+        metadata = self._probe_video(shot_file_path, 'frames')
+        duration_frames = float(metadata['frame_count'] or 1)
+
+        # now get first, middle and last frames
+        # TODO: improve that sampling
+        samples = []
+
+        # ffmpeg -i shot.mp4 -vf "select=eq(n\,4)" -vframes 1 -update 1 00004.jpg
+
+        for i, place in enumerate(PLACES):
+            samples += [
+                # '-ss', str(timedelta(seconds=duration_seconds * place)),
+                '-vf', f"""select='eq(n,{int(place[0] * (duration_frames - 1))})'""",
+                '-vframes', '1',
+                '-update', '1', # this is to supress warning about no pattern in filename
+                # shot_folder_path / f'{i+1:04d}.jpg'
+                shot_folder_path / f'{place[1]}.jpg'
+            ]
+
+        return [
             'ffmpeg', 
+            '-y', # overwrite frames left by a failed seek
             '-i', shot_file_path
         ] + samples
-        # print(command_args)
-        res = self._run_in_operator_container(command_args, binding, same_user=True)
-
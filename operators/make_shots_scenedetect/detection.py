@@ -0,0 +1,173 @@
+import numpy as np
+
+# default parameters of the PySceneDetect detectors
+CONTENT_THRESHOLD_DEFAULT = 27.0
+ADAPTIVE_THRESHOLD_DEFAULT = 3.0
+# minimum content score for an adaptive cut
+ADAPTIVE_MIN_CONTENT_VAL = 15.0
+# number of frames on each side of a frame to average the scores of its neighbours
+ADAPTIVE_WINDOW_WIDTH = 2
+# minimum length of a shot, in frames
+MIN_SCENE_LEN = 15
+
+
+class ShotDetector:
+    '''Detects the cuts in a stream of small RGB frames,
+    like the content and adaptive detectors of PySceneDetect.
+
+    The frames are fed by batches of raw RGB pixels (rgb24), as piped by ffmpeg.
+    The content score of a frame is the average of the mean absolute differences
+    of its hue, saturation and value with the previous frame,
+    computed for the whole batch at once.
+
+    method:
+    * 'content': a cut where the score is above the threshold (default: 27);
+    * 'adaptive': a cut where the ratio between the score and the average score
+    of the neighbouring frames is above the threshold (default: 3).
+    '''
+
+    def __init__(self, width: int, height: int, method='adaptive', threshold=None, min_scene_len=MIN_SCENE_LEN):
+        if method not in ['content', 'adaptive']:
+            raise ValueError(f'Unsupported detection method: {method}')
+        self.width = width
+        self.height = height
+        self.method = method
+        self.threshold = float(threshold or (CONTENT_THRESHOLD_DEFAULT if method == 'content' else ADAPTIVE_THRESHOLD_DEFAULT))
+        self.min_scene_len = min_scene_len
+        # HSV of the last frame of the previous batch
+        self.last_hsv = None
+        # content score of each frame fed so far (0 for the first frame)
+        self.scores = []
+
+    def add_frames(self, data: bytes):
+        '''Adds a batch of consecutive frames (rgb24 bytes, a whole number of frames).'''
+        frames = np.frombuffer(data, dtype=np.uint8).reshape(-1, self.height, self.width, 3)
+        if not len(frames):
+            return
+
+        hsv = self._rgb_to_hsv(frames)
+        if self.last_hsv is None:
+            previous = np.concatenate([hsv[:1], hsv[:-1]])
+        else:
+            previous = np.concatenate([self.last_hsv[None], hsv[:-1]])
+        self.last_hsv = hsv[-1]
+
+        # mean over the pixels, per channel, then over the channels
+        deltas = np.abs(hsv - previous).mean(axis=(1, 2))
+        scores = deltas.mean(axis=1)
+        if not self.scores:
+            scores[0] = 0
+
+        self.scores += scores.tolist()
+
+    def get_frame_size(self) -> int:
+        '''Returns the number of bytes of a frame.'''
+        return self.width * self.height * 3
+
+    def get_frame_count(self) -> int:
+        return len(self.scores)
+
+    def get_cuts(self) -> [int]:
+        '''Returns the index of the first frame of each shot after the first one.'''
+        ret = []
+
+        scores = self.scores
+        last_cut = 0
+        if self.method == 'content':
+            candidates = (
+                i for i, score in enumerate(scores)
+                if score >= self.threshold
+            )
+        else:
+            candidates = self._get_adaptive_candidates(scores)
+
+        for i in candidates:
+            if i - last_cut >= self.min_scene_len:
+                ret.append(i)
+                last_cut = i
+
+        return ret
+
+    def _get_adaptive_candidates(self, scores):
+        w = ADAPTIVE_WINDOW_WIDTH
+        scores = np.asarray(scores, dtype=np.float64)
+        if len(scores) < 2 * w + 1:
+            return []
+
+        # average score of the w frames before and the w frames after each frame
+        window = np.ones(2 * w + 1)
+        window[w] = 0
+        neighbours = np.convolve(scores, window, mode='valid') / (2 * w)
+        centres = scores[w:len(scores) - w]
+
+        ratios = np.where(
+            neighbours > 0,
+            centres / np.maximum(neighbours, 1e-9),
+            # no change around the frame: a cut if the frame itself changes
+            np.where(centres >= ADAPTIVE_MIN_CONTENT_VAL, 255.0, 0.0)
+        )
+        selected = (ratios >= self.threshold) & (centres >= ADAPTIVE_MIN_CONTENT_VAL)
+
+        return (np.nonzero(selected)[0] + w).tolist()
+
+    def _rgb_to_hsv(self, frames):
+        '''RGB to HSV with the same scale as OpenCV (H: 0-179, S and V: 0-255).'''
+        rgb = frames.astype(np.float32)
+        r, g, b = rgb[..., 0], rgb[..., 1], rgb[..., 2]
+        v = rgb.max(axis=-1)
+        delta = v - rgb.min(axis=-1)
+        safe_delta = np.where(delta > 0, delta, 1)
+
+        s = np.where(v > 0, 255 * delta / np.where(v > 0, v, 1), 0)
+
+        h = np.where(
+            v == r, 60 * (g - b) / safe_delta,
+            np.where(v == g, 120 + 60 * (b - r) / safe_delta, 240 + 60 * (r - g) / safe_delta)
+        )
+        h = np.where(delta > 0, h, 0)
+        h = np.where(h < 0, h + 360, h) / 2
+
+        return np.stack([h, s, v], axis=-1)
+
+
+def get_shots(cuts: [int], frame_count: int) -> [list]:
+    '''Returns the [start, end] frames of the shots (end excluded) delimited by cuts.'''
+    boundaries = [0] + [c for c in cuts if 0 < c < frame_count] + [frame_count]
+    return [
+        [boundaries[i], boundaries[i + 1]]
+        for i in range(len(boundaries) - 1)
+        if boundaries[i + 1] > boundaries[i]
+    ]
+
+
+def format_timecode(seconds: float) -> str:
+    '''e.g. 62.5 => 00:01:02.500'''
+    milliseconds = int(round(seconds * 1000))
+    hours, milliseconds = divmod(milliseconds, 3600000)
+    minutes, milliseconds = divmod(milliseconds, 60000)
+    seconds, milliseconds = divmod(milliseconds, 1000)
+    return f'{hours:02d}:{minutes:02d}:{seconds:02d}.{milliseconds:03d}'
+
+
+def get_shots_table(shots: [list], frame_rate: float) -> [list]:
+    '''Returns the rows of a shots table in the format of PySceneDetect list-scenes,
+    frame numbers start at 1.'''
+    ret = [
+        ['Timecode List:'] + [format_timecode(start / frame_rate) for start, end in shots[1:]],
+        [
+            'Scene Number', 'Start Frame', 'Start Timecode', 'Start Time (seconds)',
+            'End Frame', 'End Timecode', 'End Time (seconds)',
+            'Length (frames)', 'Length (timecode)', 'Length (seconds)'
+        ],
+    ]
+
+    for i, [start, end] in enumerate(shots):
+        start_time = start / frame_rate
+        end_time = end / frame_rate
+        ret.append([
+            i + 1, start + 1, format_timecode(start_time), f'{start_time:.3f}',
+            end, format_timecode(end_time), f'{end_time:.3f}',
+            end - start, format_timecode(end_time - start_time), f'{end_time - start_time:.3f}',
+        ])
+
+    return ret
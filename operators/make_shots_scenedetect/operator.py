@@ -5,6 +5,12 @@ import json
 from datetime import datetime
 import subprocess
 import shutil
+import csv
+
+# methods detecting the shots in this process rather than with the scenedetect command
+NATIVE_METHODS = ['native-content', 'native-adaptive']
+# number of frames scored at once by the native methods
+NATIVE_BATCH_SIZE = 64
 
 class MakeShotsSceneDetect(Operator):
     '''Extract shots from clips using PySceneDetect'''
@@ -13,22 +19,29 @@ class MakeShotsSceneDetect(Operator):
         ret = super().get_supported_arguments()
         ret['redo'] = True
         ret['filter'] = True
+        ret['jobs'] = True
         return ret
 
+    def _use_worker_container(self):
+        return True
+
     def _apply(self):
         ret = None
 
+        work_units = []
         for col in self.context['collections']:
-            for video_folder_path in col['attributes']['path'].iterdir():
-                if video_folder_path.is_dir():
-                    for clip_folder_path in video_folder_path.iterdir():
-                        if clip_folder_path.is_dir():
-                            clip_path = self._get_video_file_path(clip_folder_path)
-                            if clip_path:
-                                self._make_shots(clip_path)
+            for clip_folder_path in self._get_clip_folder_paths(col):
+                clip_path = self._get_video_file_path(clip_folder_path)
+                if clip_path:
+                    work_units.append([self._make_shots, [clip_path]])
+
+        self._run_work_units(work_units)
 
         return ret
 
+    def _process_clip(self, clip_path: Path, collection_path: Path):
+        self._make_shots(clip_path)
+
     def _make_shots(self, clip_path: Path):
         if not self._is_path_selected(clip_path):
             return
@@ -36,13 +49,12 @@ class MakeShotsSceneDetect(Operator):
         shots_folder_path = clip_path.parent / 'shots'
         shots_folder_tmp_path = clip_path.parent / 'shots.tmp'
                 
-        if self._is_redo():
-            if shots_folder_path.exists():
-                shutil.rmtree(shots_folder_path)
-
-        if shots_folder_path.exists():
+        if not self._needs_update(shots_folder_path, [clip_path]):
             return
 
+        # also removes the results about the previous shots (e.g. frames.json)
+        self._delete_data_folder(shots_folder_path)
+
         if shots_folder_tmp_path.exists():
             shutil.rmtree(shots_folder_tmp_path)
         
@@ -58,19 +70,35 @@ class MakeShotsSceneDetect(Operator):
             'scenedetect',
             '--input', clip_path,
             '--output', shots_folder_tmp_path,
-            detection_method,
         ]
+
+        if detection_method in NATIVE_METHODS:
+            # writes shots.csv, then the shots are cut by scenedetect from that table
+            self._detect_shots_natively(clip_path, shots_folder_tmp_path, detection_method)
+            command_args += ['load-scenes', '-i', shots_folder_tmp_path / 'shots.csv']
+        else:
+            command_args += [detection_method]
+
+            threshold = self.get_param('threshold')
+            if threshold:
+                command_args += ['-t', str(threshold)]
         
-        threshold = self.get_param('threshold')
-        if threshold:
-            command_args += ['-t', str(threshold)]
-        
-        command_args += [
-            'split-video',  # creates a mp4 file per shot
-            'list-scenes', # creates a CSV files with one row per shot
-        ]
+        split_video = self._get_split_video()
+        if split_video == 'encode':
+            # creates a mp4 file per shot
+            command_args += ['split-video']
+        elif split_video == 'copy':
+            # same without re-encoding, shots are cut at the nearest key frames
+            command_args += ['split-video', '--copy']
 
-        self._run_in_operator_container(command_args, binding, same_user=True)
+        if detection_method in NATIVE_METHODS:
+            # nothing left to do if the shots are not cut
+            if split_video != 'none':
+                self._run_in_operator_container(command_args, binding, same_user=True)
+        else:
+            # creates a CSV files with one row per shot
+            command_args += ['list-scenes']
+            self._run_in_operator_container(command_args, binding, same_user=True)
 
         # rename and move the files
         # 1. 00.58.16-298-Scene-003.mp4 => 003/shot.mp4
@@ -89,5 +117,100 @@ class MakeShotsSceneDetect(Operator):
         for csv_path in shots_folder_tmp_path.glob('*-Scenes.csv'):
             csv_path.rename(shots_folder_tmp_path / 'shots.csv')
 
+        # 3. 003/shot.json, locates the shot in the clip
+        self._write_shot_descriptors(clip_path, shots_folder_tmp_path)
+
         # ensure the whole operation is atomic
         shots_folder_tmp_path.rename(shots_folder_path)
+        self._record_provenance(shots_folder_path, [clip_path])
+
+    def _get_split_video(self):
+        ret = self.get_param('split_video') or 'encode'
+        if ret not in ['encode', 'copy', 'none']:
+            self._error(f'Unsupported value for `split_video` parameter: "{ret}". Please use "encode", "copy" or "none".')
+        return ret
+
+    def _write_shot_descriptors(self, clip_path: Path, shots_folder_path: Path):
+        '''Writes a shot.json in each shot folder with the range of the shot in the clip,
+        so the shot can be read from the clip when it has no video file.'''
+        shots = self._read_shots_table(shots_folder_path)
+        if not shots:
+            return
+
+        frame_rate = self._probe_video(clip_path)['frame_rate']
+        if not frame_rate and shots[-1]['end_time']:
+            # e.g. missing from the metadata, estimate it from the shot boundaries
+            frame_rate = (shots[-1]['end_frame'] + 1) / shots[-1]['end_time']
+
+        for shot in shots:
+            shot_folder_path = shots_folder_path / shot['folder_name']
+            shot_folder_path.mkdir(exist_ok=True)
+            descriptor = {
+                # relative to the clip folder
+                'clip': clip_path.name,
+                'start_frame': shot['start_frame'],
+                'end_frame': shot['end_frame'],
+                'start_time': shot['start_time'],
+                'end_time': shot['end_time'],
+                'frame_rate': frame_rate,
+            }
+            (shot_folder_path / 'shot.json').write_text(json.dumps(descriptor, indent=2))
+
+    def _detect_shots_natively(self, clip_path: Path, shots_folder_path: Path, detection_method: str):
+        '''Detects the shots of a clip in this process and writes shots.csv
+        in the same format as scenedetect list-scenes.
+        ffmpeg decodes the clip and pipes small raw frames (detection_width pixels wide), 
+        optionally only one every frame_skip + 1 frames,
+        which are scored by batches with numpy.'''
+        # numpy is only needed by the native methods
+        from .detection import ShotDetector, get_shots, get_shots_table, MIN_SCENE_LEN
+
+        metadata = self._probe_video(clip_path)
+        if not (metadata['frame_rate'] and metadata['width'] and metadata['height']):
+            self._error(f'Could not read the frame rate and size of {clip_path}')
+
+        # even dimensions, as some scalers require
+        width = min(metadata['width'], int(self.get_param('detection_width') or metadata['width']))
+        width = max(2, width - width % 2)
+        height = max(2, int(round(metadata['height'] * width / metadata['width'] / 2)) * 2)
+
+        frame_skip = max(0, int(self.get_param('frame_skip') or 0))
+        video_filters = []
+        if frame_skip:
+            video_filters.append(f'select=not(mod(n\\,{frame_skip + 1}))')
+        video_filters.append(f'scale={width}:{height}')
+
+        command_args = [
+            'ffmpeg',
+            '-loglevel', 'error',
+            '-i', clip_path,
+            '-an', '-sn',
+            '-vf', ','.join(video_filters),
+            '-vsync', 'passthrough',
+            '-pix_fmt', 'rgb24',
+            '-f', 'rawvideo',
+            'pipe:1'
+        ]
+
+        detector = ShotDetector(
+            width, height, 
+            detection_method.replace('native-', ''), 
+            self.get_param('threshold'),
+            max(1, MIN_SCENE_LEN // (frame_skip + 1))
+        )
+        frame_size = detector.get_frame_size()
+        for chunk in self._stream_from_operator_container(command_args, [clip_path.parent, Path('/data')], frame_size * NATIVE_BATCH_SIZE):
+            # ignore an incomplete last frame
+            detector.add_frames(chunk[:len(chunk) - len(chunk) % frame_size])
+
+        # back to the numbers of the decoded frames
+        cuts = [cut * (frame_skip + 1) for cut in detector.get_cuts()]
+        frame_count = detector.get_frame_count()
+        if frame_skip:
+            frame_count = metadata['frame_count'] or frame_count * (frame_skip + 1)
+
+        shots = get_shots(cuts, frame_count)
+        self._debug(f'{clip_path}: {len(shots)} shots in {frame_count} frames')
+
+        with open(shots_folder_path / 'shots.csv', 'w', newline='') as fh:
+            csv.writer(fh).writerows(get_shots_table(shots, metadata['frame_rate']))
@@ -0,0 +1,164 @@
+from ..base.operator import Operator, SERVICE_PORT
+from pathlib import Path
+from importlib import import_module
+import inspect
+import threading
+import queue
+
+# marks the end of the stream of clips in a queue
+END_OF_CLIPS = None
+
+
+class Pipeline(Operator):
+    '''Chain operators, passing each clip to the next operator as soon as it is processed'''
+
+    def get_supported_arguments(self):
+        ret = super().get_supported_arguments()
+        ret['filter'] = True
+        ret['redo'] = True
+        ret['stages'] = True
+        return ret
+
+    def _before_apply(self):
+        # this operator has no container or parameters of its own
+        self.params = {}
+        self.worker = None
+        self.stages = []
+
+        for stage in self._get_stages():
+            self.stages.append(stage)
+            try:
+                stage._before_apply()
+            except BaseException as e:
+                # stop the containers of the stages already prepared
+                self._after_apply()
+                raise e
+
+    def _after_apply(self):
+        for stage in getattr(self, 'stages', []):
+            stage._after_apply()
+        self._log_content_cache_stats()
+
+    def _apply(self):
+        '''Runs each stage in its own thread.
+        Stage N reads clips from queue N-1 and writes them to queue N.
+        So a clip is processed by the next operator (e.g. on GPU)
+        while the previous operator works on the following clips (e.g. on CPU).
+        '''
+        ret = None
+
+        self.abort = threading.Event()
+        self.failures = []
+
+        queues = [queue.Queue() for stage in self.stages[1:]]
+
+        threads = []
+        for i, stage in enumerate(self.stages):
+            threads.append(threading.Thread(
+                target=self._run_stage,
+                args=[
+                    stage,
+                    queues[i - 1] if i > 0 else None,
+                    queues[i] if i < len(queues) else None,
+                ],
+                name=stage._get_operator_name(),
+                daemon=True,
+            ))
+
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+
+        if self.failures:
+            stage, exception = self.failures[0]
+            if not isinstance(exception, SystemExit):
+                raise exception
+            # the stage has already reported the error
+            self._error(f'Pipeline interrupted by a failure of {stage._get_operator_name()}')
+
+        return ret
+
+    def _run_stage(self, stage: Operator, input_queue: queue.Queue, output_queue: queue.Queue):
+        processed_count = 0
+        try:
+            if input_queue is None:
+                clips = stage._iter_processed_clips()
+            else:
+                clips = self._iter_queue(stage, input_queue)
+
+            for clip_path, collection_path in clips:
+                if self.abort.is_set():
+                    break
+                processed_count += 1
+                if output_queue is not None:
+                    output_queue.put([clip_path, collection_path])
+        except BaseException as e:
+            # e.g. SystemExit raised by stage._error()
+            self.failures.append([stage, e])
+            self.abort.set()
+        finally:
+            if output_queue is not None:
+                output_queue.put(END_OF_CLIPS)
+
+        self._debug(f'{stage._get_operator_name()} processed {processed_count} clips')
+
+    def _iter_queue(self, stage: Operator, input_queue: queue.Queue):
+        while True:
+            item = input_queue.get()
+            if item is END_OF_CLIPS or self.abort.is_set():
+                break
+            clip_path, collection_path = item
+            stage._process_clip(clip_path, collection_path)
+            yield clip_path, collection_path
+
+    def _get_stages(self) -> [Operator]:
+        ret = []
+
+        names = self._get_framesense_argument('stages', None) or []
+        if not names:
+            self._error('Please specify the operators to chain, e.g. pipeline make_clips_ffmpeg extract_sound_ffmpeg')
+
+        for i, name in enumerate(names):
+            stage = self._get_operator(name)
+
+            operator_class = type(stage)
+            if i > 0 and operator_class._process_clip is Operator._process_clip:
+                self._error(f'Operator "{name}" can only be the first operator of a pipeline')
+            if operator_class._process_clip is Operator._process_clip and operator_class._iter_processed_clips is Operator._iter_processed_clips:
+                self._error(f'Operator "{name}" does not support pipelines')
+
+            stage.set_context(self.context)
+            # the services of the stages run at the same time, each needs its own port
+            stage.service_port = SERVICE_PORT + i
+            stage.is_pipeline_stage = True
+
+            unsupported_args = [
+                arg for arg in stage.get_unsupported_arguments()
+                if arg != 'stages'
+            ]
+            if unsupported_args:
+                self._error(f'The operator "{name}" does not support these arguments: {", ".join(unsupported_args)}')
+
+            ret.append(stage)
+
+        return ret
+
+    def _get_operator(self, operator_name) -> Operator:
+        ret = None
+
+        try:
+            operator_module = import_module(f'..{operator_name}.operator', package=__package__)
+        except ModuleNotFoundError:
+            self._error(f'Operator not found: {operator_name}')
+
+        for name, obj in operator_module.__dict__.items():
+            if not (isinstance(obj, type) and issubclass(obj, Operator)): continue
+            if inspect.isabstract(obj): continue
+            if obj is Operator: continue
+            ret = obj()
+
+        if ret is None:
+            self._error(f'No concrete operator found in {operator_name}')
+
+        return ret
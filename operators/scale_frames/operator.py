@@ -1,12 +1,14 @@
 from abc import ABC, abstractmethod
 from pathlib import Path
-from ..base.operator import Operator
+from ..base.operator import Operator, SERVICE_BATCH_SIZE_DEFAULT
 import re
 import json
 from datetime import datetime
 import subprocess
 import shutil
 
+SCALE_ATTRIBUTE_NAME = 'shot_scale'
+
 class ScaleFrames(Operator):
     '''Shot scale classification from frames'''
 
@@ -21,20 +23,43 @@ class ScaleFrames(Operator):
 
         for col in self.context['collections']:
             collection_path = col['attributes']['path']
-            for frames_folder_path in collection_path.glob('**/shots/*/'):
-                self._write_frames_scale(frames_folder_path, collection_path)
+            self._write_frames_scales(self._get_shot_folder_paths(col), collection_path)
 
         return ret
 
-    def _write_frames_scale(self, frames_folder_path: Path, collection_path: Path):
-        scale_attribute_name = 'shot_scale'
+    def _process_clip(self, clip_path: Path, collection_path: Path):
+        self._write_frames_scales(sorted(clip_path.parent.glob('shots/*/')), collection_path)
+
+    def _write_frames_scales(self, frames_folder_paths: [Path], collection_path: Path):
+        '''Classifies the frames of many shots together, 
+        so the classifier receives large batches rather than the 2 or 3 frames of a shot.
+        The frames.json of the shots are written after each window of shots.'''
+        # [frames_meta_path, frames_meta_content]
+        shots = []
+        # [frame_file_path, frame_data]
+        pending_frames = []
+
+        # classify enough frames at once to keep all the batches in flight full
+        window_size = int(self.params.get('batch_size', 0) or SERVICE_BATCH_SIZE_DEFAULT) * self._get_service_concurrency() * 4
+
+        for frames_folder_path in frames_folder_paths:
+            if not self._is_path_selected(frames_folder_path):
+                continue
+
+            frames_meta_path = Path(frames_folder_path / 'frames.json')
+            frames_meta_content = self._read_data_file(frames_meta_path, is_data_dict=True)
+            shots.append([frames_meta_path, frames_meta_content])
+            pending_frames += self._get_pending_frames(frames_folder_path, frames_meta_content['data'])
+
+            if len(pending_frames) >= window_size:
+                self._write_pending_frames_scale(shots, pending_frames, collection_path)
+                shots, pending_frames = [], []
 
-        if not self._is_path_selected(frames_folder_path):
-            return
-        
-        frames_meta_path = Path(frames_folder_path / 'frames.json')
-        frames_meta_content = self._read_data_file(frames_meta_path, is_data_dict=True)
-        frames_data = frames_meta_content['data']
+        self._write_pending_frames_scale(shots, pending_frames, collection_path)
+
+    def _get_pending_frames(self, frames_folder_path: Path, frames_data: dict) -> [list]:
+        '''Returns [frame_file_path, frame_data] for the frames of a shot without scale.'''
+        ret = []
 
         frame_file_paths = list(frames_folder_path.glob('*.jpg'))
         for frame_file_path in frame_file_paths:
@@ -44,16 +69,32 @@ class ScaleFrames(Operator):
                 frame_data = {}
                 frames_data[frame_id] = frame_data
 
-            if self._is_redo() or not frame_data.get(scale_attribute_name, None):
-                res = self._recognise_frame_scale(frame_file_path, collection_path)
-                frame_data[scale_attribute_name] = {
+            if self._is_redo() or not frame_data.get(SCALE_ATTRIBUTE_NAME, None):
+                ret.append([frame_file_path, frame_data])
+
+        return ret
+
+    def _write_pending_frames_scale(self, shots: [list], pending_frames: [list], collection_path: Path):
+        if pending_frames:
+            results = self._recognise_frames_scale([p[0] for p in pending_frames], collection_path)
+            for [frame_file_path, frame_data], res in zip(pending_frames, results):
+                frame_data[SCALE_ATTRIBUTE_NAME] = {
                     'value': res,
                     'operator': self._get_operator_name(),
                     'method': '',
                 }
 
-        self._write_data_file(frames_meta_path, frames_meta_content)
-                
+        for frames_meta_path, frames_meta_content in shots:
+            self._write_data_file(frames_meta_path, frames_meta_content)
+
+    def _recognise_frames_scale(self, frame_file_paths: [Path], collection_path: Path) -> list:
+        '''Returns the scale of each frame, in the same order.
+        Override to classify all the frames in fewer calls.'''
+        return [
+            self._recognise_frame_scale(frame_file_path, collection_path)
+            for frame_file_path in frame_file_paths
+        ]
+
     @abstractmethod
     def _recognise_frame_scale(self, frame_file_path: Path, collection_path: Path):
         ret = ''
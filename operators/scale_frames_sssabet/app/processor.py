@@ -1,16 +1,48 @@
 import torch 
 from PIL import Image
-from torch.utils.data import DataLoader
+from torch.utils.data import Dataset
+from concurrent.futures import ThreadPoolExecutor
 import numpy as np
 import torchvision.transforms as transforms
 import torchvision
 from pathlib import Path
 import sys
+import os
 import json
+import copy
+import threading
 from flask import Flask, request, jsonify
 
 PORT = 5000
 
+PARAMS_PATH = Path('/app/params.json')
+PARAMS = json.loads(PARAMS_PATH.read_text()) if PARAMS_PATH.exists() else {}
+
+MODEL_PATH = Path('/models/Pytorch_Classification_50ep.pt')
+# optimised models are built once and reused by the next runs
+ENGINE_CACHE_PATH = Path('/hf_cache/framesense/scale_frames_sssabet')
+# number of random inputs compared between the eager and the optimised models
+PARITY_SAMPLE_SIZE = 64
+# minimum proportion of identical scales for the optimised model to be used
+PARITY_MIN_AGREEMENT = 0.98
+
+IMAGE_SIZE = [128, 128]
+# built once, reused for all the frames
+DATA_TRANSFORMATION = transforms.Compose(
+    [
+        transforms.ToTensor(),
+        transforms.Resize(IMAGE_SIZE),
+        transforms.Normalize([0.485, 0.456, 0.406],[0.229, 0.224, 0.225])
+    ]
+)
+# scale for each output of the model
+SCALES = ['CS', 'ECS', 'FS', 'LS', 'MS']
+# maximum number of frames in a forward pass
+BATCH_SIZE = 64
+# number of threads decoding the frames in parallel with the inference
+# (PIL and torch release the GIL)
+DECODING_WORKERS = min(4, os.cpu_count() or 1)
+
 '''
 Usage:
 
@@ -24,14 +56,33 @@ Usage:
 
 `python processor.py serve`
 
+or `python processor.py serve 5001` to listen to another port than 5000
+
 2.2 call the service
 
 `curl localhost:5000/process?input_path=/path/to/my/image.jpg`
 
+or for many images at once (results are returned in the same order):
+
+`curl -X POST -H 'Content-Type: application/json' -d '{"input_paths": ["/path/to/a.jpg", "/path/to/b.jpg"]}' localhost:5000/process_batch`
+
+{
+    "error": "",
+    "result": [
+        {"error": "", "result": "MS"},
+        {"error": "", "result": "CS"}
+    ]
+}
+
 2.3 stop the service
 
 `curl localhost:5000/stop`
 
+3. Compare the scales predicted by the optimised engine (see `engine` parameter)
+with those of the original model, over all the frames under a folder:
+
+`python processor.py parity /path/to/a/collection`
+
 In all cases responses are in json:
 
 on success:
@@ -50,6 +101,27 @@ on failure:
 
 '''
 
+class FramesDataset(Dataset):
+    '''Decodes and transforms the frames for the model.
+    A frame which can't be read is replaced by a blank tensor and an error message.'''
+
+    def __init__(self, image_paths):
+        self.image_paths = image_paths
+
+    def __len__(self):
+        return len(self.image_paths)
+
+    def __getitem__(self, index):
+        error = ''
+        try:
+            with Image.open(self.image_paths[index]) as frame:
+                image = DATA_TRANSFORMATION(frame.convert('RGB'))
+        except Exception as e:
+            image = torch.zeros([3] + IMAGE_SIZE)
+            error = f'{type(e)}: {str(e)}'
+        return image, error
+
+
 class ScaleDetector: 
     '''Shot scale classification from frames based on //github.com/sssabet/Shot_Type_Classification
     
@@ -66,53 +138,148 @@ class ScaleDetector:
         self.device = 'cuda' if torch.cuda.is_available() else 'cpu'
 
         self.model = torch.load(
-            '/models/Pytorch_Classification_50ep.pt',
+            MODEL_PATH,
             map_location=torch.device(self.device),
             weights_only=False
         )
+        # inference mode: batch norm uses its running statistics and dropout is off,
+        # so the scale of a frame doesn't depend on the other frames of its batch
+        self.model.eval()
+
+        # kept for all the requests, so no worker is started per request
+        self.decoder = ThreadPoolExecutor(max_workers=DECODING_WORKERS)
+        # the service handles requests in parallel threads but the model isn't thread-safe,
+        # so the decoding of the frames of a request overlaps the inference of another one,
+        # but two inferences never run at the same time
+        self.lock = threading.Lock()
+
+        # the original model, always available for comparison
+        self.eager_model = self.model
+        self.engine = 'eager'
+        self._load_engine()
+
+    def _load_engine(self):
+        '''Replaces the model by an optimised version according to the parameters:
+        engine: eager (the original model) or torchscript (traced and frozen graph);
+        quantize: 1 to quantise the weights of the linear layers to int8 (CPU only).
+        The optimised model is cached under ENGINE_CACHE_PATH.
+        Falls back to the original model if it can't be built 
+        or if its predictions differ from those of the original model.'''
+        engine = PARAMS.get('engine', 'eager') or 'eager'
+        if engine == 'eager':
+            return
+
+        quantize = bool(PARAMS.get('quantize', 0)) and self.device == 'cpu'
+        name = f'{engine}{"-int8" if quantize else ""}'
+
+        try:
+            if engine != 'torchscript':
+                raise ValueError(f'unsupported engine "{engine}", please use "eager" or "torchscript"')
+
+            stat = MODEL_PATH.stat()
+            cache_path = ENGINE_CACHE_PATH / f'{name}-{self.device}-torch{torch.__version__}-{stat.st_size}-{int(stat.st_mtime)}.pt'
+
+            if cache_path.exists():
+                model = torch.jit.load(str(cache_path), map_location=torch.device(self.device))
+            else:
+                model = self.eager_model
+                if quantize:
+                    model = torch.ao.quantization.quantize_dynamic(copy.deepcopy(model), {torch.nn.Linear}, dtype=torch.qint8)
+                with torch.no_grad():
+                    model = torch.jit.trace(model, torch.zeros([1, 3] + IMAGE_SIZE, device=self.device))
+                model = torch.jit.freeze(model)
+
+            agreement = self._get_agreement(model)
+            if agreement < PARITY_MIN_AGREEMENT:
+                raise ValueError(f'predictions differ from the original model (agreement: {agreement:.3f})')
+
+            if not cache_path.exists():
+                ENGINE_CACHE_PATH.mkdir(parents=True, exist_ok=True)
+                tmp_path = cache_path.with_name(cache_path.name + '.tmp')
+                torch.jit.save(model, str(tmp_path))
+                os.replace(tmp_path, cache_path)
+
+            self.model = model
+            self.engine = name
+        except Exception as e:
+            print(f'WARNING: engine {name} not available, using the original model ({type(e).__name__}: {e})', file=sys.stderr)
+
+    def _get_agreement(self, model) -> float:
+        '''Returns the proportion of random inputs with the same prediction 
+        from the original model and another model.'''
+        generator = torch.Generator().manual_seed(1)
+        images = torch.randn([PARITY_SAMPLE_SIZE, 3] + IMAGE_SIZE, generator=generator).to(self.device)
+        with torch.no_grad():
+            expected = torch.argmax(self.eager_model(images), 1)
+            predicted = torch.argmax(model(images), 1)
+        return (expected == predicted).float().mean().item()
 
     def classify(self, image_path):
         '''Returns the shot scale classification of the image as a string:
         ECS, CS, MS, FS or LS
         '''
-        ret = ''
-        image_path = Path(image_path)
-        frame = Image.open(image_path)
-
-        IMAGE_SIZE = [128, 128]
-
-        data_transformation = transforms.Compose(
-            [
-                transforms.ToTensor(),
-                transforms.Resize(IMAGE_SIZE),
-                transforms.Normalize([0.485, 0.456, 0.406],[0.229, 0.224, 0.225])
-            ]
-        )
-        images = data_transformation(frame)
+        response = self.classify_batch([image_path])[0]
+        if response['error']:
+            raise Exception(response['error'])
 
+        return response['result']
+
+    def classify_batch(self, image_paths, model=None):
+        '''Returns one response (error & result) per image, in the same order.
+        The model classifies the frames by batches of up to BATCH_SIZE,
+        while DECODING_WORKERS threads decode the next batch.'''
+        ret = []
+
+        model = model or self.model
+
+        dataset = FramesDataset([str(p) for p in image_paths])
+        batches = [
+            range(start, min(start + BATCH_SIZE, len(dataset)))
+            for start in range(0, len(dataset), BATCH_SIZE)
+        ]
+
+        next_batch = self.decoder.map(dataset.__getitem__, batches[0]) if batches else None
         with torch.no_grad():
-            n_correct=0
-            n_samples=0
-            #images=images.to(device)
-            pred = self.model(images.view([1, 3, 128, 128]).to(self.device))
-            _, res = torch.max(pred,1)
-            
-
-        if res.item()==0:
-            p='CS'
-        elif res.item()==1:
-            p='ECS'
-        elif res.item()==2:
-            p='FS'
-        elif res.item()==3:
-            p='LS'
-        else:
-            p='MS'
-
-        # if p!=1:
-        #     print(f'The Model predicts that it is a {p}')
-
-        return p
+            for i in range(len(batches)):
+                batch = list(next_batch)
+                if i + 1 < len(batches):
+                    # decoded while the model classifies the current batch
+                    next_batch = self.decoder.map(dataset.__getitem__, batches[i + 1])
+                images = torch.stack([image for image, error in batch])
+                errors = [error for image, error in batch]
+                with self.lock:
+                    pred = model(images.to(self.device))
+                _, res = torch.max(pred, 1)
+                for error, index in zip(errors, res.tolist()):
+                    ret.append({
+                        'error': error,
+                        'result': '' if error else SCALES[min(index, len(SCALES) - 1)],
+                    })
+
+        return ret
+
+    def check_parity(self, folder_path):
+        '''Compares the scales predicted by the current engine and by the original model
+        for all the frames under a folder.'''
+        image_paths = sorted(str(p) for p in Path(folder_path).glob('**/*.jpg'))
+
+        expected = self.classify_batch(image_paths, self.eager_model)
+        predicted = self.classify_batch(image_paths)
+
+        frames = [
+            [image_path, e['result'], p['result']]
+            for image_path, e, p in zip(image_paths, expected, predicted)
+            if not (e['error'] or p['error'])
+        ]
+        differences = [frame for frame in frames if frame[1] != frame[2]]
+
+        return {
+            'engine': self.engine,
+            'frames': len(frames),
+            'agreement': (1 - len(differences) / len(frames)) if frames else None,
+            # [frame, original scale, engine scale]
+            'differences': differences,
+        }
 
 
 if __name__ == '__main__':
@@ -150,13 +317,36 @@ if __name__ == '__main__':
                 
                 return jsonify(response)
 
+            @app.route('/process_batch', methods=['POST'])
+            def process_batch():
+                image_paths = (request.get_json(silent=True) or {}).get('input_paths', None)
+
+                if image_paths:
+                    response = {
+                        'error': '',
+                        'result': detector.classify_batch(image_paths),
+                    }
+                else:
+                    response = {
+                        'error': 'input images not provided',
+                        'result': [],
+                    }
+
+                return jsonify(response)
+
             @app.route('/stop', methods=['GET'])
             def stop():
                 # yes... Flask does NOT have a shutdown function.
                 import signal, os
                 os.kill(os.getpid(), signal.SIGINT)
 
-            app.run(debug=True, host='0.0.0.0', port=PORT)
+            # e.g. serve 5001, when another service already listens on the default port
+            app.run(debug=True, host='0.0.0.0', port=int(arguments[2]) if len(arguments) > 2 else PORT)
+        elif first_arg == 'parity':
+            response = {
+                'error': '',
+                'result': detector.check_parity(arguments[2] if len(arguments) > 2 else '/data'),
+            }
         else:    
             image_path = first_arg
 
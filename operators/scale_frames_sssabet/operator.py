@@ -19,3 +19,8 @@ class ScaleFramesSSSabet(ScaleFrames):
         # TODO: error management
         response = self._call_service_processor(frame_file_path, collection_path)
         return response['result']
+
+    def _recognise_frames_scale(self, frame_file_paths: [Path], collection_path: Path) -> list:
+        # one request per batch of frames rather than per frame
+        responses = self._call_service_processor_batch(frame_file_paths, collection_path)
+        return [response['result'] for response in responses]
@@ -0,0 +1,183 @@
+import json
+import os
+from pathlib import Path
+import numpy as np
+
+
+class IVFIndex:
+    '''Approximate nearest neighbour index (inverted file)
+    over the vectors of an embedding store, by cosine similarity.
+
+    The vectors are clustered with k-means into `n_lists` lists.
+    A query is only compared with the vectors of the `nprobe` lists
+    which centroids are the closest to the query,
+    rather than with all the vectors.
+
+    The index is a folder with:
+    * meta.json: model, dimension, number of lists, version of the store;
+    * centroids.npy: float32 matrix (n_lists x dimension);
+    * offsets.npy: start of each list in vectors.npy (n_lists + 1);
+    * vectors.npy: normalised float16 vectors, ordered by list, memory-mapped when queried;
+    * keys.txt: key of each vector in vectors.npy, one per line.
+    '''
+
+    KMEANS_ITERATIONS = 20
+    # maximum number of vectors used to train the centroids
+    KMEANS_SAMPLE_SIZE = 100000
+    MAX_LISTS = 4096
+
+    def __init__(self, folder_path: Path):
+        self.folder_path = Path(folder_path)
+        self.meta = {}
+        self.centroids = None
+        self.offsets = None
+        self.vectors = None
+        self.keys = None
+
+        meta_path = self.folder_path / 'meta.json'
+        if meta_path.exists():
+            self.meta = json.loads(meta_path.read_text())
+
+    def is_up_to_date(self, store) -> bool:
+        '''True if the index was built from the current content of the store.
+        The store is append-only, so its number of rows identifies its version.'''
+        return (
+            self.meta.get('store_row_count', None) == store.row_count
+            and self.meta.get('model', None) == store.model
+        )
+
+    def build(self, store, n_lists=0, seed=1):
+        '''(Re)builds the index from the current vectors of an embedding store.
+        n_lists: number of lists, 0 for about the square root of the number of vectors.'''
+        index = store.get_index()
+        keys = sorted(index.keys())
+        rows = np.array([index[key] for key in keys], dtype=np.int64)
+
+        dimension = store.dimension or 0
+        vectors = np.zeros((0, dimension), dtype=np.float32)
+        if len(keys):
+            vectors = self._normalise(np.asarray(store.get_matrix()[rows], dtype=np.float32))
+
+        if not n_lists:
+            n_lists = int(np.sqrt(len(keys)))
+        n_lists = max(1, min(int(n_lists), self.MAX_LISTS, len(keys) or 1))
+
+        centroids = self._train_centroids(vectors, n_lists, seed)
+        assignments = self._assign(vectors, centroids)
+
+        order = np.argsort(assignments, kind='stable')
+        counts = np.bincount(assignments, minlength=n_lists)
+        offsets = np.concatenate([[0], np.cumsum(counts)]).astype(np.int64)
+
+        self.folder_path.mkdir(parents=True, exist_ok=True)
+        # each file is written next to its final path, then renamed,
+        # so a query never reads a partially written file.
+        files = {
+            'centroids.npy': lambda fh: np.save(fh, centroids.astype(np.float32)),
+            'offsets.npy': lambda fh: np.save(fh, offsets),
+            'vectors.npy': lambda fh: np.save(fh, vectors[order].astype(np.float16)),
+            'keys.txt': lambda fh: fh.write(''.join(keys[i] + '\n' for i in order).encode('utf-8')),
+        }
+        for name, write in files.items():
+            tmp_path = self.folder_path / f'{name}.tmp'
+            with open(tmp_path, 'wb') as fh:
+                write(fh)
+            os.replace(tmp_path, self.folder_path / name)
+
+        self.meta = {
+            'model': store.model,
+            'dimension': dimension,
+            'n_lists': n_lists,
+            'size': len(keys),
+            'store_row_count': store.row_count,
+        }
+        (self.folder_path / 'meta.json').write_text(json.dumps(self.meta, indent=2))
+
+        # loaded again by the next search
+        self.centroids = None
+
+    def search(self, query, top_k=10, nprobe=8) -> [list]:
+        '''Returns up to top_k [key, score] for the closest vectors to the query,
+        from the best to the worst score (cosine similarity).'''
+        ret = []
+
+        self._load()
+        if not len(self.keys):
+            return ret
+
+        query = self._normalise(np.asarray(query, dtype=np.float32).reshape(1, -1))[0]
+
+        nprobe = max(1, min(int(nprobe), len(self.centroids)))
+        list_ids = np.argsort(-(self.centroids @ query))[:nprobe]
+
+        positions = []
+        scores = []
+        for list_id in list_ids:
+            start, end = self.offsets[list_id], self.offsets[list_id + 1]
+            if start == end:
+                continue
+            positions.append(np.arange(start, end))
+            scores.append(self.vectors[start:end].astype(np.float32) @ query)
+
+        if not scores:
+            return ret
+
+        positions = np.concatenate(positions)
+        scores = np.concatenate(scores)
+
+        top_k = min(int(top_k), len(scores))
+        best = np.argpartition(-scores, top_k - 1)[:top_k]
+        best = best[np.argsort(-scores[best])]
+
+        ret = [
+            [self.keys[positions[i]], float(scores[i])]
+            for i in best
+        ]
+
+        return ret
+
+    def _load(self):
+        if self.centroids is not None:
+            return
+        self.centroids = np.load(self.folder_path / 'centroids.npy')
+        self.offsets = np.load(self.folder_path / 'offsets.npy')
+        self.vectors = np.load(self.folder_path / 'vectors.npy', mmap_mode='r')
+        self.keys = (self.folder_path / 'keys.txt').read_text(encoding='utf-8').splitlines()
+
+    def _train_centroids(self, vectors, n_lists, seed):
+        '''Spherical k-means over a sample of the vectors.'''
+        generator = np.random.default_rng(seed)
+
+        if not len(vectors):
+            return np.zeros((1, vectors.shape[1]), dtype=np.float32)
+
+        sample = vectors
+        if len(vectors) > self.KMEANS_SAMPLE_SIZE:
+            sample = vectors[generator.choice(len(vectors), self.KMEANS_SAMPLE_SIZE, replace=False)]
+
+        ret = sample[generator.choice(len(sample), n_lists, replace=False)].copy()
+
+        for i in range(self.KMEANS_ITERATIONS):
+            assignments = self._assign(sample, ret)
+            sums = np.zeros_like(ret)
+            np.add.at(sums, assignments, sample)
+            counts = np.bincount(assignments, minlength=n_lists)
+            empty = counts == 0
+            if empty.any():
+                # restart empty lists from random vectors
+                sums[empty] = sample[generator.choice(len(sample), int(empty.sum()))]
+            ret = self._normalise(sums)
+
+        return ret
+
+    def _assign(self, vectors, centroids, chunk_size=65536):
+        '''Returns the index of the closest centroid to each vector.'''
+        ret = np.zeros(len(vectors), dtype=np.int64)
+        for start in range(0, len(vectors), chunk_size):
+            ret[start:start + chunk_size] = np.argmax(vectors[start:start + chunk_size] @ centroids.T, axis=1)
+        return ret
+
+    def _normalise(self, vectors):
+        norms = np.linalg.norm(vectors, axis=1, keepdims=True)
+        norms[norms == 0] = 1
+        return vectors / norms
@@ -0,0 +1,122 @@
+from pathlib import Path
+from ..base.operator import Operator
+import shutil
+import time
+
+IMAGE_EXTENSIONS = ['.jpg', '.jpeg', '.png']
+
+
+class SearchFrames(Operator):
+    '''Search the frames closest to a text or an image, using their embeddings'''
+
+    def get_supported_arguments(self):
+        ret = super().get_supported_arguments()
+        ret['redo'] = True
+        return ret
+
+    def _before_apply(self):
+        super()._before_apply()
+        # the query is encoded by the service of the embedding operator,
+        # with the same model as the frames.
+        self.encoder = None
+        if self.get_param('query'):
+            self.encoder = self._get_encoder()
+            self.encoder._before_apply()
+
+    def _after_apply(self):
+        if getattr(self, 'encoder', None):
+            self.encoder._after_apply()
+        super()._after_apply()
+
+    def _apply(self):
+        ret = None
+
+        # one index per collection, (re)built if the embeddings have changed
+        indices = []
+        for col in self.context['collections']:
+            index = self._get_index(col)
+            if index:
+                indices.append([col, index])
+
+        query = self.get_param('query')
+        if not query:
+            self._log('Indices are up to date. Set the `query` parameter to search.')
+            return ret
+
+        if not indices:
+            self._error('No frame embeddings found, please run embed_frames_transformers first.')
+
+        query_vector = self._encode_query(query, indices[0][0]['attributes']['path'])
+
+        t0 = time.time()
+        results = []
+        for col, index in indices:
+            for key, score in index.search(query_vector, self.get_param('top_k'), self.get_param('nprobe')):
+                results.append([score, col, key])
+        results = sorted(results, key=lambda r: -r[0])[:int(self.get_param('top_k'))]
+        self._debug(f'searched in {(time.time() - t0) * 1000:.1f} ms')
+
+        self._log(f'Top {len(results)} frames for "{query}":')
+        for score, col, key in results:
+            self._log(f'  {score:.3f}  {col["attributes"]["path"] / key}')
+
+        return ret
+
+    def _get_index(self, collection):
+        ret = None
+
+        # numpy is only needed by this operator
+        from .index import IVFIndex
+
+        collection_path = collection['attributes']['path']
+        model = self._get_model()
+        store = self._get_embedding_store(collection_path, model)
+        if not len(store):
+            return ret
+
+        ret = IVFIndex(self._get_collection_data_folder_path(collection_path) / 'search' / self._sluggify(model))
+        if self._is_redo() or not ret.is_up_to_date(store):
+            self._log(f'Building search index over {len(store)} frames of collection {collection["id"]}')
+            t0 = time.time()
+            ret.build(store, self.get_param('n_lists'))
+            self._log(f'Index built in {time.time() - t0:.1f} s. ({ret.meta["n_lists"]} lists)')
+
+        return ret
+
+    def _get_model(self):
+        '''Returns the model used by embed_frames_transformers.'''
+        encoder = getattr(self, 'encoder', None)
+        if encoder is None:
+            # no query, only the parameters of the encoder are needed
+            encoder = self._get_encoder()
+            encoder._load_parameters()
+        return encoder.get_param('model')
+
+    def _get_encoder(self) -> Operator:
+        # imported here so the operators list doesn't mistake it for this operator
+        from ..embed_frames_transformers.operator import EmbedFramesTransformers
+
+        ret = EmbedFramesTransformers()
+        ret.set_context(self.context)
+        return ret
+
+    def _encode_query(self, query: str, collection_path: Path):
+        '''Returns the vector of a text or image query.'''
+        ret = None
+
+        query_path = Path(query).expanduser()
+        if query_path.suffix.lower() in IMAGE_EXTENSIONS and query_path.is_file():
+            query_path = query_path.absolute().resolve()
+            if not query_path.is_relative_to(collection_path):
+                # the service can only read files under the collection
+                copy_path = self._get_collection_data_folder_path(collection_path) / 'search' / 'queries' / query_path.name
+                copy_path.parent.mkdir(parents=True, exist_ok=True)
+                shutil.copyfile(query_path, copy_path)
+                query_path = copy_path
+            response = self.encoder._call_service_processor(query_path, collection_path)
+        else:
+            response = self.encoder._call_service_processor(None, collection_path, input_text=query)
+
+        ret = self._parse_dirty_json(response['result'])
+
+        return ret
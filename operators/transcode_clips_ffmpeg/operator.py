@@ -13,22 +13,29 @@ class TranscodeClipsFFMPEG(Operator):
         ret = super().get_supported_arguments()
         ret['redo'] = True
         ret['filter'] = True
+        ret['jobs'] = True
         return ret
 
+    def _use_worker_container(self):
+        return True
+
     def _apply(self):
         ret = None
 
+        work_units = []
         for col in self.context['collections']:
-            for video_folder_path in col['attributes']['path'].iterdir():
-                if video_folder_path.is_dir():
-                    for clip_folder_path in video_folder_path.iterdir():
-                        if clip_folder_path.is_dir():
-                            clip_path = self._get_video_file_path(clip_folder_path)
-                            if clip_path:
-                                self._transcode_clip(clip_path)
+            for clip_folder_path in self._get_clip_folder_paths(col):
+                clip_path = self._get_video_file_path(clip_folder_path)
+                if clip_path:
+                    work_units.append([self._transcode_clip, [clip_path]])
+
+        self._run_work_units(work_units)
 
         return ret
 
+    def _process_clip(self, clip_path: Path, collection_path: Path):
+        self._transcode_clip(clip_path)
+
     def _transcode_clip(self, clip_path: Path):
         if not self._is_path_selected(clip_path):
             return
@@ -38,7 +45,7 @@ class TranscodeClipsFFMPEG(Operator):
         output_extension = re.sub(r'^.*?(\.[^.]+)$', r'\1', command_str)
         transcoded_path = Path(str(clip_path.with_suffix('')) + output_extension)
 
-        if self._is_redo() or not transcoded_path.exists():
+        if self._needs_update(transcoded_path, [clip_path]):
             self._log(transcoded_path)
             command = re.split(r'\s+', command_str)
             def replace(p):
@@ -54,4 +61,8 @@ class TranscodeClipsFFMPEG(Operator):
                 for p 
                 in command
             ]
+            if transcoded_path.exists():
+                # the command may not overwrite an existing output
+                transcoded_path.unlink()
             self._run_in_operator_container(command, [clip_path.parent, '/data'], same_user=True)
+            self._record_provenance(transcoded_path, [clip_path])
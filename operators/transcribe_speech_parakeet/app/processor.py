@@ -5,10 +5,21 @@ import json
 from flask import Flask, request, jsonify
 import signal
 import os
+import wave
+import threading
 
 PARAMS = json.loads(Path('/app/params.json').read_text())
 
 PORT = 5000
+# sampling rate expected by the model
+SAMPLE_RATE = 16000
+# length (in seconds) of the windows of a stream, 
+# each window is transcribed as soon as it has been received
+STREAM_WINDOW_SECONDS = 60
+# a window is cut at the quietest moment of its last seconds, rather than in the middle of a word
+STREAM_CUT_SEARCH_SECONDS = 5
+# size (in bytes) of the reads from a stream
+STREAM_READ_SIZE = 64 * 1024
 # https://huggingface.co/nvidia/parakeet-tdt-0.6b-v3
 # MODEL = "nvidia/parakeet-tdt-0.6b-v3"
 MODEL = PARAMS['model']
@@ -26,10 +37,20 @@ Usage:
 
 `python processor.py serve`
 
+or `python processor.py serve 5001` to listen to another port than 5000
+
 2.2 call the service
 
 `curl localhost:5000/process?input_path=/path/to/my/sound.wav`
 
+or for many sound files at once (results are returned in the same order):
+
+`curl -X POST -H 'Content-Type: application/json' -d '{"input_paths": ["/path/to/a.wav", "/path/to/b.wav"]}' localhost:5000/process_batch`
+
+or for raw sound samples (16kHz, mono, 16-bit little-endian), e.g. piped from ffmpeg:
+
+`ffmpeg -i clip.mp4 -vn -ar 16000 -ac 1 -f s16le - | curl -X POST -H 'Transfer-Encoding: chunked' --data-binary @- 'localhost:5000/process_stream?sample_rate=16000'`
+
 2.3 stop the service
 
 `curl localhost:5000/stop`
@@ -77,16 +98,158 @@ class Transcriber:
         )
         # use local attention to avoid OOM errors on long-form audio
         self.model.change_attention_model(self_attention_model="rel_pos_local_attn", att_context_size=[256, 256])
+        # duration (in seconds) of an encoder frame, the unit of the segment offsets
+        self.time_stride = self.model.cfg.preprocessor.get('window_stride', 0.01) * getattr(self.model.encoder, 'subsampling_factor', 8)
+        # the service handles requests in parallel threads but the model isn't thread-safe,
+        # so only the reception and preparation of the sounds overlap, not the inference
+        self.lock = threading.Lock()
 
     def transcribe(self, sound_path):
         sound_path = Path(sound_path)
 
-        output = self.model.transcribe([str(sound_path)], timestamps=True)
+        with self.lock:
+            output = self.model.transcribe([str(sound_path)], timestamps=True)
         
         segment_timestamps = output[0].timestamp['segment']
 
         return segment_timestamps
 
+    def transcribe_samples(self, data: bytes, sample_rate=SAMPLE_RATE, start=0):
+        '''Transcribes raw sound samples (mono, 16-bit little-endian).
+        start: time (in seconds) of the first sample, added to the segment timestamps.'''
+        import numpy as np
+
+        if sample_rate != SAMPLE_RATE:
+            raise ValueError(f'unsupported sample rate {sample_rate}, expected {SAMPLE_RATE}')
+
+        audio = np.frombuffer(data[:len(data) - len(data) % 2], dtype='<i2').astype(np.float32) / 32768
+
+        with self.lock:
+            output = self.model.transcribe([audio], timestamps=True)
+
+        segment_timestamps = output[0].timestamp['segment']
+
+        if start:
+            frame_offset = int(round(start / self.time_stride))
+            for segment in segment_timestamps:
+                segment['start'] += start
+                segment['end'] += start
+                segment['start_offset'] += frame_offset
+                segment['end_offset'] += frame_offset
+
+        return segment_timestamps
+
+    def transcribe_stream(self, stream, sample_rate=SAMPLE_RATE):
+        '''Transcribes raw sound samples (mono, 16-bit little-endian) read from a stream.
+        The samples are transcribed by windows of about STREAM_WINDOW_SECONDS, 
+        each as soon as it has been received, 
+        so the transcription overlaps the decoding of the sound by the sender
+        and only one window is held in memory.
+        Returns None if the stream is empty.'''
+        ret = None
+
+        window_size = STREAM_WINDOW_SECONDS * sample_rate * 2
+        buffer = bytearray()
+        # time of the first sample in the buffer, in seconds
+        start = 0
+
+        while True:
+            chunk = stream.read(STREAM_READ_SIZE)
+            buffer += chunk
+            if ret is None and buffer:
+                ret = []
+
+            while len(buffer) >= window_size or (not chunk and len(buffer) > 1):
+                if chunk:
+                    cut = get_quiet_cut(bytes(buffer[:window_size]), sample_rate)
+                else:
+                    # end of the stream, the rest is the last window
+                    cut = len(buffer) - len(buffer) % 2
+                ret += self.transcribe_samples(bytes(buffer[:cut]), sample_rate, start)
+                del buffer[:cut]
+                start += cut / 2 / sample_rate
+
+            if not chunk:
+                break
+
+        return ret
+
+    def transcribe_batch(self, sound_paths):
+        '''Returns one response (error & result) per sound file, in the same order.
+        The files are transcribed by batches of batch_size files of similar durations,
+        so short files are not padded to the length of long ones.
+        If a batch fails (e.g. out of memory), its files are transcribed one by one.'''
+        ret = [None] * len(sound_paths)
+
+        batch_size = max(1, int(PARAMS.get('batch_size', 1) or 1))
+
+        order = sorted(range(len(sound_paths)), key=lambda i: get_sound_duration(sound_paths[i]))
+        for start in range(0, len(order), batch_size):
+            indices = order[start:start + batch_size]
+            try:
+                with self.lock:
+                    outputs = self.model.transcribe(
+                        [str(sound_paths[i]) for i in indices], 
+                        batch_size=len(indices), 
+                        timestamps=True
+                    )
+                for i, output in zip(indices, outputs):
+                    ret[i] = {
+                        'error': '',
+                        'result': output.timestamp['segment'],
+                    }
+            except Exception as e:
+                if len(indices) == 1:
+                    ret[indices[0]] = {
+                        'error': f'{type(e)}: {str(e)}',
+                        'result': [],
+                    }
+                    continue
+                if torch.cuda.is_available():
+                    torch.cuda.empty_cache()
+                for i in indices:
+                    try:
+                        ret[i] = {
+                            'error': '',
+                            'result': self.transcribe(sound_paths[i]),
+                        }
+                    except Exception as e:
+                        ret[i] = {
+                            'error': f'{type(e)}: {str(e)}',
+                            'result': [],
+                        }
+
+        return ret
+
+
+def get_quiet_cut(data: bytes, sample_rate=SAMPLE_RATE) -> int:
+    '''Returns the position (in bytes) of the quietest 100 ms 
+    in the last STREAM_CUT_SEARCH_SECONDS of raw sound samples (mono, 16-bit little-endian).'''
+    import numpy as np
+
+    frame_length = sample_rate // 10
+    samples = np.frombuffer(data[:len(data) - len(data) % 2], dtype='<i2').astype(np.float32)
+    search_start = max(0, len(samples) - STREAM_CUT_SEARCH_SECONDS * sample_rate)
+    frame_count = (len(samples) - search_start) // frame_length
+    if frame_count < 1:
+        return len(samples) * 2
+
+    frames = samples[search_start:search_start + frame_count * frame_length].reshape(frame_count, frame_length)
+    quietest = int(np.argmin((frames ** 2).mean(axis=1)))
+
+    return (search_start + quietest * frame_length + frame_length // 2) * 2
+
+
+def get_sound_duration(sound_path):
+    '''Returns the duration of a wav file in seconds, from its header, 0 if unknown.'''
+    ret = 0
+    try:
+        with wave.open(str(sound_path), 'rb') as sound:
+            ret = sound.getnframes() / sound.getframerate()
+    except (wave.Error, EOFError, OSError, ZeroDivisionError):
+        pass
+    return ret
+
 
 if __name__ == '__main__':
     response = {
@@ -123,12 +286,55 @@ if __name__ == '__main__':
                 
                 return jsonify(response)
 
+            @app.route('/process_batch', methods=['POST'])
+            def transcribe_batch():
+                sound_paths = (request.get_json(silent=True) or {}).get('input_paths', None)
+
+                if sound_paths:
+                    response = {
+                        'error': '',
+                        'result': transcriber.transcribe_batch(sound_paths),
+                    }
+                else:
+                    response = {
+                        'error': 'input sounds not provided',
+                        'result': [],
+                    }
+
+                return jsonify(response)
+
+            @app.route('/process_stream', methods=['POST'])
+            def transcribe_stream():
+                sample_rate = int(request.args.get('sample_rate', SAMPLE_RATE))
+
+                try:
+                    # the body is transcribed while it is received, until the end of the (chunked) stream
+                    res = transcriber.transcribe_stream(request.stream, sample_rate)
+                    if res is None:
+                        response = {
+                            'error': 'input sound not provided',
+                            'result': [],
+                        }
+                    else:
+                        response = {
+                            'error': '',
+                            'result': res,
+                        }
+                except Exception as e:
+                    response = {
+                        'error': f'{type(e)}: {str(e)}',
+                        'result': [],
+                    }
+
+                return jsonify(response)
+
             @app.route('/stop', methods=['GET'])
             def stop():
                 # yes... Flask does NOT have a shutdown function.
                 os.kill(os.getpid(), signal.SIGINT)
 
-            app.run(debug=True, host='0.0.0.0', port=PORT)
+            # e.g. serve 5001, when another service already listens on the default port
+            app.run(debug=True, host='0.0.0.0', port=int(arguments[2]) if len(arguments) > 2 else PORT)
         elif first_arg == 'load_model':
             response = {
                 'error': '',
@@ -1,9 +1,15 @@
 from pathlib import Path
 from ..base.operator import Operator
 import json
+import wave
 
 # https://huggingface.co/nvidia/parakeet-tdt-0.6b-v2
 
+# sampling rate expected by the model
+SAMPLE_RATE = 16000
+# bytes of 16-bit mono samples sent in each chunk of a stream (about 2 seconds)
+STREAM_CHUNK_SIZE = SAMPLE_RATE * 2 * 2
+
 class TranscribeSpeechParakeet(Operator):
     '''Transcribe speech from sound files into json files'''
 
@@ -18,30 +24,122 @@ class TranscribeSpeechParakeet(Operator):
 
         for col in self.context['collections']:
             collection_path = col['attributes']['path']
-            for video_folder_path in col['attributes']['path'].iterdir():
-                if video_folder_path.is_dir():
-                    for clip_folder_path in video_folder_path.iterdir():
-                        if clip_folder_path.is_dir():
-                            clip_path = self._get_video_file_path(clip_folder_path)
-                            if clip_path:
-                                self._transcribe(clip_path, collection_path)
+            clip_paths = []
+            for clip_folder_path in self._get_clip_folder_paths(col):
+                clip_path = self._get_video_file_path(clip_folder_path)
+                if clip_path:
+                    clip_paths.append(clip_path)
+
+            if self._get_input() == 'stream':
+                for clip_path in clip_paths:
+                    self._transcribe_stream(clip_path, collection_path)
+            else:
+                # all the sounds of the collection, so they can be batched by duration
+                sound_paths = [
+                    sound_path
+                    for sound_path in [self._get_pending_sound_path(clip_path) for clip_path in clip_paths]
+                    if sound_path
+                ]
+                self._transcribe_sounds(sound_paths, collection_path)
 
         return ret
 
+    def _process_clip(self, clip_path: Path, collection_path: Path):
+        self._transcribe(clip_path, collection_path)
+
     def _transcribe(self, clip_path: Path, collection_path: Path):
+        if self._get_input() == 'stream':
+            self._transcribe_stream(clip_path, collection_path)
+            return
+
+        sound_path = self._get_pending_sound_path(clip_path)
+        if sound_path:
+            self._transcribe_sounds([sound_path], collection_path)
+
+    def _get_pending_sound_path(self, clip_path: Path):
+        '''Returns the path of the sound file of a clip
+        if its transcription needs to be (re)done, None otherwise.'''
+        ret = None
+
         sound_path = clip_path.with_suffix('.wav')
 
         if not self._is_path_selected(sound_path):
-            return
+            return ret
 
         if not sound_path.exists():
             self._warn(f'Input transcription not found: {sound_path}')
+            return ret
+
+        transcription_path = clip_path.parent / 'transcription.json'
+
+        if self._needs_update(transcription_path, [sound_path]):
+            ret = sound_path
+
+        return ret
+
+    def _transcribe_sounds(self, sound_paths: [Path], collection_path: Path):
+        '''Transcribes sound files by batches of `batch_size` files.
+        The files are sorted by duration, 
+        so each batch has files of similar durations, 
+        which limits the padding the model has to process.'''
+        sound_paths = sorted(sound_paths, key=self._get_sound_duration)
+
+        # the transcriptions are written after each group of requests
+        batch_size = int(self.get_param('batch_size') or 1)
+        group_size = batch_size * self._get_service_concurrency()
+        for i in range(0, len(sound_paths), group_size):
+            group = sound_paths[i:i + group_size]
+            responses = self._call_service_processor_batch(group, collection_path)
+            for sound_path, response in zip(group, responses):
+                transcription_path = sound_path.parent / 'transcription.json'
+                transcription_path.write_text(json.dumps(response['result'], indent=2))
+                self._record_provenance(transcription_path, [sound_path])
+
+    def _get_sound_duration(self, sound_path: Path) -> float:
+        '''Returns the duration of a wav file in seconds, from its header.'''
+        ret = 0
+
+        try:
+            with wave.open(str(sound_path), 'rb') as sound:
+                ret = sound.getnframes() / sound.getframerate()
+        except (wave.Error, EOFError, OSError, ZeroDivisionError):
+            pass
+
+        return ret
+
+
+    def _transcribe_stream(self, clip_path: Path, collection_path: Path):
+        '''Transcribes the sound of a clip without sound file:
+        ffmpeg decodes the sound of the clip into raw samples 
+        which are streamed to the service as they are decoded.'''
+        if not self._is_path_selected(clip_path):
             return
 
         transcription_path = clip_path.parent / 'transcription.json'
 
-        if self._is_redo() or not transcription_path.exists():
-            # self._log(transcription_path)
-            response = self._call_service_processor(sound_path, collection_path)
+        if self._needs_update(transcription_path, [clip_path]):
+            command_args = [
+                'ffmpeg',
+                '-loglevel', 'error',
+                '-i', clip_path,
+                '-vn', '-sn',
+                '-ar', str(SAMPLE_RATE),
+                '-ac', '1',
+                '-f', 's16le', # raw PCM
+                'pipe:1'
+            ]
+            chunks = self._stream_from_operator_container(command_args, [clip_path.parent, Path('/data')], STREAM_CHUNK_SIZE)
+            response = self._call_service_processor_stream(
+                chunks, 
+                clip_path.relative_to(collection_path), 
+                collection_path, 
+                {'sample_rate': SAMPLE_RATE}
+            )
             transcription_path.write_text(json.dumps(response['result'], indent=2))
+            self._record_provenance(transcription_path, [clip_path])
 
+    def _get_input(self):
+        ret = self.get_param('input') or 'wav'
+        if ret not in ['wav', 'stream']:
+            self._error(f'Unsupported value for `input` parameter: "{ret}". Please use "wav" or "stream".')
+        return ret